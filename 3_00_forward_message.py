@@ -1,6 +1,8 @@
 import asyncio
-from telethon.sync import TelegramClient, events
-from datetime import datetime, timedelta
+from broker_client import session_client
+from forward_routes import FORWARD
+from forwarder import Forwarder, Route
+import metrics
 
 api_id = "27647645"
 api_hash = "2cdcf90271ae9b647a9561f5f2b0aade"
@@ -8,18 +10,18 @@ api_hash = "2cdcf90271ae9b647a9561f5f2b0aade"
 source_channel = "t.me/MarketPrimeDaily"
 target_channel = ["Trade_Proooo", "CliffCapital", "AlphaInvest0", "tradesavvy999","FinFlex0", "t.me/+M4WgsaOvIYExMWE1","t.me/+rD5KolqapallNmRl","t.me/+H-YpbIqETXEyYTc1"]
 
-client = TelegramClient("session_name",api_id, api_hash)
+# Refuses to start while broker.py holds the session
+client = session_client("session_name",api_id, api_hash)
+metrics.install()
 
-@client.on(events.NewMessage(chats=source_channel))
-async def forward_message(event):
-    try:
-        
-        for accounts in target_channel:
-            await client.forward_messages(accounts, event.message)
+# Targets are forwarded to in parallel, each one keeps the source order and
+# albums go out in one request. Posts missed while this script was down are
+# forwarded first on startup, and failed forwards are retried from .outbox/.
+forwarder = Forwarder(client, [Route(source_channel, FORWARD, target_channel)], workers=4)
 
-    except Exception as e:
-        print(f'An error occured : {e}')
+async def main():
+    async with client:
+        print("Bot is running.....")
+        await forwarder.run()
 
-print("Bot is running.....")
-with client:
-    client.run_until_disconnected()
\ No newline at end of file
+asyncio.run(main())
\ No newline at end of file
@@ -1,36 +1,37 @@
-import asyncio
-from telethon.sync import TelegramClient
-from datetime import datetime, timedelta
+from broker_client import connect_client
+from fanout import broadcast, print_report
+from outbox import DEFAULT_OUTBOX
+from send_ledger import DEFAULT_LEDGER, job_name
+from scheduler import Job, run_standalone
+import metrics
 
 
 api_id = "27647645"
 api_hash = "2cdcf90271ae9b647a9561f5f2b0aade"
 
-client = TelegramClient("session_name", api_id, api_hash)
-
-accounts_messages = {
+account_messages = {
     't.me/+M4WgsaOvIYExMWE1':'''Hope all booked profits in today's calls , please send your profit screenshots @tony00071''',
     't.me/+rD5KolqapallNmRl':'''Those who booked good profits avoid over trading 
 
 Please share your profits screenshots @premium20245'''}
 
-async def send_scheduled_message():
-        now = datetime.now()
-        target = now.replace(hour=15, minute=27, second=0, microsecond=0)
-
-        if now > target:
-            target += timedelta(days=1)
-    
-        wait_time = (target - now).total_seconds()
-        print(f'Waiting for {wait_time} seconds until {target}')
-
-        await asyncio.sleep(wait_time)
-
-        for accounts, messages in accounts_messages.items():
-              await client.send_message(accounts, messages, link_preview=False)
-
-        await asyncio.sleep(65)
-
-with client:
-      client.loop.run_until_complete(send_scheduled_message())  
-
+JOB_NAME = job_name(__file__)
+SEND_TIME = (15, 27)
+
+async def send_messages(client):
+    results = await broadcast(client, account_messages, link_preview=False,
+                              ledger=DEFAULT_LEDGER, job=JOB_NAME, outbox=DEFAULT_OUTBOX)
+    print_report(results)
+
+async def send_scheduled_message(client):
+    job = Job(JOB_NAME, SEND_TIME, send_messages, None, account_messages,
+              messages=account_messages)
+    # The send ledger, not a sleep, prevents double sending
+    await run_standalone(client, job, DEFAULT_LEDGER, outbox=DEFAULT_OUTBOX)
+
+# Run the script
+if __name__ == "__main__":
+    client = connect_client("session_name", api_id, api_hash)
+    metrics.install()
+    with client:
+        client.loop.run_until_complete(send_scheduled_message(client))
@@ -1,6 +1,8 @@
-import asyncio
-from datetime import datetime, timedelta
-from telethon.sync import TelegramClient
+from broker_client import connect_client
+from fanout import broadcast, print_report
+from outbox import DEFAULT_OUTBOX
+from send_ledger import DEFAULT_LEDGER, job_name
+import metrics
 
 # Your API credentials
 api_id = "27647645"
@@ -12,14 +14,24 @@ account_messages = '''Daily Market Prime Newsletter will be shared here https://
 
 Do join to Stay ahead, trade smarter, and dominate the markets with Market Prime! 🔥'''
 
-# Start Telethon client
-client = TelegramClient("session_name", api_id, api_hash)
+# Start Telethon client (through the session broker when it is running)
+client = connect_client("session_name", api_id, api_hash)
+metrics.install()
+
+JOB_NAME = job_name(__file__)
 
 async def send_scheduled_message():
      # Wait until the scheduled time
         # Send message
-        for destination_channel in target_accounts:
-            await client.send_message(destination_channel, account_messages)
+        # Sends a crashed run logged are resumed, not logged again
+        await DEFAULT_OUTBOX.start(client)
+        try:
+            results = await broadcast(client, account_messages, target_accounts,
+                                      ledger=DEFAULT_LEDGER, job=JOB_NAME, outbox=DEFAULT_OUTBOX)
+            print_report(results)
+            await DEFAULT_OUTBOX.join()
+        finally:
+            await DEFAULT_OUTBOX.stop()
   # Prevent double sending
 
 # Run the script
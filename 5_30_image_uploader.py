@@ -1,12 +1,17 @@
 import asyncio
 from datetime import datetime, timedelta
-from telethon.sync import TelegramClient
 import os
+from broker_client import BrokerClient, connect_client
+from image_prep import prepare_images
+from media_cache import MediaCache
+from outbox import Outbox
+from parallel_transfer import ParallelTransfer
+import metrics
 
 # Your API credentials
 api_id = "27647645"
 api_hash = "2cdcf90271ae9b647a9561f5f2b0aade"
-client = TelegramClient("session_name", api_id, api_hash)
+client = connect_client("session_name", api_id, api_hash)
 # 🔹 List of 5 channel IDs/usernames
 target_accounts = ["tradesavvy999", "Trade_Proooo", "CliffCapital", "AlphaInvest0", "FinFlex0"]
 
@@ -20,26 +25,86 @@ IMAGES = [
     "FinFlex1.jpg","FinFlex2.jpg",
 ]
 
-async def upload_images():
-    async with TelegramClient('session_name', api_id, api_hash) as client:
-        for i, channel in enumerate(target_accounts):
-            try:
-                # Select 2 images per channel
-                image1 = IMAGES[i * 2]
-                image2 = IMAGES[i * 2 + 1]
+# 🔹 Each image is uploaded once and re-sent by reference afterwards;
+#    large files are uploaded over several connections in parallel
+media_cache = MediaCache(transfer=ParallelTransfer())
+
+# 🔹 Every send is logged in .outbox/ first: failures are retried with
+#    backoff (paced by the rate limiter), and a run cut short is resumed
+#    by the next one
+outbox = Outbox(media_cache=media_cache)
+
+# 🔹 With the broker running, it uploads and caches the images itself
+if isinstance(client, BrokerClient):
+    outbox.media_cache = None
+
+# 🔹 Send each channel's images as one album, uploading the next channel's
+#    images while the current album is being sent
+ALBUM_MODE = True
+
+async def report(sends):
+    for channel, futures in sends:
+        try:
+            for future in futures:
+                await future
+            print(f"✅ Successfully uploaded images to {channel}")
 
-                # Upload first image
-                await client.send_file(channel, image1)
-                await asyncio.sleep(2)  # Wait 2 seconds to avoid spam
+        except Exception as e:
+            print(f"❌ Failed to upload images to {channel}: {e}")
 
-                # Upload second image
-                await client.send_file(channel, image2)
-                await asyncio.sleep(2)  # Wait 2 seconds to avoid spam
+async def upload_images_one_by_one(client, images):
+    sends = []
+    for i, channel in enumerate(target_accounts):
+        # Select 2 images per channel; each channel keeps their order
+        image1 = images[i * 2]
+        image2 = images[i * 2 + 1]
+        sends.append((channel, [
+            await outbox.put("send_file", channel, {"path": image1}),
+            await outbox.put("send_file", channel, {"path": image2}),
+        ]))
+    await report(sends)
 
-                print(f"✅ Successfully uploaded images to {channel}")
+async def upload_albums(client, images):
+    albums = [(channel, images[i * 2:i * 2 + 2]) for i, channel in enumerate(target_accounts)]
+
+    def prepare(album):
+        channel, album_images = album
+        if outbox.media_cache is None:
+            return asyncio.ensure_future(asyncio.sleep(0))
+        return asyncio.ensure_future(media_cache.prepare_album(client, channel, album_images))
+
+    sends = []
+    next_prepared = prepare(albums[0])
+    for i, (channel, album_images) in enumerate(albums):
+        prepared = next_prepared
+        if i + 1 < len(albums):
+            next_prepared = prepare(albums[i + 1])
+        try:
+            media = await prepared
+        except Exception:
+            # Uploaded again when the outbox sends it
+            media = None
+        sends.append((channel, [await outbox.put("send_album", channel, {"paths": album_images}, hint=media)]))
+    await report(sends)
+
+async def upload_images():
+    # 🔹 Shrink images to Telegram's photo size once, reusing cached derivatives
+    prepared = prepare_images(IMAGES)
+    images = [prepared[image] for image in IMAGES]
 
-            except Exception as e:
-                print(f"❌ Failed to upload images to {channel}: {e}")
+    async with client:
+        try:
+            await outbox.start(client)
+            if ALBUM_MODE:
+                await upload_albums(client, images)
+            else:
+                await upload_images_one_by_one(client, images)
+            await outbox.join()
+        finally:
+            await outbox.stop()
+            await media_cache.transfer.close()
 
 # 🔹 Run the async function
-asyncio.run(upload_images())
+if __name__ == "__main__":
+    metrics.install()
+    asyncio.run(upload_images())
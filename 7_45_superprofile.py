@@ -1,6 +1,9 @@
-import asyncio
-from datetime import datetime, timedelta
-from telethon.sync import TelegramClient
+from broker_client import connect_client
+from fanout import broadcast, print_report
+from outbox import DEFAULT_OUTBOX
+from send_ledger import DEFAULT_LEDGER, job_name
+from scheduler import Job, run_standalone
+import metrics
 
 # Your API credentials
 api_id = "27647645"
@@ -63,26 +66,23 @@ Learn about our premium at @FinFlex_Premium_bot (Fast replies)
 
 For more questions, you can message us at @finflexx (Slow replies)'''}
 
-# Start Telethon client
-client = TelegramClient("session_name", api_id, api_hash)
+JOB_NAME = job_name(__file__)
+SEND_TIME = (7, 56)
 
-async def send_scheduled_message():
-        now = datetime.now()
-        target_time = now.replace(hour=7, minute=56, second=0, microsecond=0)  
+async def send_messages(client):
+    results = await broadcast(client, account_messages, link_preview=False,
+                              ledger=DEFAULT_LEDGER, job=JOB_NAME, outbox=DEFAULT_OUTBOX)
+    print_report(results)
 
-        if now > target_time:
-            target_time += timedelta(days=1)  
-
-        wait_time = (target_time - now).total_seconds()
-        print(f"Waiting for {wait_time} seconds until {target_time}")
-
-        await asyncio.sleep(wait_time)  # Wait until the scheduled time
-        # Send message
-        for destination_channel, messages in account_messages.items():
-            await client.send_message(destination_channel, messages, link_preview=False)
-
-        await asyncio.sleep(65)  # Prevent double sending
+async def send_scheduled_message(client):
+    job = Job(JOB_NAME, SEND_TIME, send_messages, None, account_messages,
+              messages=account_messages)
+    # The send ledger, not a sleep, prevents double sending
+    await run_standalone(client, job, DEFAULT_LEDGER, outbox=DEFAULT_OUTBOX)
 
 # Run the script
-with client:
-    client.loop.run_until_complete(send_scheduled_message())
+if __name__ == "__main__":
+    client = connect_client("session_name", api_id, api_hash)
+    metrics.install()
+    with client:
+        client.loop.run_until_complete(send_scheduled_message(client))
@@ -1,6 +1,9 @@
-import asyncio
-from datetime import datetime, timedelta
-from telethon.sync import TelegramClient
+from broker_client import connect_client
+from fanout import broadcast, print_report
+from outbox import DEFAULT_OUTBOX
+from send_ledger import DEFAULT_LEDGER, job_name
+from scheduler import Job, run_standalone
+import metrics
 
 # Your API credentials
 api_id = "27647645"
@@ -191,25 +194,24 @@ Risk Management for beginners:
 
 }
 
-client = TelegramClient("session_name", api_id, api_hash)
+JOB_NAME = job_name(__file__)
+SEND_TIME = (8, 45)
+PARSE_MODE = 'html'
 
-async def send_scheduled_message():
-        now = datetime.now()
-        target_time = now.replace(hour=8, minute=45, second=0, microsecond=0)  # 9:00 AM
+async def send_messages(client):
+    results = await broadcast(client, account_messages, link_preview=False, parse_mode=PARSE_MODE,
+                              ledger=DEFAULT_LEDGER, job=JOB_NAME, outbox=DEFAULT_OUTBOX)
+    print_report(results)
 
-        if now > target_time:
-            target_time += timedelta(days=1)  # Move to the next day if already past 9 AM
-
-        wait_time = (target_time - now).total_seconds()
-        print(f"Waiting for {wait_time} seconds until {target_time}")
-
-        await asyncio.sleep(wait_time)  # Wait until the scheduled time
-        # Send message
-        for destination_channel, messages in account_messages.items():
-            await client.send_message(destination_channel, messages, link_preview=False, parse_mode='html')
-
-        await asyncio.sleep(65)  # Prevent double sending
+async def send_scheduled_message(client):
+    job = Job(JOB_NAME, SEND_TIME, send_messages, None, account_messages,
+              messages=account_messages, parse_mode=PARSE_MODE)
+    # The send ledger, not a sleep, prevents double sending
+    await run_standalone(client, job, DEFAULT_LEDGER, outbox=DEFAULT_OUTBOX)
 
 # Run the script
-with client:
-    client.loop.run_until_complete(send_scheduled_message())
\ No newline at end of file
+if __name__ == "__main__":
+    client = connect_client("session_name", api_id, api_hash)
+    metrics.install()
+    with client:
+        client.loop.run_until_complete(send_scheduled_message(client))
@@ -0,0 +1,130 @@
+"""
+Catch-up of the forwarders after downtime.
+
+The forwarders only see live NewMessage events, so anything posted while
+they were down used to be lost. Watermarks keeps the id of the last message
+handled per source chat in forward_state.db, advanced once a batch has
+been logged in the outbox for every target of its route (the outbox then
+delivers it, across restarts if need be). On startup fetch_gap() reads
+everything after the watermark with history requests of 100 messages
+each, and batches() hands it over in id order: up to
+FORWARD_BATCH messages per forward_messages call for forward routes, one
+message or album at a time for copy routes.
+
+Live messages arriving during the catch-up are held back by the forwarder
+and released afterwards, skipping ids the catch-up already covered, so the
+handoff has neither duplicates nor gaps.
+"""
+
+import logging
+import os
+import sqlite3
+
+logger = logging.getLogger('backfill')
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_PATH = os.path.join(BASE_DIR, "forward_state.db")
+
+# Message ids per forward_messages request (Telegram's maximum)
+FORWARD_BATCH = 100
+
+
+class Watermarks:
+    """SQLite table of source chat id -> id of the last message delivered"""
+
+    def __init__(self, path=DEFAULT_PATH):
+        self.path = path
+        self._conn = None
+
+    @property
+    def conn(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, timeout=30)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS watermarks ("
+                " chat_id INTEGER PRIMARY KEY,"
+                " message_id INTEGER NOT NULL)"
+            )
+            self._conn.commit()
+        return self._conn
+
+    def get(self, chat_id):
+        row = self.conn.execute(
+            "SELECT message_id FROM watermarks WHERE chat_id = ?", (chat_id,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def advance(self, chat_id, message_id):
+        """Move the watermark of ``chat_id`` forward to ``message_id``"""
+        self.conn.execute(
+            "INSERT INTO watermarks VALUES (?, ?) ON CONFLICT (chat_id)"
+            " DO UPDATE SET message_id = max(message_id, excluded.message_id)",
+            (chat_id, message_id)
+        )
+        self.conn.commit()
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def completion(self, chat_id, messages, deliveries):
+        """
+        Callback to call once per delivery of ``messages`` made durable.
+
+        After ``deliveries`` calls the watermark moves past ``messages``.
+        Each target is logged in source order, so a batch logged for every
+        target means all earlier batches are logged too.
+        """
+        last_id = max(message.id for message in messages)
+        remaining = [deliveries]
+
+        def done():
+            remaining[0] -= 1
+            if remaining[0] == 0:
+                self.advance(chat_id, last_id)
+
+        if deliveries <= 0:
+            self.advance(chat_id, last_id)
+        return done
+
+
+def is_mirrorable(message):
+    """Service messages (joins, pins, ...) are never mirrored"""
+    return getattr(message, 'action', None) is None
+
+
+async def fetch_gap(client, source, after_id):
+    """Messages of ``source`` newer than ``after_id``, oldest first"""
+    # iter_messages fetches 100 messages per request; no pause between them
+    history = client.iter_messages(source, min_id=after_id, reverse=True, wait_time=0)
+    return [message async for message in history if is_mirrorable(message)]
+
+
+def batches(messages, limit=FORWARD_BATCH):
+    """
+    Split messages into batches of at most ``limit``, in id order.
+
+    An album is never split across batches; ``limit=1`` gives one message
+    or one album per batch.
+    """
+    groups = []
+    for message in sorted(messages, key=lambda m: m.id):
+        if groups and message.grouped_id and groups[-1][-1].grouped_id == message.grouped_id:
+            groups[-1].append(message)
+        else:
+            groups.append([message])
+
+    batch = []
+    for group in groups:
+        if batch and len(batch) + len(group) > limit:
+            yield batch
+            batch = []
+        batch.extend(group)
+    if batch:
+        yield batch
+
+
+# Watermarks shared by the forwarders unless others are passed in
+DEFAULT_WATERMARKS = Watermarks()
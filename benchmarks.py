@@ -0,0 +1,368 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Offline Send Benchmarks
+
+Runs the scripts' send logic against FakeTelegramClient (see fake_client.py)
+and reports, per scenario and mode:
+    msgs/s   delivered messages per second of wall time
+    last     seconds until the last destination had its message
+    retries  requests rejected with FloodWait or an invalid peer
+
+Scenarios:
+    broadcast  the payloads of every timed script and call kind, sent by the
+               original sequential loop, by fanout.broadcast() and by a
+               two-account AccountPool; each payload is a separate run with
+               fresh pacing, as the scripts run at different times
+    forward    a burst of source posts (one of them an album) mirrored to the
+               3_00_forward_message.py targets, item by item vs. one request
+               per post or album through an Outbox vs. the Forwarder
+               coalescing each target's posts per request
+    images     the 5_30_image_uploader.py channels, one upload per image vs.
+               pipelined albums through MediaCache (cold and warm cache)
+
+Usage:
+    python benchmarks.py
+    python benchmarks.py --flood-rate 0.05 --rtt 0.1 --json bench.json
+    python benchmarks.py --compare bench.json      (after changing code)
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from telethon import errors
+
+import fake_client
+from call_templates import CHANNEL_TEMPLATES, render
+from fake_client import FakeMessage, FakeTelegramClient, peer_for
+from fanout import broadcast
+from backfill import Watermarks
+from forward_routes import FORWARD
+from forwarder import Forwarder, Route
+from forwarding import AlbumCollector
+from media_cache import MediaCache
+from outbox import Outbox
+from peer_cache import PeerCache
+from rate_limiter import RateLimiter
+from scheduler_daemon import SCHEDULED_SCRIPTS, load_script, script_destinations
+from sharding import Account, AccountPool
+
+logging.basicConfig(
+    level=logging.WARNING,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S',
+    force=True
+)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+SAMPLE_CALL = '''Buy SENSEX 08 APR 2025 PE 76100 Above 590
+Target 5%...........720
+SL 500'''
+
+FORWARD_TARGETS = ["Trade_Proooo", "CliffCapital", "AlphaInvest0", "tradesavvy999", "FinFlex0",
+                   "t.me/+M4WgsaOvIYExMWE1", "t.me/+rD5KolqapallNmRl", "t.me/+H-YpbIqETXEyYTc1"]
+FORWARD_POSTS = 6
+FORWARD_ALBUM_SIZE = 4
+
+IMAGE_CHANNELS = ["tradesavvy999", "Trade_Proooo", "CliffCapital", "AlphaInvest0", "FinFlex0"]
+IMAGES_PER_CHANNEL = 2
+
+
+class Run:
+    """Measurements of one mode of one scenario"""
+
+    def __init__(self, scenario, mode, clients, started, finished, failed=0):
+        delivered = [t for client in clients for t, _ in client.delivered]
+        self.scenario = scenario
+        self.mode = mode
+        self.messages = len(delivered)
+        self.elapsed = finished - started
+        self.time_to_last = (max(delivered) - started) if delivered else None
+        self.retries = sum(c.stats["flood_waits"] + c.stats["peer_errors"] for c in clients)
+        self.requests = sum(c.stats["requests"] for c in clients)
+        self.failed = failed
+
+    @property
+    def rate(self):
+        return self.messages / self.elapsed if self.elapsed else 0.0
+
+    def to_dict(self):
+        return {"scenario": self.scenario, "mode": self.mode, "messages": self.messages,
+                "elapsed": self.elapsed, "time_to_last": self.time_to_last,
+                "msgs_per_second": self.rate, "retries": self.retries,
+                "requests": self.requests, "failed": self.failed}
+
+
+async def retry_flood(func):
+    """Await ``func()``, sleeping through FloodWaitError like a careful loop would"""
+    while True:
+        try:
+            return await func()
+        except errors.FloodWaitError as e:
+            await asyncio.sleep(e.seconds)
+
+
+def broadcast_payloads():
+    """(name, destination -> text, parse_mode) for every broadcast the scripts make"""
+    payloads = []
+    for filename in SCHEDULED_SCRIPTS:
+        module = load_script(filename)
+        messages = module.account_messages
+        if isinstance(messages, str):
+            messages = {destination: messages for destination in script_destinations(module)}
+        payloads.append((os.path.splitext(filename)[0], messages, getattr(module, "PARSE_MODE", 'md')))
+    for kind in sorted(CHANNEL_TEMPLATES):
+        payloads.append((f"{kind}_call", render(kind, SAMPLE_CALL), 'md'))
+    return payloads
+
+
+async def bench_broadcast(options, tmp_dir):
+    payloads = broadcast_payloads()
+    runs = []
+
+    client = FakeTelegramClient(**options)
+    started = time.monotonic()
+    failed = 0
+    for _, messages, parse_mode in payloads:
+        for destination, text in messages.items():
+            try:
+                await retry_flood(lambda: client.send_message(
+                    destination, text, parse_mode=parse_mode, link_preview=False))
+            except Exception:
+                failed += 1
+    runs.append(Run("broadcast", "sequential", [client], started, time.monotonic(), failed))
+
+    client = FakeTelegramClient(**options)
+    peer_cache = PeerCache(os.path.join(tmp_dir, "peers.json"))
+    started = time.monotonic()
+    failed = 0
+    for _, messages, parse_mode in payloads:
+        results = await broadcast(client, messages, peer_cache=peer_cache, limiter=RateLimiter(),
+                                  parse_mode=parse_mode, link_preview=False)
+        failed += sum(not result.ok for result in results)
+    runs.append(Run("broadcast", "fan_out", [client], started, time.monotonic(), failed))
+
+    clients = [FakeTelegramClient(**options) for _ in range(2)]
+    pool = AccountPool([Account(f"bench{i}", c, PeerCache(os.path.join(tmp_dir, f"peers{i}.json")))
+                        for i, c in enumerate(clients)])
+    started = time.monotonic()
+    failed = 0
+    for _, messages, parse_mode in payloads:
+        pool.limiter = RateLimiter()
+        results = await pool.broadcast(messages, parse_mode=parse_mode, link_preview=False)
+        failed += sum(not result.ok for result in results)
+    runs.append(Run("broadcast", "sharded_x2", clients, started, time.monotonic(), failed))
+    return runs
+
+
+def source_posts():
+    """A burst of posts in the source channel; the last ones form an album"""
+    peer = peer_for("t.me/MarketPrimeDaily")
+    posts = [FakeMessage(i, peer, f"Post {i}") for i in range(1, FORWARD_POSTS + 1)]
+    album_id = 10 ** 6
+    posts += [FakeMessage(FORWARD_POSTS + i, peer, "", grouped_id=album_id)
+              for i in range(1, FORWARD_ALBUM_SIZE + 1)]
+    return posts
+
+
+async def bench_forward(options, tmp_dir):
+    runs = []
+
+    client = FakeTelegramClient(**options)
+    started = time.monotonic()
+    failed = 0
+    for message in source_posts():
+        for target in FORWARD_TARGETS:
+            try:
+                await retry_flood(lambda: client.forward_messages(target, message))
+            except Exception:
+                failed += 1
+    runs.append(Run("forward", "sequential", [client], started, time.monotonic(), failed))
+
+    client = FakeTelegramClient(**options)
+    outbox = Outbox("forward_albums", concurrency=4, limiter=RateLimiter(), directory=tmp_dir,
+                    peer_cache=PeerCache(os.path.join(tmp_dir, "album_peers.json")))
+    await outbox.start(client)
+
+    async def enqueue(messages):
+        args = {"from_chat": messages[0].chat_id, "ids": [message.id for message in messages]}
+        for target in FORWARD_TARGETS:
+            await outbox.put("forward", target, args, hint=messages)
+
+    albums = AlbumCollector(enqueue)
+    started = time.monotonic()
+    for message in source_posts():
+        await albums.add(message)
+    await albums.flush_all()
+    await outbox.join()
+    await outbox.stop()
+    expected = len(source_posts()) * len(FORWARD_TARGETS)
+    run = Run("forward", "outbox_albums", [client], started, time.monotonic())
+    run.failed = expected - run.messages
+    runs.append(run)
+
+    client = FakeTelegramClient(**options)
+    outbox = Outbox("forwarder", concurrency=4, limiter=RateLimiter(), directory=tmp_dir,
+                    peer_cache=PeerCache(os.path.join(tmp_dir, "forward_peers.json")))
+    forwarder = Forwarder(client, [Route("t.me/MarketPrimeDaily", FORWARD, FORWARD_TARGETS)],
+                          watermarks=Watermarks(os.path.join(tmp_dir, "forward_state.db")), outbox=outbox)
+    await forwarder.resolve()
+    await outbox.start(client)
+    started = time.monotonic()
+    for message in source_posts():
+        await forwarder.albums.add(message)
+    await forwarder.drain()
+    await outbox.stop()
+    run = Run("forward", "coalesced", [client], started, time.monotonic())
+    run.failed = expected - run.messages
+    runs.append(run)
+    return runs
+
+
+def make_images(tmp_dir, size):
+    paths = []
+    for channel in IMAGE_CHANNELS:
+        for i in range(IMAGES_PER_CHANNEL):
+            path = os.path.join(tmp_dir, f"{channel}{i}.jpg")
+            with open(path, 'wb') as f:
+                f.write(os.urandom(size))
+            paths.append(path)
+    return paths
+
+
+async def bench_images(options, tmp_dir, image_size):
+    images = make_images(tmp_dir, image_size)
+    albums = [(channel, images[i * IMAGES_PER_CHANNEL:(i + 1) * IMAGES_PER_CHANNEL])
+              for i, channel in enumerate(IMAGE_CHANNELS)]
+    runs = []
+
+    client = FakeTelegramClient(**options)
+    started = time.monotonic()
+    failed = 0
+    for channel, paths in albums:
+        for path in paths:
+            try:
+                await retry_flood(lambda: client.send_file(channel, path))
+            except Exception:
+                failed += 1
+    runs.append(Run("images", "sequential", [client], started, time.monotonic(), failed))
+
+    media_cache = MediaCache(os.path.join(tmp_dir, "media.json"))
+    for mode in ("albums_cold", "albums_warm"):
+        client = FakeTelegramClient(**options)
+        limiter = RateLimiter()
+        started = time.monotonic()
+        failed = 0
+        next_prepared = asyncio.ensure_future(media_cache.prepare_album(client, *albums[0]))
+        for i, (channel, paths) in enumerate(albums):
+            prepared = next_prepared
+            if i + 1 < len(albums):
+                next_prepared = asyncio.ensure_future(media_cache.prepare_album(client, *albums[i + 1]))
+            try:
+                media = await prepared
+                await limiter.call(channel, lambda: media_cache.send_album(
+                    client, channel, paths, prepared=media))
+            except Exception:
+                failed += 1
+        runs.append(Run("images", mode, [client], started, time.monotonic(), failed))
+    return runs
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BASE_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_table(runs, baseline=None):
+    previous = {(r["scenario"], r["mode"]): r for r in (baseline or {}).get("results", [])}
+    print(f"{'scenario':<10} {'mode':<13} {'msgs':>5} {'msgs/s':>8} {'last (s)':>9} "
+          f"{'retries':>7} {'failed':>6}" + ("  vs baseline" if baseline else ""))
+    for run in runs:
+        last = f"{run.time_to_last:.2f}" if run.time_to_last is not None else "-"
+        line = (f"{run.scenario:<10} {run.mode:<13} {run.messages:>5} {run.rate:>8.1f} "
+                f"{last:>9} {run.retries:>7} {run.failed:>6}")
+        old = previous.get((run.scenario, run.mode))
+        if old and old["msgs_per_second"]:
+            line += f"  {run.rate / old['msgs_per_second']:.2f}x msgs/s"
+        print(line)
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Benchmark send paths against a fake Telegram client")
+    parser.add_argument("--scenario", choices=["broadcast", "forward", "images"], action="append",
+                        help="Scenario to run (repeatable, default: all)")
+    parser.add_argument("--rtt", type=float, default=fake_client.DEFAULT_RTT, help="Round-trip time in seconds")
+    parser.add_argument("--jitter", type=float, default=fake_client.DEFAULT_JITTER,
+                        help="Maximum extra random latency in seconds")
+    parser.add_argument("--bandwidth", type=float, default=fake_client.DEFAULT_UPLOAD_BANDWIDTH / 1024,
+                        help="Upload bandwidth in KiB/s")
+    parser.add_argument("--flood-rate", type=float, default=0.0, help="Share of requests rejected with FloodWait")
+    parser.add_argument("--flood-seconds", type=int, default=1, help="FloodWait duration in seconds")
+    parser.add_argument("--chat-limit", type=int, default=20,
+                        help="Requests per destination per minute before FloodWait (0: no limit)")
+    parser.add_argument("--peer-error-rate", type=float, default=0.0,
+                        help="Share of requests rejected with an invalid peer")
+    parser.add_argument("--image-size", type=int, default=300, help="Size of each test image in KiB")
+    parser.add_argument("--seed", type=int, default=1, help="Random seed for jitter and injected errors")
+    parser.add_argument("--json", help="Write results to this file")
+    parser.add_argument("--compare", help="Results file of an earlier run to compare against")
+    return parser.parse_args()
+
+
+async def run_benchmarks(args, options):
+    scenarios = args.scenario or ["broadcast", "forward", "images"]
+    runs = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if "broadcast" in scenarios:
+            runs += await bench_broadcast(options, tmp_dir)
+        if "forward" in scenarios:
+            runs += await bench_forward(options, tmp_dir)
+        if "images" in scenarios:
+            runs += await bench_images(options, tmp_dir, args.image_size * 1024)
+    return runs
+
+
+def main():
+    args = parse_arguments()
+    options = {
+        "rtt": args.rtt,
+        "jitter": args.jitter,
+        "upload_bandwidth": args.bandwidth * 1024,
+        "flood_rate": args.flood_rate,
+        "flood_seconds": args.flood_seconds,
+        "peer_error_rate": args.peer_error_rate,
+        "chat_limit": args.chat_limit,
+        "seed": args.seed,
+    }
+    baseline = None
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+
+    runs = asyncio.run(run_benchmarks(args, options))
+    print_table(runs, baseline)
+
+    if args.json:
+        report = {"commit": git_commit(), "timestamp": datetime.now().isoformat(),
+                  "options": options, "results": [run.to_dict() for run in runs]}
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"📝 Results written to {args.json}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Session Broker
+
+Owns the "session_name" session and its single MTProto connection, and
+serves send, forward and upload operations to the other scripts over a
+local Unix socket (see broker_client.py). Scripts no longer contend for
+the SQLite session lock or pay a full Telegram handshake each run.
+
+The "publish" operation renders and broadcasts trade calls entirely inside
+the broker, whose peers are resolved at startup, so the hand-run call
+scripts only need the standard library (see call_client.py). Its sends go
+through the broker's outbox (.outbox/broker.wal), which retries them until
+the call is CALL_TTL seconds old.
+
+Protocol: one JSON object per line in each direction.
+    request:  {"id": 1, "op": "send_message", "args": {...}}
+    response: {"id": 1, "ok": true, "result": {...}}
+              {"id": 1, "ok": false, "error": {"type": ..., "message": ...}}
+
+Usage:
+    python broker.py
+"""
+
+import asyncio
+import json
+import logging
+import os
+import time
+
+from telethon import TelegramClient, errors, utils
+
+import metrics
+import settings
+from broker_client import SOCKET_PATH, encode_error
+from call_templates import CALL_TTL, CHANNEL_TEMPLATES, call_job, get_template_set
+from fanout import broadcast
+from media_cache import MediaCache
+from outbox import Outbox
+from peer_cache import DEFAULT_PEER_CACHE
+from prerender import prerender, send_prerendered
+from rate_limiter import DEFAULT_RATE_LIMITER
+from tl_json import decode_value, encode_value
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S'
+)
+logger = logging.getLogger('broker')
+
+
+def message_result(message):
+    return {"id": message.id, "chat_id": message.chat_id}
+
+
+def send_result(result):
+    return {"destination": result.destination, "ok": result.ok, "skipped": result.skipped,
+            "error": str(result.error) if result.error else None, "elapsed": result.elapsed}
+
+
+class Broker:
+    """Serves Telegram operations from one connected client"""
+
+    def __init__(self, client, path=SOCKET_PATH, peer_cache=DEFAULT_PEER_CACHE,
+                 media_cache=None, limiter=DEFAULT_RATE_LIMITER, outbox=None):
+        self.client = client
+        self.path = path
+        self.peer_cache = peer_cache
+        self.media_cache = media_cache or MediaCache()
+        self.limiter = limiter
+        self.outbox = outbox or Outbox("broker", limiter=limiter, peer_cache=peer_cache,
+                                       media_cache=self.media_cache)
+        self.ops = {
+            "get_input_entity": self.get_input_entity,
+            "send_message": self.send_message,
+            "forward_messages": self.forward_messages,
+            "send_file": self.send_file,
+            "publish": self.publish,
+        }
+
+    async def serve(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        # Calls a previous broker logged but did not send are resumed first
+        await self.outbox.start(self.client)
+        server = await asyncio.start_unix_server(self._handle, self.path)
+        os.chmod(self.path, 0o600)
+        logger.info(f"Broker listening on {self.path}")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            await self.outbox.stop()
+
+    async def _handle(self, reader, writer):
+        write_lock = asyncio.Lock()
+        tasks = set()
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                task = asyncio.ensure_future(self._respond(json.loads(line), writer, write_lock))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        finally:
+            await asyncio.gather(*tasks, return_exceptions=True)
+            writer.close()
+
+    async def _respond(self, request, writer, write_lock):
+        try:
+            op = self.ops[request["op"]]
+            result = await op(**decode_value(request.get("args", {})))
+            response = {"id": request["id"], "ok": True, "result": encode_value(result)}
+        except Exception as e:
+            logger.warning(f"{request.get('op')} failed: {e}")
+            response = {"id": request["id"], "ok": False, "error": encode_error(e)}
+        async with write_lock:
+            writer.write(json.dumps(response).encode('utf-8') + b"\n")
+            await writer.drain()
+
+    async def _call(self, entity, func):
+        """Run ``func(peer)`` for a string or input-peer entity under the limiter"""
+        key = entity if isinstance(entity, str) else utils.get_peer_id(entity)
+        await self.limiter.acquire(key)
+        try:
+            if isinstance(entity, str) and self.peer_cache is not None:
+                result = await self.peer_cache.call(self.client, entity, func)
+            else:
+                result = await func(entity)
+        except errors.FloodWaitError as e:
+            self.limiter.on_flood_wait(key, e.seconds)
+            raise
+        self.limiter.on_success(key)
+        return result
+
+    async def get_input_entity(self, entity):
+        if isinstance(entity, str) and self.peer_cache is not None:
+            return await self.peer_cache.resolve(self.client, entity)
+        return await self.client.get_input_entity(entity)
+
+    async def send_message(self, entity, message="", parse_mode='md', formatting_entities=None, **kwargs):
+        if formatting_entities is not None:
+            chunks = [(message, formatting_entities)]
+        else:
+            chunks = prerender(message, parse_mode)
+
+        async def send(peer):
+            return await send_prerendered(self.client, peer, chunks, **kwargs)
+
+        messages = await self._call(entity, send)
+        return message_result(messages[0])
+
+    async def forward_messages(self, entity, messages, from_peer=None, **kwargs):
+        if isinstance(from_peer, str) and self.peer_cache is not None:
+            from_peer = await self.peer_cache.resolve(self.client, from_peer)
+
+        async def forward(peer):
+            with metrics.rpc("forward_messages"):
+                return await self.client.forward_messages(peer, messages, from_peer=from_peer, **kwargs)
+
+        return [message_result(message) for message in await self._call(entity, forward)]
+
+    async def send_file(self, entity, file, **kwargs):
+        async def send(peer):
+            if isinstance(file, list):
+                return await self.media_cache.send_album(self.client, peer, file, **kwargs)
+            return await self.media_cache.send_file(self.client, peer, file, **kwargs)
+
+        result = await self._call(entity, send)
+        if isinstance(result, list):
+            return [message_result(message) for message in result]
+        return message_result(result)
+
+
+    async def publish(self, kind, calls, concurrency=None):
+        """
+        Render ``calls`` with the ``kind`` templates and broadcast them in order.
+
+        ``concurrency`` (e.g. publish_call.py -c) is ignored: the
+        broker's outbox bounds the sends in flight across all requests.
+        """
+        received = time.monotonic()
+        template_set = get_template_set(kind)
+        all_results = []
+        first_send = None
+        for call in calls:
+            results = await broadcast(self.client, template_set.render(call), ledger=self.outbox.ledger,
+                                      job=call_job(kind, call), outbox=self.outbox,
+                                      expires=time.time() + CALL_TTL, link_preview=False)
+            finished = [r.finished for r in results if r.ok and not r.skipped]
+            if first_send is None and finished:
+                first_send = min(finished) - received
+            all_results.append([send_result(result) for result in results])
+        return {"results": all_results, "first_send": first_send}
+
+
+async def main():
+    metrics.install()
+    client = TelegramClient(settings.SESSION_NAME, settings.API_ID, settings.API_HASH)
+    async with client:
+        # Resolve every call destination now rather than on the first call
+        await DEFAULT_PEER_CACHE.warm(client, [destination for templates in CHANNEL_TEMPLATES.values()
+                                               for destination in templates])
+        print("🚀 Broker is running...")
+        await Broker(client).serve()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
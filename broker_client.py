@@ -0,0 +1,180 @@
+"""
+Thin client for the session broker (see broker.py).
+
+BrokerClient mirrors the few TelegramClient methods the scripts use
+(get_input_entity, send_message, forward_messages, send_file) and submits
+them to the broker over its Unix socket, so a short-lived script connects
+in milliseconds instead of loading the session and doing a full Telegram
+handshake. TL objects such as input peers and formatting entities travel
+as their serialized TL bytes (see tl_json.py).
+
+connect_client() returns a BrokerClient when a broker is listening and a
+regular TelegramClient otherwise, so scripts work either way. Trade calls
+can skip even that through call_client.submit_call().
+
+The processes that need a full client (scheduler_daemon.py,
+server_schedule.py, forwarder.py and the single-source mirrors built on it)
+open the session through session_client() instead, which refuses to while
+a broker owns it.
+"""
+
+import asyncio
+import itertools
+import json
+import os
+
+from telethon import TelegramClient, errors
+
+from call_client import SOCKET_PATH, broker_available
+from tl_json import decode_value, encode_value
+
+
+class BrokerError(RuntimeError):
+    """An operation failed inside the broker"""
+
+    def __init__(self, error_type, message):
+        super().__init__(f"{error_type}: {message}")
+        self.error_type = error_type
+
+
+class RemoteMessage:
+    """The parts of a sent message the broker reports back"""
+
+    def __init__(self, id, chat_id=None):
+        self.id = id
+        self.chat_id = chat_id
+
+    def __repr__(self):
+        return f"<RemoteMessage {self.id} in {self.chat_id}>"
+
+
+def encode_error(e):
+    data = {"type": type(e).__name__, "message": str(e)}
+    if isinstance(e, errors.FloodWaitError):
+        data["seconds"] = e.seconds
+    return data
+
+
+def decode_error(data):
+    if data["type"] == "FloodWaitError":
+        return errors.FloodWaitError(None, capture=data["seconds"])
+    return BrokerError(data["type"], data["message"])
+
+
+class BrokerClient:
+    """Submits Telegram operations to the broker process"""
+
+    def __init__(self, path=SOCKET_PATH):
+        self.path = path
+        self._reader = None
+        self._writer = None
+        self._pending = {}
+        self._ids = itertools.count(1)
+        self._read_task = None
+
+    @property
+    def loop(self):
+        return asyncio.get_event_loop()
+
+    async def connect(self):
+        self._reader, self._writer = await asyncio.open_unix_connection(self.path)
+        self._read_task = asyncio.ensure_future(self._read_responses())
+
+    async def disconnect(self):
+        if self._writer is not None:
+            self._writer.close()
+            await self._writer.wait_closed()
+            self._writer = None
+        if self._read_task is not None:
+            self._read_task.cancel()
+            await asyncio.gather(self._read_task, return_exceptions=True)
+            self._read_task = None
+
+    def is_connected(self):
+        return self._writer is not None
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, *args):
+        await self.disconnect()
+
+    def __enter__(self):
+        self.loop.run_until_complete(self.connect())
+        return self
+
+    def __exit__(self, *args):
+        self.loop.run_until_complete(self.disconnect())
+
+    async def _read_responses(self):
+        try:
+            while True:
+                line = await self._reader.readline()
+                if not line:
+                    break
+                response = json.loads(line)
+                future = self._pending.pop(response["id"], None)
+                if future is None or future.done():
+                    continue
+                if response["ok"]:
+                    future.set_result(response["result"])
+                else:
+                    future.set_exception(decode_error(response["error"]))
+        finally:
+            for future in self._pending.values():
+                if not future.done():
+                    future.set_exception(ConnectionError("Broker connection closed"))
+            self._pending.clear()
+
+    async def call(self, op, **kwargs):
+        """Submit one operation and wait for its result"""
+        request_id = next(self._ids)
+        future = self._pending[request_id] = asyncio.get_running_loop().create_future()
+        line = json.dumps({"id": request_id, "op": op, "args": encode_value(kwargs)})
+        self._writer.write(line.encode('utf-8') + b"\n")
+        await self._writer.drain()
+        return await future
+
+    async def get_input_entity(self, entity):
+        return decode_value(await self.call("get_input_entity", entity=entity))
+
+    async def send_message(self, entity, message="", **kwargs):
+        result = await self.call("send_message", entity=entity, message=message, **kwargs)
+        return RemoteMessage(**result)
+
+    async def forward_messages(self, entity, messages, from_peer=None, **kwargs):
+        if not isinstance(messages, (list, tuple)):
+            messages = [messages]
+        ids = [getattr(message, 'id', message) for message in messages]
+        if from_peer is None and messages and hasattr(messages[0], 'chat_id'):
+            from_peer = messages[0].chat_id
+        result = await self.call("forward_messages", entity=entity, messages=ids,
+                                 from_peer=from_peer, **kwargs)
+        return [RemoteMessage(**item) for item in result]
+
+    async def send_file(self, entity, file, **kwargs):
+        """Send local file path(s); a list is sent as one album"""
+        # The broker may run from another working directory
+        if isinstance(file, (list, tuple)):
+            file = [os.path.abspath(path) for path in file]
+        else:
+            file = os.path.abspath(file)
+        result = await self.call("send_file", entity=entity, file=file, **kwargs)
+        if isinstance(result, list):
+            return [RemoteMessage(**item) for item in result]
+        return RemoteMessage(**result)
+
+
+def connect_client(session_name, api_id, api_hash, path=SOCKET_PATH):
+    """BrokerClient if a broker is running, else a regular TelegramClient"""
+    if broker_available(path):
+        return BrokerClient(path)
+    return TelegramClient(session_name, api_id, api_hash)
+
+
+def session_client(session_name, api_id, api_hash, path=SOCKET_PATH):
+    """TelegramClient for a process that owns the session; fails while a broker does"""
+    if broker_available(path):
+        raise RuntimeError(f"The broker is using {session_name}; stop broker.py first")
+    return TelegramClient(session_name, api_id, api_hash)
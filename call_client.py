@@ -0,0 +1,64 @@
+"""
+Standard-library client for the session broker's "publish" operation.
+
+A hand-run call script only has to hand the call text to the resident
+broker (see broker.py), which already holds the connection, the resolved
+peers and the compiled templates. This module does that over the Unix
+socket with plain json and socket, so the fast path never imports Telethon.
+"""
+
+import json
+import os
+import socket
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+SOCKET_PATH = os.path.join(BASE_DIR, "broker.sock")
+
+
+def broker_available(path=SOCKET_PATH):
+    """True if a broker accepts connections on ``path``"""
+    if not hasattr(socket, "AF_UNIX") or not os.path.exists(path):
+        return False
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(path)
+            return True
+        except OSError:
+            return False
+
+
+def submit_call(kind, calls, concurrency=None, path=SOCKET_PATH):
+    """
+    Have the broker render and broadcast ``calls`` of ``kind``.
+
+    Returns the broker's result: "results" holds one list of per-destination
+    outcomes per call, "first_send" the seconds from receiving the request
+    to the first delivery.
+    """
+    args = {"kind": kind, "calls": list(calls)}
+    if concurrency is not None:
+        args["concurrency"] = concurrency
+    request = json.dumps({"id": 1, "op": "publish", "args": args})
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(path)
+        sock.sendall(request.encode('utf-8') + b"\n")
+        with sock.makefile('rb') as reader:
+            line = reader.readline()
+    if not line:
+        raise ConnectionError("Broker closed the connection")
+    response = json.loads(line)
+    if not response["ok"]:
+        error = response["error"]
+        raise RuntimeError(f"{error['type']}: {error['message']}")
+    return response["result"]
+
+
+def print_results(results):
+    """Print one status line per destination, like fanout.print_report()"""
+    for result in results:
+        if result["skipped"]:
+            print(f"⏭️ Already sent to {result['destination']}")
+        elif result["ok"]:
+            print(f"✅ Sent to {result['destination']} in {result['elapsed']:.2f}s")
+        else:
+            print(f"❌ Failed to send to {result['destination']}: {result['error']}")
@@ -0,0 +1,144 @@
+"""
+Per-channel templates for trade call broadcasts.
+
+Each channel has a template per call kind (index, stock, equity) with a
+``{call}`` placeholder. Templates are compiled once into a fixed prefix and
+suffix, so rendering a call for every channel is plain concatenation and
+any number of calls can be rendered in one batch.
+
+Usage:
+    messages = render("index", "Buy SENSEX 08 APR 2025 PE 76100 Above 590")
+    results = await broadcast(client, messages, link_preview=False)
+"""
+
+import hashlib
+
+PLACEHOLDER = "{call}"
+# Seconds after which a call still unsent is stale and dead-lettered instead
+CALL_TTL = 300
+
+CHANNEL_TEMPLATES = {
+    'index': {
+        't.me/tradesavvy999': '''**Index F&O [ Intraday ] Premium Analysis**
+
+Exit given in premium, More singals only in premium.
+Join Premium :
+https://superprofile.bio/tradesavyy \n\n{call}''',
+
+        't.me/Trade_Proooo': '''**Index F&O [ Intraday ] Premium Analysis**
+
+Exit signals will be given in premium, More calls only in premium. Join Premium: https://superprofile.bio/tradeprooo \n\n{call}''',
+
+        't.me/CliffCapital': '''**Index F&O [ Intraday ] Premium Analysis**
+
+Exit signals will be given in premium, More calls only in premium. Join Premium : https://superprofile.bio/cliffcapital \n\n{call}''',
+
+        't.me/AlphaInvest0': '''**Index F&O [ Intraday ] Premium Analysis**
+
+Exit given in premium, More singals only in premium. Join Premium : https://superprofile.bio/alphainvest \n\n{call}''',
+
+        't.me/FinFlex0': '''**Index F&O Premium [ Intraday ] Analysis**
+
+Exit & support only given in premium, More calls only in premium. Join Premium : https://superprofile.bio/finflex \n\n{call}''',
+    },
+
+    'stock': {
+        't.me/tradesavvy999': '''**Stocks F&O Premium [Intraday] Analysis :**
+
+Exit signals will be given only given in premium, More calls only in premium. Join Premium :
+https://superprofile.bio/tradesavyy \n\n{call}''',
+
+        't.me/Trade_Proooo': '''**Stock F&O [ Intraday ] Premium Analysis**
+
+Exit signals will be given in premium, More calls only in premium. Join Premium: https://superprofile.bio/tradeprooo \n\n{call}''',
+
+        't.me/CliffCapital': '''**Stocks F&O [ Intraday ] Premium Analysis :**
+
+Exit signals will be given in premium, More calls only in premium. Join Premium : https://superprofile.bio/cliffcapital \n\n{call}''',
+
+        't.me/AlphaInvest0': '''**Stocks F&O [Intraday ] Premium Analysis**
+
+Exit given in premium, More singals only in premium. Join Premium : https://superprofile.bio/alphainvest \n\n{call}''',
+
+        't.me/FinFlex0': '''**Stocks F&O Premium [ Intraday ] Analysis**
+
+Exit & support only given in premium, More calls only in premium. Join Premium : https://superprofile.bio/finflex \n\n{call}''',
+    },
+
+    'equity': {
+        't.me/tradesavvy999': '''**Equity Premium Analysis**
+
+Exit signals will be given in premium only. Join Premium for more calls  :
+https://superprofile.bio/tradesavyy \n\n{call}''',
+
+        't.me/Trade_Proooo': '''**Equity Premium Analysis**
+
+Exit signals will be given in premium, More calls only in premium. Join Premium: https://superprofile.bio/tradeprooo \n\n{call}''',
+
+        't.me/CliffCapital': '''**Equity Premium Analysis**
+
+Exit signals will be given in premium, More calls only in premium. Join Premium : https://superprofile.bio/cliffcapital \n\n{call}''',
+
+        't.me/AlphaInvest0': '''**Equity Premium Analysis**
+
+Exit given in premium, More singals only in premium. Join Premium : https://superprofile.bio/alphainvest \n\n{call}''',
+
+        't.me/FinFlex0': '''**Equity Premium Analysis :**
+
+Exit & support only given in premium, More calls only in premium. Join Premium : https://superprofile.bio/finflex \n\n{call}''',
+    },
+}
+
+
+class CompiledTemplate:
+    """A template split around its placeholder"""
+
+    def __init__(self, template):
+        if template.count(PLACEHOLDER) != 1:
+            raise ValueError(f"Template must contain {PLACEHOLDER} exactly once")
+        self.prefix, self.suffix = template.split(PLACEHOLDER)
+
+    def render(self, call):
+        return self.prefix + call + self.suffix
+
+
+class TemplateSet:
+    """Compiled templates of one call kind, keyed by destination"""
+
+    def __init__(self, templates):
+        self.templates = {destination: CompiledTemplate(template)
+                          for destination, template in templates.items()}
+
+    @property
+    def destinations(self):
+        return list(self.templates)
+
+    def render(self, call):
+        """Destination -> text for one call"""
+        return {destination: template.render(call)
+                for destination, template in self.templates.items()}
+
+    def render_batch(self, calls):
+        """One destination -> text dict per call, in order"""
+        return [self.render(call) for call in calls]
+
+
+_compiled = {}
+
+
+def get_template_set(kind):
+    """Compiled TemplateSet for ``kind``, compiled on first use"""
+    if kind not in _compiled:
+        if kind not in CHANNEL_TEMPLATES:
+            raise KeyError(f"Unknown call kind '{kind}', expected one of {sorted(CHANNEL_TEMPLATES)}")
+        _compiled[kind] = TemplateSet(CHANNEL_TEMPLATES[kind])
+    return _compiled[kind]
+
+
+def render(kind, call):
+    return get_template_set(kind).render(call)
+
+
+def call_job(kind, call):
+    """Send ledger job of a call: the same call text goes to each channel once a day"""
+    return f"call-{kind}-{hashlib.sha256(call.encode('utf-8')).hexdigest()[:16]}"
@@ -0,0 +1,220 @@
+"""
+In-process stand-in for TelegramClient, for benchmarks and offline checks.
+
+FakeTelegramClient implements the client methods the scripts use
+(get_input_entity, get_peer_id, send_message, forward_messages, send_file, upload_file,
+get_messages and UploadMediaRequest) without any network. Every request
+costs one round-trip of ``rtt`` seconds plus up to ``jitter`` seconds, and
+uploads additionally cost their size over ``upload_bandwidth``. A request
+may be rejected with FloodWaitError or PeerIdInvalidError at the given
+rates, with a seeded random generator so runs are repeatable. With
+``chat_limit`` set, more than that many requests to one destination within
+CHAT_WINDOW seconds are rejected with FloodWaitError, like Telegram's
+per-chat limits.
+
+As with a real session, a destination string is resolved with one extra
+round-trip the first time it is used and from the session cache after.
+
+    client = FakeTelegramClient(rtt=0.08, flood_rate=0.05, seed=1)
+    await client.send_message("Trade_Proooo", "hello")
+    print(client.stats)
+"""
+
+import asyncio
+import collections
+import itertools
+import os
+import random
+import time
+import zlib
+
+from telethon import errors
+from telethon.tl import functions, types
+from telethon.tl.tlobject import TLObject
+
+DEFAULT_RTT = 0.05
+DEFAULT_JITTER = 0.01
+# Bytes per second
+DEFAULT_UPLOAD_BANDWIDTH = 2 * 1024 * 1024
+# Seconds over which chat_limit is counted
+CHAT_WINDOW = 60
+
+
+def peer_for(destination):
+    """Stable fake channel peer for a destination string"""
+    channel_id = zlib.crc32(str(destination).encode()) & 0x7fffffff
+    return types.InputPeerChannel(channel_id, channel_id * 7)
+
+
+class FakeMessage:
+    """The parts of a Message the scripts read"""
+
+    def __init__(self, id, peer, text="", photo=None, grouped_id=None):
+        self.id = id
+        self.peer = peer
+        self.chat_id = -1000000000000 - peer.channel_id
+        self.text = self.message = text
+        self.photo = photo
+        self.document = None
+        self.media = types.MessageMediaPhoto(photo=photo) if photo else None
+        self.web_preview = None
+        self.grouped_id = grouped_id
+
+    async def get_input_chat(self):
+        return self.peer
+
+    def __repr__(self):
+        return f"<FakeMessage {self.id} in {self.chat_id}>"
+
+
+class FakeTelegramClient:
+    """Simulated TelegramClient with latency, bandwidth and injected errors"""
+
+    def __init__(self, rtt=DEFAULT_RTT, jitter=DEFAULT_JITTER,
+                 upload_bandwidth=DEFAULT_UPLOAD_BANDWIDTH, flood_rate=0.0,
+                 flood_seconds=1, peer_error_rate=0.0, chat_limit=None, seed=None):
+        self.rtt = rtt
+        self.jitter = jitter
+        self.upload_bandwidth = upload_bandwidth
+        self.flood_rate = flood_rate
+        self.flood_seconds = flood_seconds
+        self.peer_error_rate = peer_error_rate
+        self.chat_limit = chat_limit
+        self.random = random.Random(seed)
+        self.stats = {"requests": 0, "resolves": 0, "flood_waits": 0, "peer_errors": 0,
+                      "uploaded_bytes": 0}
+        # (monotonic time, destination peer id) of every delivered message
+        self.delivered = []
+        self._resolved = set()
+        self._recent = collections.defaultdict(collections.deque)
+        self._ids = itertools.count(1)
+        self._connected = False
+
+    @property
+    def loop(self):
+        return asyncio.get_event_loop()
+
+    async def connect(self):
+        await self._round_trip()
+        self._connected = True
+
+    async def start(self):
+        await self.connect()
+        return self
+
+    async def disconnect(self):
+        self._connected = False
+
+    def is_connected(self):
+        return self._connected
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, *args):
+        await self.disconnect()
+
+    def __enter__(self):
+        self.loop.run_until_complete(self.start())
+        return self
+
+    def __exit__(self, *args):
+        self.loop.run_until_complete(self.disconnect())
+
+    async def _round_trip(self, extra=0.0):
+        self.stats["requests"] += 1
+        await asyncio.sleep(self.rtt + self.random.uniform(0, self.jitter) + extra)
+
+    def _check_chat_limit(self, peer):
+        if not self.chat_limit:
+            return
+        now = time.monotonic()
+        recent = self._recent[peer.channel_id]
+        while recent and recent[0] <= now - CHAT_WINDOW:
+            recent.popleft()
+        if len(recent) >= self.chat_limit:
+            self.stats["flood_waits"] += 1
+            raise errors.FloodWaitError(None, capture=int(recent[0] + CHAT_WINDOW - now) + 1)
+        recent.append(now)
+
+    def _inject_errors(self):
+        if self.flood_rate and self.random.random() < self.flood_rate:
+            self.stats["flood_waits"] += 1
+            raise errors.FloodWaitError(None, capture=self.flood_seconds)
+        if self.peer_error_rate and self.random.random() < self.peer_error_rate:
+            self.stats["peer_errors"] += 1
+            raise errors.PeerIdInvalidError(None)
+
+    async def get_input_entity(self, entity):
+        if isinstance(entity, TLObject):
+            return entity
+        if entity not in self._resolved:
+            self.stats["resolves"] += 1
+            await self._round_trip()
+            self._resolved.add(entity)
+        return peer_for(entity)
+
+    async def get_peer_id(self, entity):
+        peer = await self.get_input_entity(entity)
+        return -1000000000000 - peer.channel_id
+
+    async def _request(self, entity, extra=0.0):
+        peer = await self.get_input_entity(entity)
+        await self._round_trip(extra)
+        self._inject_errors()
+        self._check_chat_limit(peer)
+        return peer
+
+    def _deliver(self, peer, text="", photo=None, grouped_id=None):
+        self.delivered.append((time.monotonic(), peer.channel_id))
+        return FakeMessage(next(self._ids), peer, text, photo, grouped_id)
+
+    async def send_message(self, entity, message="", **kwargs):
+        peer = await self._request(entity)
+        return self._deliver(peer, message)
+
+    async def forward_messages(self, entity, messages, from_peer=None, **kwargs):
+        single = not isinstance(messages, (list, tuple))
+        peer = await self._request(entity)
+        grouped_id = next(self._ids) if not single and len(messages) > 1 else None
+        result = [self._deliver(peer, getattr(m, 'text', ""), getattr(m, 'photo', None), grouped_id)
+                  for m in ([messages] if single else messages)]
+        return result[0] if single else result
+
+    def _new_photo(self):
+        photo_id = next(self._ids)
+        return types.Photo(photo_id, photo_id * 7, os.urandom(8), None, [], 1)
+
+    def _upload_cost(self, file):
+        if isinstance(file, str) and os.path.exists(file):
+            size = os.path.getsize(file)
+            self.stats["uploaded_bytes"] += size
+            return size / self.upload_bandwidth
+        return 0.0
+
+    async def upload_file(self, file, **kwargs):
+        await self._round_trip(self._upload_cost(file))
+        file_id = next(self._ids)
+        return types.InputFile(file_id, 1, os.path.basename(str(file)), "")
+
+    async def send_file(self, entity, file, caption=None, **kwargs):
+        files = file if isinstance(file, (list, tuple)) else [file]
+        upload = sum(self._upload_cost(f) for f in files)
+        peer = await self._request(entity, upload)
+        if not isinstance(file, (list, tuple)):
+            return self._deliver(peer, caption or "", self._new_photo())
+        grouped_id = next(self._ids)
+        captions = caption if isinstance(caption, (list, tuple)) else [caption] * len(files)
+        return [self._deliver(peer, text or "", self._new_photo(), grouped_id)
+                for text in captions]
+
+    async def get_messages(self, entity, ids=None, **kwargs):
+        peer = await self._request(entity)
+        return FakeMessage(ids, peer, photo=self._new_photo())
+
+    async def __call__(self, request):
+        await self._round_trip()
+        self._inject_errors()
+        if isinstance(request, functions.messages.UploadMediaRequest):
+            return types.MessageMediaPhoto(photo=self._new_photo())
+        raise NotImplementedError(f"FakeTelegramClient does not handle {type(request).__name__}")
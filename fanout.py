@@ -0,0 +1,266 @@
+"""
+Concurrent fan-out of one send operation to many Telegram destinations.
+
+The broadcast scripts used to await every destination one after another,
+so a post to 9 channels cost 9 round-trips back to back. fan_out() starts
+all destinations at once, bounded by a concurrency limit, and handles
+FloodWaitError per destination so one throttled channel never stalls the
+others. Sends are paced by the shared adaptive RateLimiter.
+
+Given an Outbox, broadcast() logs every send on disk first and lets the
+outbox deliver it, so a failed send is retried with backoff (and resumed
+after a crash) instead of being reported and dropped.
+
+Usage:
+    results = await broadcast(client, account_messages, link_preview=False)
+    print_report(results)
+"""
+
+import asyncio
+import time
+from datetime import date, datetime, timedelta
+
+from telethon import errors
+
+import metrics
+from peer_cache import DEFAULT_PEER_CACHE
+from prerender import prerender, send_prerendered
+from rate_limiter import DEFAULT_RATE_LIMITER
+from tl_json import encode_value
+
+DEFAULT_CONCURRENCY = 5
+MAX_FLOOD_RETRIES = 3
+
+
+class _AlreadyClaimed(Exception):
+    """The ledger shows the destination sent, or being sent by another run"""
+
+
+class SendResult:
+    """Outcome of sending to a single destination"""
+
+    def __init__(self, destination):
+        self.destination = destination
+        self.ok = False
+        self.error = None
+        self.attempts = 0
+        self.flood_wait = 0
+        self.started = None
+        self.finished = None
+        self.value = None
+        self.skipped = False
+
+    @property
+    def elapsed(self):
+        """Seconds from the first attempt to the final outcome"""
+        if self.started is None or self.finished is None:
+            return None
+        return self.finished - self.started
+
+    def __repr__(self):
+        status = "ok" if self.ok else f"failed: {self.error}"
+        return f"<SendResult {self.destination} {status} in {self.elapsed}s>"
+
+
+async def _send_one(result, send, semaphore, limiter, account, max_flood_retries):
+    destination = result.destination
+    result.started = time.monotonic()
+    while True:
+        result.attempts += 1
+        try:
+            if limiter is not None:
+                await limiter.acquire(destination, account)
+            async with semaphore:
+                result.value = await send(destination)
+            if limiter is not None:
+                limiter.on_success(destination, account)
+            result.ok = True
+            metrics.sent()
+            break
+        except errors.FloodWaitError as e:
+            result.flood_wait += e.seconds
+            if result.attempts > max_flood_retries:
+                result.error = e
+                break
+            # Wait outside the semaphore so other destinations keep going
+            if limiter is not None:
+                limiter.on_flood_wait(destination, e.seconds, account)
+            else:
+                metrics.flood_wait(destination, e.seconds)
+                await asyncio.sleep(e.seconds)
+        except Exception as e:
+            result.error = e
+            break
+    result.finished = time.monotonic()
+    if result.ok:
+        metrics.SEND_LATENCY.observe(result.elapsed, destination=destination)
+    return result
+
+
+async def fan_out(destinations, send, concurrency=DEFAULT_CONCURRENCY,
+                  max_flood_retries=MAX_FLOOD_RETRIES, limiter=None, account=None):
+    """
+    Run ``send(destination)`` for every destination concurrently.
+
+    Args:
+        destinations: Iterable of destination identifiers
+        send: Coroutine function taking a destination
+        concurrency: Maximum number of sends in flight at once
+        max_flood_retries: Retries per destination after a FloodWaitError
+        limiter: RateLimiter pacing the sends, or None to only honour FloodWait
+        account: Account name used for the limiter's per-account bucket
+
+    Returns:
+        List of SendResult in the order of ``destinations``
+    """
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    results = [SendResult(destination) for destination in destinations]
+    await asyncio.gather(*(
+        _send_one(result, send, semaphore, limiter, account, max_flood_retries)
+        for result in results
+    ))
+    return results
+
+
+def prerender_messages(messages, targets=None, parse_mode='md'):
+    """
+    Destination -> pre-rendered chunks for ``messages``.
+
+    Rendering is cached, so calling this ahead of time (e.g. before a
+    scheduled slot) makes the later broadcast skip all parsing.
+    """
+    if isinstance(messages, str):
+        messages = {destination: messages for destination in targets}
+    return {destination: prerender(text, parse_mode) for destination, text in messages.items()}
+
+
+async def _send_through_outbox(client, outbox, rendered, destinations, job, scheduled_date, expires,
+                               kwargs):
+    """Log one send_message per destination and wait for the outcomes"""
+    await outbox.start(client)
+    day = scheduled_date or date.today()
+    # Sends a crashed run already logged are resumed by the outbox, not logged again
+    queued = {item.target: item.future for item in outbox.pending("send_message")
+              if job is not None and item.args.get("job") == job and item.args.get("date") == day.isoformat()}
+    new = [destination for destination in destinations if destination not in queued]
+    if expires is None:
+        # A daily post still unsent the next day is dead-lettered instead
+        expires = datetime.combine(day + timedelta(days=1), datetime.min.time()).timestamp()
+
+    def args(destination):
+        return {"chunks": encode_value(rendered[destination]), "kwargs": encode_value(kwargs),
+                "job": job, "date": day.isoformat(), "expires": expires}
+
+    started = time.monotonic()
+    # Put together, so they share one group commit
+    futures = dict(queued)
+    futures.update(zip(new, await asyncio.gather(*(
+        outbox.put("send_message", destination, args(destination)) for destination in new))))
+
+    async def outcome(destination):
+        result = SendResult(destination)
+        result.started = started
+        result.attempts = 1
+        try:
+            result.value = await futures[destination]
+            result.ok = True
+            # None: the ledger already had it sent, or another send claimed it
+            result.skipped = result.value is None
+            if not result.skipped:
+                metrics.sent()
+        except Exception as e:
+            result.error = e
+        result.finished = time.monotonic()
+        return result
+
+    return await asyncio.gather(*(outcome(destination) for destination in destinations))
+
+
+async def broadcast(client, messages, targets=None, concurrency=DEFAULT_CONCURRENCY,
+                    peer_cache=DEFAULT_PEER_CACHE, limiter=DEFAULT_RATE_LIMITER,
+                    ledger=None, job=None, scheduled_date=None, outbox=None, expires=None, **kwargs):
+    """
+    Send messages to many destinations through ``client.send_message``.
+
+    Each text is pre-rendered once into (text, entities) chunks that fit the
+    message length limit, so a post longer than 4096 characters goes out as
+    several messages instead of failing.
+
+    Args:
+        client: Connected TelegramClient
+        messages: Dict of destination -> text, or a single text for all targets
+        targets: Destinations to use when ``messages`` is a single text
+        concurrency: Maximum number of sends in flight at once
+        peer_cache: PeerCache used to skip entity resolution, or None
+        limiter: RateLimiter pacing the sends, or None
+        ledger: SendLedger making the broadcast idempotent per ``job`` and day
+        job: Job name recorded in the ledger
+        scheduled_date: Day the broadcast belongs to, today by default
+        outbox: Outbox logging and retrying the sends, or None to try each
+            destination once; its own concurrency, limiter, peer cache and
+            ledger are used then
+        expires: Unix time after which the outbox dead-letters a send still
+            not made, the end of ``scheduled_date`` by default
+        **kwargs: Passed through to ``send_message`` (link_preview, parse_mode, ...)
+
+    Returns:
+        List of SendResult; ``value`` holds the list of sent messages
+    """
+    parse_mode = kwargs.pop('parse_mode', 'md')
+    rendered = prerender_messages(messages, targets, parse_mode)
+
+    pending = list(rendered)
+    if ledger is not None:
+        pending = ledger.missing(job, pending, scheduled_date)
+
+    async def send(destination):
+        # Checked right before the send, not only when the broadcast started
+        if ledger is not None and not ledger.claim(job, destination, scheduled_date):
+            raise _AlreadyClaimed(destination)
+
+        async def send_to(peer):
+            return await send_prerendered(client, peer, rendered[destination], **kwargs)
+
+        try:
+            if peer_cache is None:
+                sent_messages = await send_to(destination)
+            else:
+                sent_messages = await peer_cache.call(client, destination, send_to)
+        except BaseException:
+            if ledger is not None:
+                ledger.release(job, destination, scheduled_date)
+            raise
+        if ledger is not None:
+            first = sent_messages[0] if sent_messages else None
+            ledger.record(job, destination, scheduled_date, getattr(first, 'id', None))
+        return sent_messages
+
+    if outbox is not None:
+        outcomes = await _send_through_outbox(client, outbox, rendered, pending,
+                                              job if ledger is not None else None, scheduled_date, expires,
+                                              kwargs)
+    else:
+        outcomes = await fan_out(pending, send, concurrency=concurrency, limiter=limiter)
+    sent = {result.destination: result for result in outcomes}
+    results = []
+    for destination in rendered:
+        result = sent.get(destination)
+        if result is None:
+            result = SendResult(destination)
+            result.ok = result.skipped = True
+        elif isinstance(result.error, _AlreadyClaimed):
+            result.ok = result.skipped = True
+            result.error = None
+        results.append(result)
+    return results
+
+
+def print_report(results):
+    """Print one status line per destination"""
+    for result in results:
+        if result.skipped:
+            print(f"⏭️ Already sent to {result.destination}")
+        elif result.ok:
+            print(f"✅ Sent to {result.destination} in {result.elapsed:.2f}s")
+        else:
+            print(f"❌ Failed to send to {result.destination}: {result.error}")
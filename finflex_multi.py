@@ -1,5 +1,7 @@
-import asyncio
-from telethon import TelegramClient, events
+from broker_client import session_client
+from forward_routes import COPY
+from forwarder import Forwarder, Route
+import metrics
 
 api_id = 27647645
 api_hash = "2cdcf90271ae9b647a9561f5f2b0aade"
@@ -7,25 +9,19 @@ api_hash = "2cdcf90271ae9b647a9561f5f2b0aade"
 source_channel = "FinFlex0"  # Try using a username first
 target_accounts = ["Trade_Proooo", "CliffCapital", "AlphaInvest0", "tradesavvy999"]
 
-client = TelegramClient("session_name", api_id, api_hash)
+# Refuses to start while broker.py holds the session
+client = session_client("session_name", api_id, api_hash)
+metrics.install()
 
-@client.on(events.NewMessage(chats=source_channel))
-async def copy_to_account(event):
-    print(f"📩 New message detected in {source_channel}: {event.message.text or '[MEDIA]'}")
-
-    for account in target_accounts:
-        try:
-            if event.message.text:
-                await client.send_message(account, event.message.text)
-            elif event.message.media:
-                await client.send_file(account, event.message.media, caption=event.message.text)
-            print(f"✅ Message forwarded to {account}")
-        except Exception as e:
-            print(f"❌ Error sending to {account}: {e}")
+# Targets are copied to in parallel, each one keeps the source order and
+# albums go out in one request. Media that cannot be copied by reference is
+# downloaded and uploaded once. Posts missed while this script was down are
+# copied first on startup, and failed copies are retried from .outbox/.
+forwarder = Forwarder(client, [Route(source_channel, COPY, target_accounts)], workers=4)
 
 async def main():
     await client.start()
     print("🚀 Bot is running...")
-    await client.run_until_disconnected()
+    await forwarder.run()
 
 client.loop.run_until_complete(main())
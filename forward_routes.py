@@ -0,0 +1,24 @@
+"""
+Routing table of the forwarder (see forwarder.py).
+
+Each route mirrors one source chat to its targets, either by forwarding
+the messages (FORWARD, keeps the "Forwarded from" header) or by copying
+them as our own posts (COPY). Adding a source is one more entry here.
+"""
+
+FORWARD = "forward"
+COPY = "copy"
+
+ROUTES = [
+    # (source, mode, targets)
+    ("t.me/MarketPrimeDaily", FORWARD, [
+        "Trade_Proooo", "CliffCapital", "AlphaInvest0", "tradesavvy999", "FinFlex0",
+        "t.me/+M4WgsaOvIYExMWE1", "t.me/+rD5KolqapallNmRl", "t.me/+H-YpbIqETXEyYTc1",
+    ]),
+    ("FinFlex0", COPY, [
+        "Trade_Proooo", "CliffCapital", "AlphaInvest0", "tradesavvy999",
+    ]),
+    ("t.me/jobformyselfonly", COPY, [
+        "t.me/DeepakRaghava", "t.me/iamsmk12", "t.me/copyofjobupdatesmyself",
+    ]),
+]
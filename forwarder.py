@@ -0,0 +1,241 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Forwarder
+
+Mirrors every source in forward_routes.ROUTES from one process on one
+connection, instead of one process, session and hard-coded handler per
+source (3_00_forward_message.py, finflex_multi.py, non_premium.py).
+
+Sources are resolved to chat ids once at startup. A single NewMessage
+handler looks the route of each message up by chat id in a dict, groups
+albums, and logs one delivery per target in the forwarder's Outbox (see
+outbox.py), so every target keeps the source order while targets proceed
+in parallel, and failed deliveries are retried instead of lost.
+For forward routes, what arrives for one target within --coalesce-window
+seconds is forwarded with a single request of up to 100 ids.
+
+Each source's last logged message id is kept in forward_state.db. On
+startup the outbox resumes what was logged but not delivered, and whatever
+was posted while the forwarder was down is mirrored first (see
+backfill.py), while live messages are held back; they are released once
+the catch-up is logged, skipping ids it already covered. A catch-up that
+fails is retried with backoff from the last id it queued, and live
+messages stay held until it succeeds, so the watermark never passes a
+message that was not logged.
+
+The forwarder needs the session's update stream, so it opens the session
+itself and refuses to start while broker.py is running.
+
+Usage:
+    python forwarder.py [--workers 8] [--coalesce-window 0.25]
+"""
+
+import argparse
+import asyncio
+import logging
+
+from telethon import events
+
+import metrics
+import settings
+from backfill import DEFAULT_WATERMARKS, FORWARD_BATCH, batches, fetch_gap
+from broker_client import session_client
+from forward_routes import COPY, FORWARD, ROUTES
+from forwarding import COALESCE_WINDOW, AlbumCollector, Coalescer
+from media_relay import MediaRelay
+from outbox import Outbox, backoff
+from parallel_transfer import ParallelTransfer
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S'
+)
+logger = logging.getLogger('forwarder')
+
+DEFAULT_WORKERS = 8
+
+
+class Route:
+    """One source chat mirrored to its targets in FORWARD or COPY mode"""
+
+    def __init__(self, source, mode, targets):
+        if mode not in (FORWARD, COPY):
+            raise ValueError(f"Unknown mode {mode!r} for {source}")
+        self.source = source
+        self.mode = mode
+        self.targets = list(targets)
+        self.chat_id = None
+
+    @property
+    def batch_limit(self):
+        """Messages handed over at once when catching up"""
+        return FORWARD_BATCH if self.mode == FORWARD else 1
+
+    @property
+    def op(self):
+        """Outbox operation delivering a message or a whole album to one target"""
+        return "copy" if self.mode == COPY else "forward"
+
+    def __repr__(self):
+        return f"<Route {self.source} {self.mode} -> {len(self.targets)} targets>"
+
+
+class Forwarder:
+    """One NewMessage handler serving every route"""
+
+    def __init__(self, client, routes, workers=DEFAULT_WORKERS, watermarks=DEFAULT_WATERMARKS,
+                 coalesce_window=COALESCE_WINDOW, outbox=None):
+        self.client = client
+        self.routes = list(routes)
+        # Copied media that cannot go by reference is transferred once for all
+        # targets, large files over several connections in parallel
+        self.relay = MediaRelay(transfer=ParallelTransfer())
+        # Deliveries are paced only by FloodWait, as before
+        self.outbox = outbox or Outbox(concurrency=workers, limiter=None, relay=self.relay)
+        self.outbox.relay = self.outbox.relay or self.relay
+        self.albums = AlbumCollector(self._enqueue)
+        # Forward batches per (source, target) are merged into one request
+        self.coalescer = Coalescer(self._put_coalesced, window=coalesce_window)
+        self.watermarks = watermarks
+        self._by_chat = {}
+        # Chat id -> live messages held back while that source catches up
+        self._held = {}
+
+    @classmethod
+    def from_config(cls, client, routes=ROUTES, **kwargs):
+        return cls(client, [Route(*route) for route in routes], **kwargs)
+
+    async def resolve(self):
+        """Map each route's source to its chat id"""
+        for route in self.routes:
+            route.chat_id = await self.client.get_peer_id(route.source)
+            if route.chat_id in self._by_chat:
+                raise ValueError(f"{route.source} is routed twice")
+            self._by_chat[route.chat_id] = route
+            logger.info(f"{route.source} ({route.chat_id}): {route.mode} to {', '.join(route.targets)}")
+        # Targets (invite links included) are resolved once, then sent to by cached peer
+        await self.outbox.peer_cache.warm(self.client, [t for route in self.routes for t in route.targets])
+
+    def route_for(self, chat_id):
+        return self._by_chat.get(chat_id)
+
+    def start(self):
+        """Register the single handler; live messages wait for catch_up()"""
+        self._held = {chat_id: [] for chat_id in self._by_chat}
+        self.client.add_event_handler(self._on_message, events.NewMessage(chats=list(self._by_chat)))
+
+    async def _on_message(self, event):
+        if event.chat_id not in self._by_chat:
+            return
+        held = self._held.get(event.chat_id)
+        if held is not None:
+            held.append(event.message)
+            return
+        await self.albums.add(event.message)
+
+    async def catch_up(self):
+        """Mirror what every source posted while down, then go live"""
+        await asyncio.gather(*(self._catch_up(route) for route in self.routes))
+
+    async def _catch_up(self, route):
+        last_id = self.watermarks.get(route.chat_id)
+        failures = 0
+        while True:
+            try:
+                if last_id is None:
+                    # First run: start from the newest message, not the whole history
+                    latest = await self.client.get_messages(route.source, limit=1)
+                    last_id = latest[0].id if latest else 0
+                    self.watermarks.advance(route.chat_id, last_id)
+                else:
+                    missed = await fetch_gap(self.client, route.source, last_id)
+                    if missed:
+                        logger.info(f"Catching up {len(missed)} messages of {route.source}")
+                    for batch in batches(missed, route.batch_limit):
+                        await self._enqueue(batch)
+                        # A retry starts after what was queued
+                        last_id = max(last_id, batch[-1].id)
+                break
+            except Exception as e:
+                # Live messages stay held: released now, they would move the watermark past the gap
+                failures += 1
+                delay = backoff(failures)
+                logger.error(f"Catching up {route.source} failed ({e}), retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+
+        # Release held messages in order; newer ones keep queueing behind them
+        held = self._held[route.chat_id]
+        held.sort(key=lambda m: m.id)
+        while held:
+            message = held.pop(0)
+            if message.id > last_id:
+                await self.albums.add(message)
+        del self._held[route.chat_id]
+
+    async def _enqueue(self, messages):
+        route = self._by_chat[messages[0].chat_id]
+        done = self.watermarks.completion(route.chat_id, messages, len(route.targets))
+        if route.mode == FORWARD:
+            for target in route.targets:
+                await self.coalescer.add((route.chat_id, target), messages, done)
+        else:
+            # Logged together, so all targets share one group commit
+            await asyncio.gather(*(self._put(route, target, messages, [done]) for target in route.targets))
+
+    async def _put_coalesced(self, key, messages, dones):
+        chat_id, target = key
+        await self._put(self._by_chat[chat_id], target, messages, dones)
+
+    async def _put(self, route, target, messages, dones):
+        args = {"from_chat": route.chat_id, "ids": [message.id for message in messages]}
+        await self.outbox.put(route.op, target, args, hint=messages)
+        # On disk now: the outbox delivers it even if the process dies first
+        for done in dones:
+            done()
+
+    async def drain(self):
+        """Deliver everything collected so far and wait until it is sent"""
+        await self.albums.flush_all()
+        await self.coalescer.flush_all()
+        await self.outbox.join()
+
+    async def run(self):
+        """Resolve, resume the outbox, catch up and forward live messages until disconnected"""
+        await self.resolve()
+        await self.outbox.start(self.client)
+        self.start()
+        # Catching up may retry for a while; a disconnect ends it with the run
+        catching_up = asyncio.ensure_future(self.catch_up())
+        try:
+            await self.client.run_until_disconnected()
+        finally:
+            catching_up.cancel()
+            await asyncio.gather(catching_up, return_exceptions=True)
+            await self.outbox.stop()
+            await self.relay.transfer.close()
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Mirror every routed source chat from one process")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS,
+                        help="Targets delivered to in parallel (default 8)")
+    parser.add_argument("--coalesce-window", type=float, default=COALESCE_WINDOW,
+                        help="Seconds to gather posts per target into one forward request")
+    return parser.parse_args()
+
+
+async def main():
+    args = parse_arguments()
+    metrics.install()
+    client = session_client(settings.SESSION_NAME, settings.API_ID, settings.API_HASH)
+    forwarder = Forwarder.from_config(client, workers=args.workers, coalesce_window=args.coalesce_window)
+    async with client:
+        print(f"🚀 Forwarding {len(forwarder.routes)} sources...")
+        await forwarder.run()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
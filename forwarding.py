@@ -0,0 +1,173 @@
+"""
+Shared helpers for the channel mirrors.
+
+AlbumCollector groups the separate NewMessage events Telegram emits for
+the items of one album (same grouped_id) and hands them over as a single
+batch once no new item arrived for a short window. forward_batch() and
+copy_batch() then deliver a batch to a target in one request, whether it
+is a single message or a 10-item album; copy_batch() can route media
+through a MediaRelay (see media_relay.py).
+
+Coalescer merges the batches bound for one (source, target) pair within a
+short window, so a burst of posts is forwarded to each target with one
+forward_messages request of up to 100 ids instead of one per post.
+
+Both hand a batch over from a timer when its window closes; if that
+delivery fails the error is logged, and flush_all() waits for it.
+"""
+
+import asyncio
+import logging
+
+import metrics
+
+logger = logging.getLogger('forwarding')
+
+ALBUM_WINDOW = 0.5
+COALESCE_WINDOW = 0.25
+# Message ids per forward_messages request (Telegram's maximum)
+MAX_FORWARD_IDS = 100
+
+
+class _TimedFlushes:
+    """Flushes started by a timer, kept so their failures are logged and awaited"""
+
+    def __init__(self):
+        self._tasks = set()
+
+    def start(self, flush, key):
+        task = asyncio.ensure_future(flush(key))
+        self._tasks.add(task)
+        task.add_done_callback(lambda task: self._done(task, key))
+
+    def _done(self, task, key):
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"Delivering the batch for {key} failed", exc_info=task.exception())
+
+    async def wait(self):
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+
+class AlbumCollector:
+    """Buffers album items and calls ``callback(messages)`` once per album"""
+
+    def __init__(self, callback, window=ALBUM_WINDOW):
+        self.callback = callback
+        self.window = window
+        self._albums = {}
+        self._timers = {}
+        self._flushes = _TimedFlushes()
+
+    async def add(self, message):
+        key = (message.chat_id, message.grouped_id)
+        # Anything after an album closes it, so the source order is kept
+        for pending in [k for k in self._albums if k[0] == key[0] and k != key]:
+            self._timers.pop(pending).cancel()
+            await self._flush(pending)
+
+        if not message.grouped_id:
+            await self.callback([message])
+            return
+
+        self._albums.setdefault(key, []).append(message)
+        timer = self._timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+        self._timers[key] = asyncio.get_running_loop().call_later(
+            self.window, self._flushes.start, self._flush, key)
+
+    async def _flush(self, key):
+        self._timers.pop(key, None)
+        messages = self._albums.pop(key, [])
+        if messages:
+            await self.callback(sorted(messages, key=lambda m: m.id))
+
+    async def flush_all(self):
+        for key in list(self._albums):
+            timer = self._timers.pop(key, None)
+            if timer is not None:
+                timer.cancel()
+            await self._flush(key)
+        await self._flushes.wait()
+
+
+class Coalescer:
+    """
+    Merges batches per key and calls ``callback(key, messages, tokens)``.
+
+    The first batch for a key opens a ``window``; everything added for that
+    key until it closes is delivered as one batch in arrival order, along
+    with the token passed with each part. A batch is delivered early once
+    it holds ``limit`` messages.
+    """
+
+    def __init__(self, callback, window=COALESCE_WINDOW, limit=MAX_FORWARD_IDS):
+        self.callback = callback
+        self.window = window
+        self.limit = limit
+        self._pending = {}
+        self._timers = {}
+        self._flushes = _TimedFlushes()
+
+    async def add(self, key, messages, token=None):
+        pending = self._pending.get(key)
+        if pending is not None and len(pending[0]) + len(messages) > self.limit:
+            await self._flush(key)
+            pending = None
+        if pending is None:
+            pending = self._pending[key] = ([], [])
+            self._timers[key] = asyncio.get_running_loop().call_later(
+                self.window, self._flushes.start, self._flush, key)
+        pending[0].extend(messages)
+        pending[1].append(token)
+        if len(pending[0]) >= self.limit:
+            await self._flush(key)
+
+    async def _flush(self, key):
+        timer = self._timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+        pending = self._pending.pop(key, None)
+        if pending is not None:
+            await self.callback(key, *pending)
+
+    async def flush_all(self):
+        for key in list(self._pending):
+            await self._flush(key)
+        await self._flushes.wait()
+
+
+async def forward_batch(client, target, messages, from_peer=None):
+    """
+    Forward a message or a whole album with one request.
+
+    ``messages`` may also be message ids of the chat ``from_peer``.
+    """
+    with metrics.rpc("forward_messages"):
+        return await client.forward_messages(target, messages, from_peer=from_peer)
+
+
+async def copy_batch(client, target, messages, relay=None):
+    """
+    Re-send a message or a whole album as our own post.
+
+    With a MediaRelay, media that cannot be re-sent by reference is
+    downloaded and uploaded once and shared by every target.
+    """
+    if len(messages) == 1:
+        message = messages[0]
+        if message.media and not message.web_preview:
+            if relay is not None:
+                return await relay.send(client, target, messages, single=True, caption=message.text)
+            with metrics.rpc("send_file"):
+                return await client.send_file(target, message.media, caption=message.text)
+        with metrics.rpc("send_message"):
+            return await client.send_message(target, message.text)
+
+    media_messages = [message for message in messages if message.media]
+    captions = [message.text or "" for message in media_messages]
+    if relay is not None:
+        return await relay.send(client, target, media_messages, caption=captions)
+    with metrics.rpc("send_file"):
+        return await client.send_file(target, [message.media for message in media_messages], caption=captions)
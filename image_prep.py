@@ -0,0 +1,137 @@
+"""
+Pillow preprocessing for images sent as Telegram photos.
+
+Telegram recompresses every photo to at most 1280px on the long side, so
+uploading larger or higher-quality files only pays for bytes that are
+thrown away. prepare_images() resizes and re-encodes the images ahead of
+time in a process pool and keeps the derivatives in .image_cache/, keyed
+by the source's content hash. A manifest remembers each source's size and
+mtime, so unchanged files are not even re-hashed on later runs.
+
+A derivative that does not come out smaller than its source is not used.
+"""
+
+import hashlib
+import json
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+logger = logging.getLogger('image_prep')
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+CACHE_DIR = os.path.join(BASE_DIR, ".image_cache")
+MANIFEST_NAME = "manifest.json"
+
+# Telegram's own photo size and a quality it will not noticeably re-degrade
+MAX_SIDE = 1280
+QUALITY = 85
+# Bumped when rendering changes, so older derivatives are not reused
+RENDER_VERSION = 2
+
+
+def _source_hash(path):
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 16), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def _render(source, destination, max_side, quality):
+    """Resize and re-encode one image; runs in a worker process"""
+    with Image.open(source) as image:
+        # Bake the EXIF orientation into the pixels; the JPEG is saved without EXIF
+        image = ImageOps.exif_transpose(image).convert("RGB")
+        image.thumbnail((max_side, max_side), Image.LANCZOS)
+        tmp_path = destination + ".tmp"
+        image.save(tmp_path, "JPEG", quality=quality, optimize=True, progressive=True)
+    os.replace(tmp_path, destination)
+    return destination
+
+
+class ImageCache:
+    """Derivatives on disk plus a manifest of source size/mtime/hash"""
+
+    def __init__(self, cache_dir=CACHE_DIR, max_side=MAX_SIDE, quality=QUALITY):
+        self.cache_dir = cache_dir
+        self.max_side = max_side
+        self.quality = quality
+        self.manifest_path = os.path.join(cache_dir, MANIFEST_NAME)
+        self.manifest = {}
+        if os.path.exists(self.manifest_path):
+            try:
+                with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                    self.manifest = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.warning(f"Ignoring unreadable image manifest: {e}")
+
+    def save(self):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.manifest, f, indent=2)
+        os.replace(tmp_path, self.manifest_path)
+
+    def source_hash(self, path):
+        """Content hash of ``path``, reused while its size and mtime are unchanged"""
+        stat = os.stat(path)
+        entry = self.manifest.get(os.path.abspath(path))
+        if entry and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime_ns:
+            return entry["hash"]
+        digest = _source_hash(path)
+        self.manifest[os.path.abspath(path)] = {
+            "size": stat.st_size, "mtime": stat.st_mtime_ns, "hash": digest}
+        return digest
+
+    def derivative_path(self, digest):
+        return os.path.join(self.cache_dir, f"{digest[:32]}_{self.max_side}q{self.quality}v{RENDER_VERSION}.jpg")
+
+
+def prepare_images(paths, cache=None, workers=None):
+    """
+    Map each image path to the file that should actually be uploaded.
+
+    Missing derivatives are rendered in parallel in a process pool. Paths
+    that do not exist, cannot be decoded, or would not shrink map to
+    themselves.
+    """
+    result = {path: path for path in paths}
+    if Image is None:
+        logger.warning("Pillow is not installed, sending images unprocessed")
+        return result
+
+    cache = cache or ImageCache()
+    os.makedirs(cache.cache_dir, exist_ok=True)
+    todo = {}
+    for path in paths:
+        if not os.path.isfile(path):
+            continue
+        derivative = cache.derivative_path(cache.source_hash(path))
+        if os.path.exists(derivative):
+            result[path] = derivative
+        else:
+            todo[path] = derivative
+
+    if todo:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {
+                path: pool.submit(_render, path, derivative, cache.max_side, cache.quality)
+                for path, derivative in todo.items()
+            }
+            for path, future in futures.items():
+                try:
+                    result[path] = future.result()
+                except Exception as e:
+                    logger.warning(f"Could not preprocess {path}: {e}")
+    cache.save()
+
+    for path, derivative in result.items():
+        if derivative != path and os.path.getsize(derivative) >= os.path.getsize(path):
+            result[path] = path
+    return result
@@ -0,0 +1,251 @@
+"""
+Upload-once, send-many cache for local media files.
+
+Files are keyed by the SHA-256 of their content. The first send uploads the
+bytes; the resulting photo/document reference (id, access hash and file
+reference) is stored in media_cache.json together with the message it came
+from. Every later send, to any channel and on any later day, re-sends that
+reference instead of uploading again. When Telegram reports the file
+reference as expired, it is refreshed by re-fetching the original message.
+
+Albums are prepared in parallel: every uncached image is uploaded and turned
+into a photo with UploadMedia concurrently, then the whole album goes out as
+one grouped-media request.
+
+With a ParallelTransfer (see parallel_transfer.py), files above its size
+threshold are uploaded over several connections.
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+
+from telethon import errors, utils
+from telethon.tl import functions, types
+
+import metrics
+from peer_cache import peer_from_dict, peer_to_dict
+
+logger = logging.getLogger('media_cache')
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_PATH = os.path.join(BASE_DIR, "media_cache.json")
+
+STALE_REFERENCE_ERRORS = (
+    errors.FileReferenceExpiredError,
+    errors.FileReferenceInvalidError,
+    errors.FileReferenceEmptyError,
+    errors.MediaEmptyError,
+)
+
+_hash_memo = {}
+
+
+async def _send_file(client, entity, file, **kwargs):
+    with metrics.rpc("send_file"):
+        return await client.send_file(entity, file, **kwargs)
+
+
+def file_hash(path):
+    """SHA-256 of a file's content, memoized by path, size and mtime"""
+    stat = os.stat(path)
+    memo_key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    digest = _hash_memo.get(memo_key)
+    if digest is None:
+        sha = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 16), b''):
+                sha.update(chunk)
+        digest = _hash_memo[memo_key] = sha.hexdigest()
+    return digest
+
+
+def media_to_dict(message):
+    if message.photo:
+        media, kind = message.photo, "photo"
+    elif message.document:
+        media, kind = message.document, "document"
+    else:
+        return None
+    return {
+        "kind": kind,
+        "id": media.id,
+        "access_hash": media.access_hash,
+        "file_reference": media.file_reference.hex(),
+    }
+
+
+def media_from_dict(data):
+    cls = types.InputPhoto if data["kind"] == "photo" else types.InputDocument
+    return cls(data["id"], data["access_hash"], bytes.fromhex(data["file_reference"]))
+
+
+class MediaCache:
+    """Content hash -> sent media reference, stored as JSON on disk"""
+
+    def __init__(self, path=DEFAULT_PATH, transfer=None):
+        self.path = path
+        self.transfer = transfer
+        self._entries = None
+        self._locks = {}
+        self._uploads = {}
+
+    def _load(self):
+        if self._entries is not None:
+            return
+        self._entries = {}
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self._entries = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable media cache {self.path}: {e}")
+
+    def save(self):
+        self._load()
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self._entries, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+    def get(self, key):
+        """Input media for a content hash, or None if never sent"""
+        self._load()
+        entry = self._entries.get(key)
+        return media_from_dict(entry["media"]) if entry else None
+
+    async def remember(self, key, message):
+        """Store the media of a sent ``message`` under ``key``"""
+        media = media_to_dict(message)
+        peer = peer_to_dict(await message.get_input_chat())
+        if media is None or peer is None:
+            return
+        self._load()
+        self._entries[key] = {"media": media, "peer": peer, "msg_id": message.id}
+        self.save()
+
+    def forget(self, key):
+        self._load()
+        if self._entries.pop(key, None) is not None:
+            self.save()
+
+    async def refresh(self, client, key):
+        """Fetch a fresh file reference from the original message"""
+        self._load()
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        try:
+            message = await client.get_messages(peer_from_dict(entry["peer"]), ids=entry["msg_id"])
+        except Exception as e:
+            logger.info(f"Could not refresh media {key[:12]}: {e}")
+            message = None
+        if message is None or media_to_dict(message) is None:
+            self.forget(key)
+            return None
+        await self.remember(key, message)
+        return self.get(key)
+
+    async def _file(self, client, path):
+        """``path`` itself, or a parallel upload of it when the file is large"""
+        if self.transfer is not None and self.transfer.wants(os.path.getsize(path)):
+            return await self.transfer.upload(client, path)
+        return path
+
+    def _lock_for(self, key):
+        if key not in self._locks:
+            self._locks[key] = asyncio.Lock()
+        return self._locks[key]
+
+    async def send_file(self, client, entity, path, **kwargs):
+        """
+        Send a local file, uploading it only if it was never sent before.
+
+        Concurrent sends of the same new file wait for the first upload and
+        then reuse its reference.
+        """
+        key = file_hash(path)
+        media = self.get(key)
+        if media is None:
+            async with self._lock_for(key):
+                media = self.get(key)
+                if media is None:
+                    message = await _send_file(client, entity, await self._file(client, path), **kwargs)
+                    await self.remember(key, message)
+                    return message
+
+        try:
+            return await _send_file(client, entity, media, **kwargs)
+        except STALE_REFERENCE_ERRORS:
+            media = await self.refresh(client, key)
+            if media is None:
+                message = await _send_file(client, entity, await self._file(client, path), **kwargs)
+                await self.remember(key, message)
+                return message
+            return await _send_file(client, entity, media, **kwargs)
+
+    async def prepare(self, client, entity, path):
+        """
+        Input media ready to be put in an album.
+
+        Cached files return their reference. New images are uploaded once
+        (concurrent callers share the upload) and converted into a photo,
+        so the album request itself carries no upload work.
+        """
+        key = file_hash(path)
+        media = self.get(key)
+        if media is not None:
+            return media
+
+        task = self._uploads.get(key)
+        if task is None:
+            task = self._uploads[key] = asyncio.ensure_future(self._upload(client, entity, path))
+        try:
+            return await task
+        except Exception:
+            # Let the next caller retry the upload
+            self._uploads.pop(key, None)
+            raise
+
+    async def _upload(self, client, entity, path):
+        if self.transfer is not None and self.transfer.wants(os.path.getsize(path)):
+            handle = await self.transfer.upload(client, path)
+        else:
+            with metrics.rpc("upload_file"):
+                handle = await client.upload_file(path)
+        if not utils.is_image(path):
+            return handle
+        result = await client(functions.messages.UploadMediaRequest(
+            await client.get_input_entity(entity),
+            types.InputMediaUploadedPhoto(handle)
+        ))
+        return utils.get_input_photo(result.photo)
+
+    async def prepare_album(self, client, entity, paths):
+        """Prepare every file of an album in parallel"""
+        return list(await asyncio.gather(*(self.prepare(client, entity, path) for path in paths)))
+
+    async def send_album(self, client, entity, paths, prepared=None, **kwargs):
+        """
+        Send ``paths`` as one grouped-media message.
+
+        ``prepared`` may hold the result of an earlier prepare_album() call,
+        which lets callers upload the next album while this one is sent.
+        """
+        media = prepared or await self.prepare_album(client, entity, paths)
+        try:
+            messages = await _send_file(client, entity, media, **kwargs)
+        except STALE_REFERENCE_ERRORS:
+            for path in paths:
+                await self.refresh(client, file_hash(path))
+            media = await self.prepare_album(client, entity, paths)
+            messages = await _send_file(client, entity, media, **kwargs)
+
+        for path, message in zip(paths, messages):
+            key = file_hash(path)
+            await self.remember(key, message)
+            self._uploads.pop(key, None)
+        return messages
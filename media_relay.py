@@ -0,0 +1,166 @@
+"""
+Download-once, upload-once relay for copied media.
+
+copy_batch() re-sends a source message's media by reference. That is
+refused when the reference cannot be reused (protected content, an expired
+or invalid file reference), and a per-target fallback would download and
+re-upload the same file once for every target. MediaRelay downloads each
+source photo or document at most once into a bounded buffer (kept in
+memory up to SPOOL_MEMORY bytes, spooled to a temporary file beyond),
+uploads it once, turns it into a reusable photo/document with UploadMedia
+and hands that same handle to every target. Concurrent relays of one media
+id share a single transfer, and at most ``transfers`` run at a time so
+the buffers stay bounded.
+
+With a ParallelTransfer (see parallel_transfer.py), media above its size
+threshold is downloaded into a resumable file under .transfers/ and moved
+over several connections in both directions instead.
+
+Usage:
+    relay = MediaRelay()
+    await copy_batch(client, target, messages, relay)
+"""
+
+import asyncio
+import collections
+import logging
+import os
+import tempfile
+
+from telethon import errors, utils
+from telethon.tl import functions, types
+
+import metrics
+from media_cache import STALE_REFERENCE_ERRORS
+from parallel_transfer import media_size
+
+logger = logging.getLogger('media_relay')
+
+# Bytes buffered in memory before a download spills to a temporary file
+SPOOL_MEMORY = 32 * 1024 * 1024
+# Downloads/uploads in flight at once
+DEFAULT_TRANSFERS = 2
+# Relayed handles kept for reuse, least recently used dropped first
+MAX_HANDLES = 256
+
+# Errors meaning the source media cannot be sent by reference
+RELAY_ERRORS = STALE_REFERENCE_ERRORS + (errors.ChatForwardsRestrictedError,)
+
+
+def media_key(message):
+    """Id of a message's photo or document, or None if it cannot be relayed"""
+    if message.photo:
+        return "photo", message.photo.id
+    if message.document:
+        return "document", message.document.id
+    return None
+
+
+async def _send_file(client, entity, file, **kwargs):
+    with metrics.rpc("send_file"):
+        return await client.send_file(entity, file, **kwargs)
+
+
+class MediaRelay:
+    """Source media id -> input media uploaded by us, shared by all targets"""
+
+    def __init__(self, spool_memory=SPOOL_MEMORY, transfers=DEFAULT_TRANSFERS, max_handles=MAX_HANDLES,
+                 transfer=None):
+        self.spool_memory = spool_memory
+        self.transfer = transfer
+        self.max_handles = max_handles
+        self._semaphore = asyncio.Semaphore(max(1, transfers))
+        self._handles = collections.OrderedDict()
+        self._tasks = {}
+
+    def get(self, message):
+        """Relayed input media for ``message``, or None"""
+        key = media_key(message)
+        handle = self._handles.get(key)
+        if handle is not None:
+            self._handles.move_to_end(key)
+        return handle
+
+    def _remember(self, key, handle):
+        self._handles[key] = handle
+        while len(self._handles) > self.max_handles:
+            self._handles.popitem(last=False)
+
+    async def relay(self, client, message, stale=None):
+        """
+        Input media for ``message``, downloading and uploading it only once.
+
+        ``stale`` is a handle a send just rejected; it is dropped so the
+        media is relayed again (still only once for all callers).
+        """
+        key = media_key(message)
+        if key is None:
+            raise ValueError(f"Message {message.id} has no photo or document to relay")
+        if stale is not None and self._handles.get(key) is stale:
+            del self._handles[key]
+        handle = self.get(message)
+        if handle is not None:
+            return handle
+
+        task = self._tasks.get(key)
+        if task is None:
+            task = self._tasks[key] = asyncio.ensure_future(self._transfer(client, message))
+            task.add_done_callback(lambda _: self._tasks.pop(key, None))
+        handle = await task
+        if key not in self._handles:
+            self._remember(key, handle)
+        return handle
+
+    async def _transfer(self, client, message):
+        name = f"{message.id}{utils.get_extension(message.media)}"
+        size = media_size(message)
+        async with self._semaphore:
+            if self.transfer is not None and self.transfer.wants(size):
+                kind, media_id = media_key(message)
+                os.makedirs(self.transfer.state_dir, exist_ok=True)
+                path = os.path.join(self.transfer.state_dir, f"relay_{kind}_{media_id}")
+                await self.transfer.download(client, message, path, size)
+                handle = await self.transfer.upload(client, path, name=name)
+                os.remove(path)
+            else:
+                with tempfile.SpooledTemporaryFile(max_size=self.spool_memory) as buffer:
+                    with metrics.rpc("download_media"):
+                        await client.download_media(message, file=buffer)
+                    size = buffer.tell()
+                    buffer.seek(0)
+                    with metrics.rpc("upload_file"):
+                        handle = await client.upload_file(buffer, file_size=size, file_name=name)
+        logger.info(f"Relayed media of message {message.id} ({size} bytes)")
+
+        if message.photo:
+            uploaded = types.InputMediaUploadedPhoto(handle)
+        else:
+            document = message.document
+            uploaded = types.InputMediaUploadedDocument(handle, document.mime_type, document.attributes)
+        with metrics.rpc("upload_media"):
+            result = await client(functions.messages.UploadMediaRequest(types.InputPeerSelf(), uploaded))
+        return utils.get_input_media(result)
+
+    def media_for(self, message):
+        """What to send for ``message`` before anything was rejected"""
+        return self.get(message) or message.media
+
+    async def send(self, client, entity, messages, single=False, **kwargs):
+        """
+        send_file the media of ``messages`` to ``entity``.
+
+        Media goes by reference where possible. Protected sources, and any
+        media Telegram refuses by reference, are relayed instead.
+        """
+        if any(getattr(m, 'noforwards', False) for m in messages):
+            media = await asyncio.gather(*(self.relay(client, m) for m in messages))
+        else:
+            media = [self.media_for(m) for m in messages]
+        try:
+            return await _send_file(client, entity, media[0] if single else media, **kwargs)
+        except RELAY_ERRORS as e:
+            if any(media_key(m) is None for m in messages):
+                raise
+            logger.info(f"Media for {entity} refused by reference ({e.__class__.__name__}), relaying")
+            media = await asyncio.gather(*(self.relay(client, m, stale) for m, stale in zip(messages, media)))
+            return await _send_file(client, entity, media[0] if single else media, **kwargs)
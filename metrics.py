@@ -0,0 +1,278 @@
+"""
+Process-wide metrics for the broadcast scripts, forwarders and daemons.
+
+Series:
+    telegram_send_latency_seconds   histogram per destination
+    telegram_rpc_total              counter per request kind and outcome
+    telegram_flood_waits_total      counter per destination
+    telegram_flood_wait_seconds_total counter of seconds lost per destination
+    outbox_depth                    gauge of outbox operations not sent or dead yet
+    scheduler_lag_seconds           planned fire time to first successful send, per job
+    startup_phase_seconds           interpreter, import, connect and first-send time
+
+install() exposes them in Prometheus text format on a local HTTP endpoint
+(http://127.0.0.1:9464/metrics, or the next free port) and dumps them to
+.metrics/<script>.json when the process exits.
+"""
+
+import atexit
+import bisect
+import contextvars
+import json
+import logging
+import os
+import sys
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from telethon import errors
+
+logger = logging.getLogger('metrics')
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DUMP_DIR = os.path.join(BASE_DIR, ".metrics")
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = int(os.environ.get("METRICS_PORT", 9464))
+# Several scripts run side by side; each takes the next free port
+PORT_ATTEMPTS = 10
+
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _label_key(labels, values):
+    return tuple(str(values.get(label, "")) for label in labels)
+
+
+def _format_labels(labels, key, extra=None):
+    pairs = list(zip(labels, key))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    inner = ",".join('{}="{}"'.format(name, value.replace('\\', '\\\\').replace('"', '\\"'))
+                     for name, value in pairs)
+    return "{" + inner + "}"
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(self.labels, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, key, None, value) for key, value in self._values.items()]
+
+    def to_dict(self):
+        with self._lock:
+            return [{"labels": dict(zip(self.labels, key)), "value": value}
+                    for key, value in self._values.items()]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        key = _label_key(self.labels, labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = _label_key(self.labels, labels)
+        with self._lock:
+            counts, total = self._values.get(key) or ([0] * (len(self.buckets) + 1), 0.0)
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._values[key] = (counts, total + value)
+
+    def samples(self):
+        result = []
+        with self._lock:
+            for key, (counts, total) in self._values.items():
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float('inf'),), counts):
+                    cumulative += count
+                    le = "+Inf" if bound == float('inf') else repr(bound)
+                    result.append((self.name + "_bucket", key, ("le", le), cumulative))
+                result.append((self.name + "_sum", key, None, total))
+                result.append((self.name + "_count", key, None, cumulative))
+        return result
+
+    def to_dict(self):
+        with self._lock:
+            return [{"labels": dict(zip(self.labels, key)),
+                     "buckets": dict(zip([str(b) for b in self.buckets] + ["+Inf"], counts)),
+                     "sum": total, "count": sum(counts)}
+                    for key, (counts, total) in self._values.items()]
+
+
+class Registry:
+    """Named metrics of one process"""
+
+    def __init__(self):
+        self.metrics = {}
+
+    def _add(self, metric):
+        self.metrics.setdefault(metric.name, metric)
+        return self.metrics[metric.name]
+
+    def counter(self, name, help, labels=()):
+        return self._add(Counter(name, help, labels))
+
+    def gauge(self, name, help, labels=()):
+        return self._add(Gauge(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        return self._add(Histogram(name, help, labels, buckets))
+
+    def render(self):
+        """Prometheus text exposition format"""
+        lines = []
+        for metric in self.metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, key, extra, value in metric.samples():
+                lines.append(f"{name}{_format_labels(metric.labels, key, extra)} {value}")
+        return "\n".join(lines) + "\n"
+
+    def to_dict(self):
+        return {name: {"type": metric.kind, "help": metric.help, "samples": metric.to_dict()}
+                for name, metric in self.metrics.items()}
+
+    def dump(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        data = {"pid": os.getpid(), "dumped_at": datetime.now().isoformat(),
+                "metrics": self.to_dict()}
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=2)
+        os.replace(tmp_path, path)
+
+
+DEFAULT_REGISTRY = Registry()
+
+SEND_LATENCY = DEFAULT_REGISTRY.histogram(
+    "telegram_send_latency_seconds", "Time from first attempt to delivery", ["destination"])
+RPC_TOTAL = DEFAULT_REGISTRY.counter(
+    "telegram_rpc_total", "Telegram requests sent", ["op", "outcome"])
+FLOOD_WAITS = DEFAULT_REGISTRY.counter(
+    "telegram_flood_waits_total", "FloodWaitErrors received", ["destination"])
+FLOOD_WAIT_SECONDS = DEFAULT_REGISTRY.counter(
+    "telegram_flood_wait_seconds_total", "Seconds Telegram asked us to wait", ["destination"])
+OUTBOX_DEPTH = DEFAULT_REGISTRY.gauge(
+    "outbox_depth", "Operations waiting in the outbox", ["queue"])
+SCHEDULER_LAG = DEFAULT_REGISTRY.histogram(
+    "scheduler_lag_seconds", "Planned fire time to first successful send", ["job"])
+STARTUP_SECONDS = DEFAULT_REGISTRY.gauge(
+    "startup_phase_seconds", "Duration of each startup phase of the last run", ["phase"])
+
+
+@contextmanager
+def rpc(op):
+    """Count one Telegram request by outcome: ok, flood_wait or error"""
+    try:
+        yield
+    except errors.FloodWaitError:
+        RPC_TOTAL.inc(op=op, outcome="flood_wait")
+        raise
+    except Exception:
+        RPC_TOTAL.inc(op=op, outcome="error")
+        raise
+    RPC_TOTAL.inc(op=op, outcome="ok")
+
+
+def flood_wait(destination, seconds):
+    FLOOD_WAITS.inc(destination=destination)
+    FLOOD_WAIT_SECONDS.inc(seconds, destination=destination)
+
+
+# The scheduled run the current task belongs to; tasks it spawns inherit it
+_planned_run = contextvars.ContextVar('planned_run', default=None)
+
+
+def planned(job, fire_time):
+    """Mark the current task as the run of ``job`` planned for ``fire_time``"""
+    _planned_run.set({"job": job, "fire_time": fire_time, "recorded": False})
+
+
+def sent():
+    """Record scheduler lag on the first successful send of a planned run"""
+    run = _planned_run.get()
+    if run is None or run["recorded"]:
+        return
+    run["recorded"] = True
+    lag = (datetime.now() - run["fire_time"]).total_seconds()
+    SCHEDULER_LAG.observe(lag, job=run["job"])
+    logger.info(f"{run['job']} first send {lag:.3f}s after its planned time")
+
+
+class _Handler(BaseHTTPRequestHandler):
+    registry = DEFAULT_REGISTRY
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = self.registry.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(port=DEFAULT_PORT, host=DEFAULT_HOST, registry=DEFAULT_REGISTRY):
+    """Serve ``/metrics`` from a background thread; returns the server or None"""
+    handler = type("Handler", (_Handler,), {"registry": registry})
+    for candidate in range(port, port + PORT_ATTEMPTS):
+        try:
+            server = ThreadingHTTPServer((host, candidate), handler)
+        except OSError:
+            continue
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        logger.info(f"Metrics on http://{host}:{candidate}/metrics")
+        return server
+    logger.warning(f"No free metrics port in {port}-{port + PORT_ATTEMPTS - 1}, endpoint disabled")
+    return None
+
+
+_installed = False
+
+
+def install(port=DEFAULT_PORT, registry=DEFAULT_REGISTRY):
+    """Start the endpoint and dump the registry to .metrics/ at exit (once per process)"""
+    global _installed
+    if _installed:
+        return
+    _installed = True
+    script = os.path.splitext(os.path.basename(sys.argv[0] or "python"))[0] or "python"
+    path = os.path.join(DUMP_DIR, f"{script}.json")
+    atexit.register(registry.dump, path)
+    serve(port, registry=registry)
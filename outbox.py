@@ -0,0 +1,489 @@
+"""
+Durable outbound queue with retries.
+
+Every operation put into an Outbox is appended to a write-ahead log on
+disk (.outbox/<name>.wal) before it is sent, so a failed or interrupted
+send is never lost:
+  - failures are retried with exponential backoff and full jitter, and a
+    FloodWaitError waits exactly as long as Telegram asked (without using
+    up an attempt);
+  - requests Telegram rejects as invalid, and anything still failing after
+    ``max_attempts``, are moved to .outbox/<name>.dead.jsonl;
+  - on restart the log is replayed and every operation neither sent nor
+    dead is resumed in its original order, with its attempt count; one
+    whose ``expires`` timestamp has passed is dead-lettered instead.
+Operations for one target are sent strictly in order while targets
+proceed in parallel. Each target's lane holds at most ``lane_size``
+operations: put() waits while it is full, which pushes back on the
+producer instead of growing memory without bound. Log records of concurrent operations are written and
+fsynced together (group commit) instead of one fsync per record, and the
+log is compacted to the pending operations on every start and every
+COMPACT_RECORDS records.
+
+Operations (``args`` must be JSON-safe; TL objects via tl_json.encode_value):
+    send_message  {"chunks": [[text, entities], ...], "kwargs": {...},
+                   "job": ..., "date": ...}   job/date are claimed in the ledger
+                                               before sending and recorded after;
+                                               one already sent is acked unsent
+    forward       {"from_chat": chat id, "ids": [...]}
+    copy          {"from_chat": chat id, "ids": [...]}
+    send_file     {"path": path, "kwargs": {...}}      through the MediaCache
+    send_album    {"paths": [...], "kwargs": {...}}    through the MediaCache
+Without a media_cache, files go through the client's own send_file (a
+BrokerClient's broker uses its media cache).
+Any operation may carry "expires": a Unix time after which it is not sent.
+
+Usage:
+    outbox = Outbox("forwarder")
+    await outbox.start(client)
+    await outbox.put("forward", target, {"from_chat": chat_id, "ids": ids})
+"""
+
+import asyncio
+import collections
+import json
+import logging
+import os
+import random
+import sys
+import time
+from datetime import date
+
+from telethon import errors
+
+import metrics
+from forwarding import copy_batch, forward_batch
+from peer_cache import DEFAULT_PEER_CACHE
+from prerender import send_prerendered
+from rate_limiter import DEFAULT_RATE_LIMITER
+from send_ledger import DEFAULT_LEDGER
+from tl_json import decode_value
+
+logger = logging.getLogger('outbox')
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+OUTBOX_DIR = os.path.join(BASE_DIR, ".outbox")
+
+DEFAULT_CONCURRENCY = 8
+# Operations queued per target before put() waits
+DEFAULT_LANE_SIZE = 1000
+MAX_ATTEMPTS = 8
+# Backoff before retry n is a random delay up to min(MAX_BACKOFF, BASE_BACKOFF * 2 ** (n - 1))
+BASE_BACKOFF = 1.0
+MAX_BACKOFF = 300.0
+# Records appended before the log is compacted again
+COMPACT_RECORDS = 10000
+
+# Errors no retry can fix: bad requests, missing rights and missing local files
+PERMANENT_ERRORS = (errors.BadRequestError, errors.ForbiddenError, ValueError, FileNotFoundError)
+
+
+def default_name():
+    """Outbox name of the running script, e.g. "8_00_market_prime" """
+    name = os.path.splitext(os.path.basename(sys.argv[0] or ""))[0]
+    return name or "outbox"
+
+
+def backoff(attempts, base=BASE_BACKOFF, cap=MAX_BACKOFF):
+    """Full-jitter delay before retrying after ``attempts`` failures"""
+    return random.uniform(0, min(cap, base * 2 ** (attempts - 1)))
+
+
+class OutboxItem:
+    """One logged operation for one target"""
+
+    def __init__(self, id, op, target, args, attempts=0, hint=None):
+        self.id = id
+        self.op = op
+        self.target = target
+        self.args = args
+        self.attempts = attempts
+        # In-memory objects that save work on the first try (never logged)
+        self.hint = hint
+        # Result of the operation, or the error that sent it to the dead letters
+        self.future = asyncio.get_running_loop().create_future()
+
+    def to_record(self):
+        return {"put": self.id, "op": self.op, "target": self.target, "args": self.args,
+                "attempts": self.attempts}
+
+    def __repr__(self):
+        return f"<OutboxItem {self.id} {self.op} to {self.target} attempts={self.attempts}>"
+
+
+async def _send_message(outbox, item):
+    chunks = decode_value(item.args["chunks"])
+    kwargs = item.args.get("kwargs", {})
+    client = outbox.client
+    job = item.args.get("job") if outbox.ledger is not None else None
+    scheduled_date = date.fromisoformat(item.args["date"]) if item.args.get("date") else None
+
+    async def send_to(peer):
+        return await send_prerendered(client, peer, chunks, **kwargs)
+
+    # A crash between the ledger record and the ack replays a send that went out
+    if job and not outbox.ledger.claim(job, item.target, scheduled_date):
+        return None
+    try:
+        sent = await outbox.peer_cache.call(client, item.target, send_to)
+    except BaseException:
+        if job:
+            outbox.ledger.release(job, item.target, scheduled_date)
+        raise
+    if job:
+        first = sent[0] if sent else None
+        outbox.ledger.record(job, item.target, scheduled_date, getattr(first, 'id', None))
+    return sent
+
+
+async def _forward(outbox, item):
+    client = outbox.client
+
+    async def forward_to(peer):
+        if item.hint is not None:
+            return await forward_batch(client, peer, item.hint)
+        return await forward_batch(client, peer, item.args["ids"], from_peer=item.args["from_chat"])
+
+    return await outbox.peer_cache.call(client, item.target, forward_to)
+
+
+async def _copy(outbox, item):
+    client = outbox.client
+    messages = item.hint
+    if messages is None:
+        with metrics.rpc("get_messages"):
+            messages = await client.get_messages(item.args["from_chat"], ids=item.args["ids"])
+        # Deleted at the source since
+        messages = [message for message in messages if message is not None]
+        if not messages:
+            return None
+
+    async def copy_to(peer):
+        return await copy_batch(client, peer, messages, outbox.relay)
+
+    return await outbox.peer_cache.call(client, item.target, copy_to)
+
+
+def _check_files(paths):
+    """Fail at once on a missing local file; a broker would only report it as a BrokerError"""
+    for path in paths:
+        if not os.path.isfile(path):
+            raise FileNotFoundError(f"No such file: {path}")
+
+
+async def _send_file(outbox, item):
+    _check_files([item.args["path"]])
+    if outbox.media_cache is None:
+        # e.g. a BrokerClient, whose broker sends through its own media cache
+        return await outbox.client.send_file(item.target, item.args["path"], **item.args.get("kwargs", {}))
+    return await outbox.media_cache.send_file(outbox.client, item.target, item.args["path"],
+                                              **item.args.get("kwargs", {}))
+
+
+async def _send_album(outbox, item):
+    _check_files(item.args["paths"])
+    if outbox.media_cache is None:
+        return await outbox.client.send_file(item.target, item.args["paths"], **item.args.get("kwargs", {}))
+    # The hint is the album's prepare_album() result, uploaded ahead of time
+    return await outbox.media_cache.send_album(outbox.client, item.target, item.args["paths"],
+                                               prepared=item.hint, **item.args.get("kwargs", {}))
+
+
+OPERATIONS = {
+    "send_message": _send_message,
+    "forward": _forward,
+    "copy": _copy,
+    "send_file": _send_file,
+    "send_album": _send_album,
+}
+
+
+class Outbox:
+    """Write-ahead logged, per-target ordered queue of outbound operations"""
+
+    def __init__(self, name=None, concurrency=DEFAULT_CONCURRENCY, max_attempts=MAX_ATTEMPTS,
+                 limiter=DEFAULT_RATE_LIMITER, peer_cache=DEFAULT_PEER_CACHE, ledger=DEFAULT_LEDGER,
+                 relay=None, media_cache=None, directory=OUTBOX_DIR, lane_size=DEFAULT_LANE_SIZE):
+        self.name = name or default_name()
+        self.concurrency = max(1, concurrency)
+        self.lane_size = lane_size
+        self.max_attempts = max_attempts
+        self.limiter = limiter
+        self.peer_cache = peer_cache
+        self.ledger = ledger
+        self.relay = relay
+        self.media_cache = media_cache
+        self.path = os.path.join(directory, f"{self.name}.wal")
+        self.dead_path = os.path.join(directory, f"{self.name}.dead.jsonl")
+        self.client = None
+        self._items = {}
+        self._lanes = {}
+        self._lane_tasks = {}
+        # Target -> puts waiting to be logged, and the condition they wait on for room
+        self._reserved = {}
+        self._room = {}
+        self._next_id = 1
+        self._log = None
+        self._appended = 0
+        self._records = None
+        self._writer = None
+        self._semaphore = None
+        self._idle = None
+
+    @property
+    def depth(self):
+        """Operations logged but not sent or dead yet"""
+        return len(self._items)
+
+    def pending(self, op=None):
+        """Items not sent or dead yet, oldest first"""
+        return [item for item in self._items.values() if op is None or item.op == op]
+
+    def _replay(self):
+        """Pending items from the log, in order"""
+        items = {}
+        if not os.path.exists(self.path):
+            return items
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # A record torn by a crash mid-write; nothing after it was acknowledged
+                    logger.warning(f"Ignoring a torn record at the end of {self.path}")
+                    break
+                if "put" in record:
+                    items[record["put"]] = OutboxItem(record["put"], record["op"], record["target"],
+                                                      record["args"], record.get("attempts", 0))
+                elif "retry" in record and record["retry"] in items:
+                    items[record["retry"]].attempts = record["attempts"]
+                elif "ack" in record:
+                    items.pop(record["ack"], None)
+                elif "dead" in record:
+                    items.pop(record["dead"], None)
+        return items
+
+    def _snapshot(self):
+        return "".join(json.dumps(item.to_record()) + "\n" for item in self._items.values())
+
+    def _compact(self, snapshot):
+        """Rewrite the log as just the pending items in ``snapshot``"""
+        if self._log is not None:
+            self._log.close()
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(snapshot)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        self._log = open(self.path, 'a', encoding='utf-8')
+        self._appended = 0
+
+    async def start(self, client):
+        """Replay the log and resume every pending operation; idempotent"""
+        if self.client is not None:
+            return
+        self.client = client
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._items = self._replay()
+        self._next_id = max(self._items, default=0) + 1
+        self._compact(self._snapshot())
+        self._records = asyncio.Queue()
+        self._writer = asyncio.ensure_future(self._write_records())
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        self._idle = asyncio.Event()
+        self._idle.set()
+        if self._items:
+            logger.info(f"Resuming {len(self._items)} pending operations from {self.path}")
+        for item in self._items.values():
+            self._dispatch(item)
+
+    async def stop(self):
+        """Stop sending; pending operations stay in the log for the next start"""
+        for task in self._lane_tasks.values():
+            task.cancel()
+        await asyncio.gather(*self._lane_tasks.values(), return_exceptions=True)
+        self._lane_tasks.clear()
+        self._lanes.clear()
+        self._reserved.clear()
+        self._room.clear()
+        if self._writer is not None:
+            await self._records.join()
+            self._writer.cancel()
+            await asyncio.gather(self._writer, return_exceptions=True)
+            self._writer = None
+            self._log.close()
+            self._log = None
+        self.client = None
+
+    def _append(self, lines, count):
+        self._log.write(lines)
+        self._log.flush()
+        os.fsync(self._log.fileno())
+        self._appended += count
+
+    async def _write_records(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._records.get()]
+            while not self._records.empty():
+                batch.append(self._records.get_nowait())
+            lines = "".join(json.dumps(record) + "\n" for record, _ in batch)
+            try:
+                # Records logged while this fsync runs form the next group
+                await loop.run_in_executor(None, self._append, lines, len(batch))
+                if self._appended >= COMPACT_RECORDS:
+                    await loop.run_in_executor(None, self._compact, self._snapshot())
+                for _, written in batch:
+                    written.set_result(None)
+            except Exception as e:
+                for _, written in batch:
+                    written.set_exception(e)
+            finally:
+                for _ in batch:
+                    self._records.task_done()
+
+    async def _write(self, record):
+        """Append ``record`` to the log; returns once it is on disk"""
+        written = asyncio.get_running_loop().create_future()
+        await self._records.put((record, written))
+        await written
+
+    async def put(self, op, target, args, hint=None):
+        """
+        Log an operation, then queue it for sending.
+
+        Waits while ``target``'s lane is full, then returns once the
+        operation is on disk. The returned future resolves to the
+        operation's result, or raises if it ended in the dead letters.
+        """
+        if op not in OPERATIONS:
+            raise ValueError(f"Unknown outbox operation {op!r}")
+        if self.client is None:
+            raise RuntimeError("Outbox.start(client) must be called before put()")
+        await self._reserve(target)
+        try:
+            item = OutboxItem(self._next_id, op, target, args, hint=hint)
+            self._next_id += 1
+            self._items[item.id] = item
+            try:
+                await self._write(item.to_record())
+            except BaseException:
+                del self._items[item.id]
+                raise
+            self._dispatch(item)
+        finally:
+            await self._unreserve(target)
+        return item.future
+
+    def _load(self, target):
+        """Operations queued or being logged for ``target``"""
+        return len(self._lanes.get(target, ())) + self._reserved.get(target, 0)
+
+    async def _reserve(self, target):
+        """Wait for room in ``target``'s lane and hold it until the put is dispatched"""
+        if self.lane_size:
+            room = self._room.setdefault(target, asyncio.Condition())
+            async with room:
+                await room.wait_for(lambda: self._load(target) < self.lane_size)
+        self._reserved[target] = self._reserved.get(target, 0) + 1
+
+    async def _unreserve(self, target):
+        self._reserved[target] -= 1
+        if not self._reserved[target]:
+            del self._reserved[target]
+        await self._make_room(target)
+
+    async def _make_room(self, target):
+        room = self._room.get(target)
+        if room is not None:
+            async with room:
+                room.notify_all()
+
+    def _dispatch(self, item):
+        self._idle.clear()
+        self._lanes.setdefault(item.target, collections.deque()).append(item)
+        if item.target not in self._lane_tasks:
+            self._lane_tasks[item.target] = asyncio.ensure_future(self._run_lane(item.target))
+        metrics.OUTBOX_DEPTH.set(self.depth, queue=self.name)
+
+    async def _run_lane(self, target):
+        lane = self._lanes[target]
+        try:
+            while lane:
+                await self._deliver(lane[0])
+                lane.popleft()
+                metrics.OUTBOX_DEPTH.set(self.depth, queue=self.name)
+                await self._make_room(target)
+        finally:
+            self._lane_tasks.pop(target, None)
+            self._lanes.pop(target, None)
+            if not self._lane_tasks:
+                self._idle.set()
+
+    async def _deliver(self, item):
+        """Send ``item`` until it succeeds or is dead; logs the outcome"""
+        operation = OPERATIONS[item.op]
+        while True:
+            if item.args.get("expires") and time.time() > item.args["expires"]:
+                await self._bury(item, TimeoutError("expired before it could be sent"))
+                return
+            started = time.monotonic()
+            try:
+                if self.limiter is not None:
+                    await self.limiter.acquire(item.target)
+                async with self._semaphore:
+                    result = await operation(self, item)
+            except errors.FloodWaitError as e:
+                if self.limiter is not None:
+                    self.limiter.on_flood_wait(item.target, e.seconds)
+                else:
+                    metrics.flood_wait(item.target, e.seconds)
+                    await asyncio.sleep(e.seconds)
+                continue
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                item.attempts += 1
+                if isinstance(e, PERMANENT_ERRORS) or item.attempts >= self.max_attempts:
+                    await self._bury(item, e)
+                    return
+                delay = backoff(item.attempts)
+                logger.warning(f"{item.op} to {item.target} failed ({e!r}),"
+                               f" retry {item.attempts} in {delay:.1f}s")
+                await self._write({"retry": item.id, "attempts": item.attempts})
+                await asyncio.sleep(delay)
+                continue
+
+            if self.limiter is not None:
+                self.limiter.on_success(item.target)
+            metrics.SEND_LATENCY.observe(time.monotonic() - started, destination=item.target)
+            # Out of the pending set first, so no compaction keeps it
+            del self._items[item.id]
+            await self._write({"ack": item.id})
+            if not item.future.done():
+                item.future.set_result(result)
+            return
+
+    async def _bury(self, item, error):
+        logger.error(f"{item.op} to {item.target} failed for good after"
+                     f" {item.attempts} attempts: {error!r}")
+        entry = item.to_record()
+        entry.update(error=repr(error), failed_at=time.time())
+        with open(self.dead_path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(entry) + "\n")
+        del self._items[item.id]
+        await self._write({"dead": item.id})
+        if not item.future.done():
+            item.future.set_exception(error)
+            # Nobody may be waiting for it
+            item.future.exception()
+
+    async def join(self):
+        """Wait until every queued operation was sent or is dead"""
+        if self._idle is not None:
+            await self._idle.wait()
+
+
+# Outbox of the running script unless another one is passed in
+DEFAULT_OUTBOX = Outbox()
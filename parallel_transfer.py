@@ -0,0 +1,304 @@
+"""
+Parallel chunked downloads and uploads for large media.
+
+Telethon moves a file over one connection, one part after another, which
+is far below the link speed for videos and large documents. ParallelTransfer
+opens ``connections`` extra MTProto senders to the data center that holds
+the file (the session's own DC for uploads), exporting the authorization
+once when that is another DC, and moves ``part_size`` parts over all of
+them at once. Senders are kept open and reused across transfers.
+
+Transfers to or from a path can be resumed: a download writes into
+``<path>.partial`` and records its finished parts in ``<path>.partial.json``,
+an upload records its file id and finished parts under .transfers/. An
+interrupted transfer started again only moves the missing parts; uploaded
+parts are only kept by Telegram for a while, so older upload state is
+discarded after UPLOAD_STATE_TTL seconds.
+
+Callers use it only for files of at least ``threshold`` bytes:
+    transfer = ParallelTransfer()
+    if transfer.wants(size):
+        handle = await transfer.upload(client, path)
+"""
+
+import asyncio
+import copy
+import hashlib
+import json
+import logging
+import math
+import os
+import random
+import time
+
+from telethon import errors, utils
+from telethon.network import MTProtoSender
+from telethon.tl import functions, types
+from telethon.tl.alltlobjects import LAYER
+
+import metrics
+
+logger = logging.getLogger('parallel_transfer')
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+STATE_DIR = os.path.join(BASE_DIR, ".transfers")
+
+DEFAULT_CONNECTIONS = 4
+# Bytes per part; a power of two from 4 KiB to 512 KiB fits both directions
+DEFAULT_PART_SIZE = 512 * 1024
+# Smaller files are moved by Telethon itself
+SIZE_THRESHOLD = 10 * 1024 * 1024
+# Uploads above this size must use the "big file" part requests
+BIG_FILE_SIZE = 10 * 1024 * 1024
+# Seconds after which the parts of an interrupted upload are assumed gone
+UPLOAD_STATE_TTL = 3600
+
+
+def _read_state(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_state(path, state):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f)
+    os.replace(tmp_path, path)
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def media_size(message_or_media):
+    """Size in bytes of a message's photo or document, or None"""
+    file = getattr(message_or_media, 'file', None)
+    if file is not None and file.size is not None:
+        return file.size
+    media = getattr(message_or_media, 'media', message_or_media)
+    document = getattr(media, 'document', None)
+    return getattr(document, 'size', None)
+
+
+class ParallelTransfer:
+    """Moves file parts over several connections per data center"""
+
+    def __init__(self, connections=DEFAULT_CONNECTIONS, part_size=DEFAULT_PART_SIZE,
+                 threshold=SIZE_THRESHOLD, state_dir=STATE_DIR):
+        if part_size % 4096 or (512 * 1024) % part_size:
+            raise ValueError(f"part_size must be a power of two from 4 KiB to 512 KiB, not {part_size}")
+        self.connections = max(1, connections)
+        self.part_size = part_size
+        self.threshold = threshold
+        self.state_dir = state_dir
+        self._senders = {}
+        self._locks = {}
+
+    def wants(self, size):
+        """True if a file of ``size`` bytes should go through this transfer"""
+        return size is not None and size >= self.threshold
+
+    async def _connect(self, client, dc, auth_key, query):
+        sender = MTProtoSender(auth_key, loggers=client._log)
+        await sender.connect(client._connection(
+            dc.ip_address, dc.port, dc.id,
+            loggers=client._log, proxy=client._proxy, local_addr=client._local_addr
+        ))
+        init = copy.copy(client._init_request)
+        init.query = query
+        await sender.send(functions.InvokeWithLayerRequest(LAYER, init))
+        return sender
+
+    async def _senders_for(self, client, dc_id):
+        key = (client, dc_id)
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            senders = self._senders.get(key)
+            if senders:
+                return senders
+            dc = await client._get_dc(dc_id)
+            if dc_id == client.session.dc_id:
+                auth_key = client.session.auth_key
+                first = await self._connect(client, dc, auth_key, functions.help.GetConfigRequest())
+            else:
+                auth = await client(functions.auth.ExportAuthorizationRequest(dc_id))
+                first = await self._connect(client, dc, None, functions.auth.ImportAuthorizationRequest(
+                    id=auth.id, bytes=auth.bytes))
+                auth_key = first.auth_key
+            rest = await asyncio.gather(*(
+                self._connect(client, dc, auth_key, functions.help.GetConfigRequest())
+                for _ in range(self.connections - 1)
+            ))
+            senders = self._senders[key] = [first, *rest]
+            logger.info(f"Opened {len(senders)} transfer connections to DC {dc_id}")
+            return senders
+
+    async def close(self):
+        """Disconnect every transfer connection"""
+        senders = [sender for group in self._senders.values() for sender in group]
+        self._senders.clear()
+        await asyncio.gather(*(sender.disconnect() for sender in senders), return_exceptions=True)
+
+    async def _run_parts(self, senders, parts, move, op, label):
+        """Run ``move(sender, index)`` for every part, spread over ``senders``"""
+        pending = iter(parts)
+
+        async def worker(sender):
+            for index in pending:
+                while True:
+                    try:
+                        with metrics.rpc(op):
+                            await move(sender, index)
+                        break
+                    except errors.FloodWaitError as e:
+                        metrics.flood_wait(label, e.seconds)
+                        await asyncio.sleep(e.seconds)
+
+        tasks = [asyncio.ensure_future(worker(sender)) for sender in senders]
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            # Stop the other connections before the file is closed
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+
+    async def download(self, client, message, file, size=None):
+        """
+        Download the photo or document of ``message`` into ``file``.
+
+        ``file`` is a path (resumable) or a writable, seekable file object.
+
+        Returns:
+            Number of bytes downloaded
+        """
+        media = getattr(message, 'media', message)
+        size = size if size is not None else media_size(message)
+        if size is None:
+            raise ValueError("Size of the media to download is unknown")
+        dc_id, location = utils.get_input_location(media)
+        total = math.ceil(size / self.part_size)
+        senders = await self._senders_for(client, dc_id)
+        started = time.monotonic()
+
+        if not isinstance(file, str):
+            done = set()
+            out = file
+        else:
+            partial, state_path = file + ".partial", file + ".partial.json"
+            state = _read_state(state_path)
+            if not state or state.get("size") != size or state.get("part_size") != self.part_size \
+                    or not os.path.exists(partial):
+                state = {"size": size, "part_size": self.part_size, "done": []}
+                with open(partial, 'wb') as f:
+                    f.truncate(size)
+                _write_state(state_path, state)
+            done = set(state["done"])
+            if done:
+                logger.info(f"Resuming download of {file}: {len(done)}/{total} parts done")
+            out = open(partial, 'r+b')
+
+        async def move(sender, index):
+            result = await sender.send(functions.upload.GetFileRequest(
+                location, offset=index * self.part_size, limit=self.part_size))
+            out.seek(index * self.part_size)
+            out.write(result.bytes)
+            if isinstance(file, str):
+                done.add(index)
+                state["done"] = sorted(done)
+                _write_state(state_path, state)
+
+        try:
+            await self._run_parts(senders, [i for i in range(total) if i not in done],
+                                  move, "get_file", f"dc{dc_id}")
+        finally:
+            if isinstance(file, str):
+                out.close()
+        if isinstance(file, str):
+            os.replace(partial, file)
+            _remove(state_path)
+        else:
+            file.seek(size)
+        logger.info(f"Downloaded {size} bytes over {len(senders)} connections"
+                    f" in {time.monotonic() - started:.2f}s")
+        return size
+
+    def _upload_state_path(self, path, size):
+        stat = os.stat(path)
+        key = hashlib.sha256(f"{os.path.abspath(path)}\0{size}\0{stat.st_mtime_ns}".encode()).hexdigest()
+        return os.path.join(self.state_dir, f"upload_{key[:32]}.json")
+
+    async def upload(self, client, file, size=None, name=None):
+        """
+        Upload ``file`` to the session's data center.
+
+        ``file`` is a path (resumable) or a readable, seekable file object.
+
+        Returns:
+            InputFile or InputFileBig to send with send_file or UploadMedia
+        """
+        if isinstance(file, str):
+            size = os.path.getsize(file)
+            name = name or os.path.basename(file)
+        elif size is None:
+            file.seek(0, os.SEEK_END)
+            size = file.tell()
+        name = name or "file"
+        total = max(1, math.ceil(size / self.part_size))
+        big = size > BIG_FILE_SIZE
+        senders = await self._senders_for(client, client.session.dc_id)
+        started = time.monotonic()
+
+        state, state_path = None, None
+        if isinstance(file, str):
+            state_path = self._upload_state_path(file, size)
+            state = _read_state(state_path)
+            if not state or state.get("part_size") != self.part_size \
+                    or time.time() - state.get("started", 0) > UPLOAD_STATE_TTL:
+                state = {"file_id": random.getrandbits(63), "part_size": self.part_size,
+                         "started": time.time(), "done": []}
+            elif state["done"]:
+                logger.info(f"Resuming upload of {file}: {len(state['done'])}/{total} parts done")
+            source = open(file, 'rb')
+        else:
+            state = {"file_id": random.getrandbits(63), "done": []}
+            source = file
+        file_id = state["file_id"]
+        done = set(state["done"])
+        if state_path is not None:
+            os.makedirs(self.state_dir, exist_ok=True)
+
+        async def move(sender, index):
+            source.seek(index * self.part_size)
+            data = source.read(self.part_size)
+            if big:
+                request = functions.upload.SaveBigFilePartRequest(file_id, index, total, data)
+            else:
+                request = functions.upload.SaveFilePartRequest(file_id, index, data)
+            if not await sender.send(request):
+                raise RuntimeError(f"Telegram did not accept part {index} of {name}")
+            if state_path is not None:
+                done.add(index)
+                state["done"] = sorted(done)
+                _write_state(state_path, state)
+
+        try:
+            await self._run_parts(senders, [i for i in range(total) if i not in done],
+                                  move, "save_file_part", f"dc{client.session.dc_id}")
+        finally:
+            if isinstance(file, str):
+                source.close()
+        if state_path is not None:
+            _remove(state_path)
+        logger.info(f"Uploaded {size} bytes over {len(senders)} connections"
+                    f" in {time.monotonic() - started:.2f}s")
+        if big:
+            return types.InputFileBig(file_id, total, name)
+        return types.InputFile(file_id, total, name, '')
@@ -0,0 +1,163 @@
+"""
+Persistent cache of resolved destination peers.
+
+Scripts address destinations by raw strings such as "Trade_Proooo" or
+"t.me/+M4WgsaOvIYExMWE1". Resolving those costs RPCs (invite links need
+an extra CheckChatInvite call) and counts against resolve limits. The cache
+maps each destination string to its input peer and access hash, keeps the
+mapping on disk, and drops an entry when a send reports the peer invalid.
+
+Access hashes are per account, so use one cache file per session.
+Several processes may share a file: each save merges what the others
+saved meanwhile and replaces the file atomically.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import tempfile
+
+from telethon import errors
+from telethon.tl import types
+
+logger = logging.getLogger('peer_cache')
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_PATH = os.path.join(BASE_DIR, "peer_cache.json")
+
+# Errors meaning the cached peer can no longer be used as-is
+INVALID_PEER_ERRORS = (
+    errors.PeerIdInvalidError,
+    errors.ChannelInvalidError,
+    errors.ChannelPrivateError,
+    errors.ChatIdInvalidError,
+    errors.UserIdInvalidError,
+)
+
+
+def peer_to_dict(peer):
+    if isinstance(peer, types.InputPeerChannel):
+        return {"type": "channel", "id": peer.channel_id, "access_hash": peer.access_hash}
+    if isinstance(peer, types.InputPeerUser):
+        return {"type": "user", "id": peer.user_id, "access_hash": peer.access_hash}
+    if isinstance(peer, types.InputPeerChat):
+        return {"type": "chat", "id": peer.chat_id}
+    if isinstance(peer, types.InputPeerSelf):
+        return {"type": "self"}
+    return None
+
+
+def peer_from_dict(data):
+    kind = data["type"]
+    if kind == "channel":
+        return types.InputPeerChannel(data["id"], data["access_hash"])
+    if kind == "user":
+        return types.InputPeerUser(data["id"], data["access_hash"])
+    if kind == "chat":
+        return types.InputPeerChat(data["id"])
+    if kind == "self":
+        return types.InputPeerSelf()
+    raise ValueError(f"Unknown peer type: {kind}")
+
+
+class PeerCache:
+    """Destination string -> input peer, stored as JSON on disk"""
+
+    def __init__(self, path=DEFAULT_PATH):
+        self.path = path
+        self._peers = None
+        # Entries invalidated here, not to be merged back from disk
+        self._dropped = set()
+
+    def _read(self):
+        """Destination -> input peer as currently saved on disk"""
+        peers = {}
+        if not os.path.exists(self.path):
+            return peers
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for destination, data in json.load(f).items():
+                    peers[destination] = peer_from_dict(data)
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Ignoring unreadable peer cache {self.path}: {e}")
+        return peers
+
+    def _load(self):
+        if self._peers is None:
+            self._peers = self._read()
+
+    def save(self):
+        self._load()
+        # Keep what other processes resolved since we loaded
+        for destination, peer in self._read().items():
+            if destination not in self._dropped:
+                self._peers.setdefault(destination, peer)
+        data = {}
+        for destination, peer in self._peers.items():
+            entry = peer_to_dict(peer)
+            if entry is not None:
+                data[destination] = entry
+        directory = os.path.dirname(os.path.abspath(self.path))
+        with tempfile.NamedTemporaryFile('w', encoding='utf-8', dir=directory, suffix=".tmp",
+                                         prefix=os.path.basename(self.path), delete=False) as f:
+            json.dump(data, f, indent=2)
+        os.replace(f.name, self.path)
+
+    def get(self, destination):
+        self._load()
+        return self._peers.get(destination)
+
+    def __contains__(self, destination):
+        return self.get(destination) is not None
+
+    async def resolve(self, client, destination, save=True):
+        """Cached input peer for ``destination``, resolving it on a miss"""
+        peer = self.get(destination)
+        if peer is None:
+            peer = await client.get_input_entity(destination)
+            self._peers[destination] = peer
+            self._dropped.discard(destination)
+            if save:
+                self.save()
+        return peer
+
+    async def warm(self, client, destinations):
+        """Resolve every destination not cached yet and save once"""
+        self._load()
+        missing = [d for d in dict.fromkeys(destinations) if d not in self._peers]
+        results = await asyncio.gather(
+            *(self.resolve(client, d, save=False) for d in missing),
+            return_exceptions=True
+        )
+        for destination, result in zip(missing, results):
+            if isinstance(result, Exception):
+                logger.warning(f"Could not resolve {destination}: {result}")
+        if missing:
+            self.save()
+
+    def invalidate(self, destination):
+        self._load()
+        if self._peers.pop(destination, None) is not None:
+            self._dropped.add(destination)
+            self.save()
+
+    async def call(self, client, destination, func):
+        """
+        Await ``func(peer)`` with the cached peer for ``destination``.
+
+        If the peer turns out to be invalid, the entry is dropped, the
+        destination is resolved again and ``func`` is retried once.
+        """
+        peer = await self.resolve(client, destination)
+        try:
+            return await func(peer)
+        except INVALID_PEER_ERRORS:
+            logger.info(f"Cached peer for {destination} is invalid, resolving again")
+            self.invalidate(destination)
+            peer = await self.resolve(client, destination)
+            return await func(peer)
+
+
+# Cache used by fanout.broadcast() unless another one is passed in
+DEFAULT_PEER_CACHE = PeerCache()
@@ -0,0 +1,147 @@
+"""
+Pre-rendering of formatted posts into (text, entities) chunks.
+
+Sending with parse_mode makes Telethon re-parse the markup on every send.
+prerender() parses a body once, caches the result by content hash (in
+memory and in .render_cache/), and splits it into chunks that fit
+Telegram's 4096-character limit as measured in UTF-16 code units. Splits
+prefer paragraph breaks, then line breaks, then spaces, and avoid cutting
+through a formatting entity whenever possible. The chunks are then sent
+with formatting_entities, so no parsing happens at send time and a long
+post can never be rejected for its length.
+"""
+
+import hashlib
+import logging
+import os
+import pickle
+import re
+
+from telethon import helpers
+from telethon.extensions import html, markdown
+
+import metrics
+
+logger = logging.getLogger('prerender')
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+CACHE_DIR = os.path.join(BASE_DIR, ".render_cache")
+
+MAX_MESSAGE_LENGTH = 4096
+SPLIT_AT = (re.compile(r'\n\n'), re.compile(r'\n'), re.compile(r'\s'))
+
+PARSERS = {
+    'md': markdown.parse,
+    'markdown': markdown.parse,
+    'html': html.parse,
+    None: lambda body: (body, []),
+}
+
+_memory_cache = {}
+
+
+def _clip(entity, offset, length):
+    kwargs = entity.to_dict()
+    del kwargs['_']
+    kwargs.update(offset=offset, length=length)
+    return entity.__class__(**kwargs)
+
+
+def _find_split(text, entities, limit):
+    """Best split position <= limit in surrogated ``text``"""
+    inside = [(e.offset, e.offset + e.length) for e in entities]
+    fallback = None
+    for pattern in SPLIT_AT:
+        for position in reversed(range(1, limit)):
+            match = pattern.match(text, position)
+            if not match:
+                continue
+            end = match.end()
+            if end > limit:
+                continue
+            if not any(start < end < stop for start, stop in inside):
+                return end
+            if fallback is None:
+                fallback = end
+    if fallback:
+        return fallback
+    # A forced split must not separate the two halves of a surrogate pair
+    return limit - 1 if helpers.within_surrogate(text, limit) else limit
+
+
+def split_entities(text, entities, limit=MAX_MESSAGE_LENGTH):
+    """
+    Split text and entities into chunks of at most ``limit`` UTF-16 units.
+
+    Entities crossing a forced split are clipped into both chunks.
+    """
+    text = helpers.add_surrogate(text)
+    entities = sorted(entities, key=lambda e: e.offset)
+    chunks = []
+    while len(text) > limit:
+        at = _find_split(text, entities, limit)
+        head, head_entities, rest, rest_entities = text[:at], [], text[at:], []
+        for entity in entities:
+            stop = entity.offset + entity.length
+            if entity.offset < at:
+                head_entities.append(entity if stop <= at else _clip(entity, entity.offset, at - entity.offset))
+            if stop > at:
+                start = max(entity.offset, at)
+                rest_entities.append(_clip(entity, start - at, stop - start))
+        chunks.append((head, head_entities))
+        text, entities = rest, rest_entities
+    chunks.append((text, entities))
+
+    result = []
+    for chunk_text, chunk_entities in chunks:
+        chunk_text = helpers.strip_text(chunk_text, chunk_entities)
+        if chunk_text:
+            result.append((helpers.del_surrogate(chunk_text), chunk_entities))
+    return result
+
+
+def _cache_key(body, parse_mode, limit):
+    return hashlib.sha256(f"{parse_mode}\0{limit}\0{body}".encode('utf-8')).hexdigest()
+
+
+def prerender(body, parse_mode='md', limit=MAX_MESSAGE_LENGTH):
+    """
+    Parse ``body`` once into a list of (text, entities) chunks.
+
+    Results are cached by content hash in memory and on disk.
+    """
+    key = _cache_key(body, parse_mode, limit)
+    chunks = _memory_cache.get(key)
+    if chunks is not None:
+        return chunks
+
+    path = os.path.join(CACHE_DIR, f"{key}.pickle")
+    if os.path.exists(path):
+        try:
+            with open(path, 'rb') as f:
+                chunks = _memory_cache[key] = pickle.load(f)
+            return chunks
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable render cache {path}: {e}")
+
+    text, entities = PARSERS[parse_mode](body)
+    chunks = _memory_cache[key] = split_entities(text, entities, limit)
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(chunks, f)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logger.warning(f"Could not write render cache {path}: {e}")
+    return chunks
+
+
+async def send_prerendered(client, entity, chunks, **kwargs):
+    """Send pre-rendered chunks in order; returns the sent messages"""
+    messages = []
+    for text, entities in chunks:
+        with metrics.rpc("send_message"):
+            messages.append(await client.send_message(
+                entity, text, formatting_entities=entities, parse_mode=None, **kwargs))
+    return messages
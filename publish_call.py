@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Publish Trade Calls
+
+Renders one or more calls against every channel template of a call kind
+(see call_templates.py) and broadcasts them, without editing any script.
+
+Usage:
+    Argument: python publish_call.py index "Buy SENSEX 08 APR 2025 PE 76100 Above 590"
+    File:     python publish_call.py stock -f calls.txt
+    Stdin:    echo "Buy BSE ..." | python publish_call.py stock
+    Sharded:  python publish_call.py index --sharded "..."  (spread over settings.ACCOUNTS)
+
+Several calls in a file or on stdin are separated by a line containing only ---.
+Each call text goes to a channel at most once a day (see send_ledger.py), so
+re-running after a crash sends only what is missing.
+
+When the session broker is running, the calls are handed to it and this
+script never imports Telethon, so a call goes out as fast as the
+interpreter starts. Startup phases (interpreter, import, connect, first
+send) are printed after every run.
+"""
+
+from startup_timer import StartupTimer
+
+timer = StartupTimer()
+
+import argparse
+import sys
+import time
+
+from call_client import broker_available, print_results, submit_call
+from call_templates import CHANNEL_TEMPLATES, get_template_set
+
+SEPARATOR = "---"
+
+
+def split_calls(text):
+    """Split text on separator lines into non-empty calls"""
+    calls, current = [], []
+    for line in text.splitlines():
+        if line.strip() == SEPARATOR:
+            calls.append("\n".join(current))
+            current = []
+        else:
+            current.append(line)
+    calls.append("\n".join(current))
+    return [call.strip() for call in calls if call.strip()]
+
+
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(description="Broadcast trade calls to all channels")
+    parser.add_argument("kind", choices=sorted(CHANNEL_TEMPLATES), help="Call kind / template set")
+    parser.add_argument("call", nargs="?", help="Call text (read from --file or stdin if omitted)")
+    parser.add_argument("-f", "--file", help="File with one or more calls separated by ---")
+    parser.add_argument("-c", "--concurrency", type=int,
+                        help="Maximum sends in flight at once (default 5)")
+    parser.add_argument("--dry-run", action="store_true", help="Print rendered messages without sending")
+    parser.add_argument("--sharded", action="store_true",
+                        help="Spread channels over all accounts in settings.ACCOUNTS")
+    # Options may follow the call kind, e.g. "index --sharded <call>"
+    return parser.parse_intermixed_args(argv)
+
+
+def read_calls(args):
+    if args.call:
+        return [args.call]
+    if args.file:
+        with open(args.file, 'r', encoding='utf-8') as f:
+            return split_calls(f.read())
+    return split_calls(sys.stdin.read())
+
+
+def publish_via_broker(kind, calls, concurrency=None):
+    """Hand the calls to the running broker; returns the number of failed sends"""
+    timer.mark("import")
+    submitted = time.monotonic()
+    response = submit_call(kind, calls, concurrency)
+    if response["first_send"] is not None:
+        # The broker reports its own offset; the socket round trip is negligible
+        timer.mark("first send", submitted + response["first_send"])
+    failed = 0
+    for results in response["results"]:
+        print_results(results)
+        failed += sum(not result["ok"] for result in results)
+    timer.mark("done")
+    return failed
+
+
+def publish_directly(kind, calls, concurrency=None, sharded=False):
+    """Connect and broadcast from this process; returns the number of failed sends"""
+    # Imported only here, so the broker path never pays for Telethon
+    import asyncio
+
+    import metrics
+    import settings
+    from broker_client import connect_client
+    from call_templates import CALL_TTL, call_job
+    from fanout import DEFAULT_CONCURRENCY, broadcast, print_report
+    from outbox import Outbox
+    from send_ledger import DEFAULT_LEDGER
+    from sharding import AccountPool
+    timer.mark("import")
+
+    concurrency = concurrency or DEFAULT_CONCURRENCY
+    batch = get_template_set(kind).render_batch(calls)
+    metrics.install()
+
+    async def publish(client):
+        timer.mark("connect")
+        if isinstance(client, AccountPool):
+            all_results = []
+            for messages in batch:
+                results = await client.broadcast(messages, concurrency=concurrency, link_preview=False)
+                print_report(results)
+                all_results.append(results)
+            return all_results
+
+        # Failed sends are retried; a call still unsent after CALL_TTL is dropped as stale.
+        # Sends a crashed run logged are resumed, and the ledger keeps them from going out twice.
+        outbox = Outbox(concurrency=concurrency, ledger=DEFAULT_LEDGER)
+        await outbox.start(client)
+        all_results = []
+        try:
+            for call, messages in zip(calls, batch):
+                results = await broadcast(client, messages, ledger=DEFAULT_LEDGER, job=call_job(kind, call),
+                                          outbox=outbox, expires=time.time() + CALL_TTL, link_preview=False)
+                print_report(results)
+                all_results.append(results)
+            await outbox.join()
+        finally:
+            await outbox.stop()
+        return all_results
+
+    async def publish_sharded():
+        async with AccountPool.from_settings() as pool:
+            return await publish(pool)
+
+    if sharded:
+        all_results = asyncio.run(publish_sharded())
+    else:
+        client = connect_client(settings.SESSION_NAME, settings.API_ID, settings.API_HASH)
+        with client:
+            all_results = client.loop.run_until_complete(publish(client))
+
+    finished = [r.finished for results in all_results for r in results if r.ok and not r.skipped]
+    if finished:
+        timer.mark("first send", min(finished))
+    timer.mark("done")
+    return sum(not result.ok for results in all_results for result in results)
+
+
+def publish_calls(kind, calls, concurrency=None, sharded=False):
+    """Broadcast calls through the broker if it is running, else directly; returns an exit code"""
+    if not sharded and broker_available():
+        failed = publish_via_broker(kind, calls, concurrency)
+    else:
+        failed = publish_directly(kind, calls, concurrency, sharded)
+    timer.report()
+    return 1 if failed else 0
+
+
+def main(argv=None):
+    args = parse_arguments(argv)
+    calls = read_calls(args)
+    if not calls:
+        print("Error: no call given")
+        return 1
+
+    if args.dry_run:
+        for messages in get_template_set(args.kind).render_batch(calls):
+            for destination, text in messages.items():
+                print(f"=== {destination}\n{text}\n")
+        return 0
+
+    return publish_calls(args.kind, calls, args.concurrency, args.sharded)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
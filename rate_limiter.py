@@ -0,0 +1,134 @@
+"""
+Adaptive token-bucket rate limiting for outbound Telegram requests.
+
+Every request takes one token from three buckets: the global bucket, the
+bucket of the account sending it and the bucket of its destination. Rates
+adapt AIMD-style: each success raises a bucket's rate a little (up to its
+ceiling), each FloodWaitError halves it and blocks the bucket for the
+duration Telegram asked for. This replaces fixed sleeps between sends, so
+a batch runs as fast as Telegram allows and no faster.
+"""
+
+import asyncio
+import time
+
+from telethon import errors
+
+import metrics
+
+GLOBAL_RATE = 30.0
+ACCOUNT_RATE = 20.0
+DESTINATION_RATE = 1.0
+DESTINATION_BURST = 3
+
+# Additive increase per success, as a fraction of the ceiling
+INCREASE_STEP = 0.05
+# Multiplicative decrease on FloodWaitError
+DECREASE_FACTOR = 0.5
+MAX_FLOOD_RETRIES = 3
+
+
+class TokenBucket:
+    """Token bucket whose refill rate adapts between ``min_rate`` and ``max_rate``"""
+
+    def __init__(self, rate, capacity=None, min_rate=None):
+        self.max_rate = rate
+        self.min_rate = min_rate or rate / 20
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self.tokens = self.capacity
+        self.blocked_until = 0.0
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.blocked_until:
+                    await asyncio.sleep(self.blocked_until - now)
+                    continue
+                self._refill(now)
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def penalize(self, seconds):
+        """Block the bucket for ``seconds`` and halve its rate"""
+        now = time.monotonic()
+        self._refill(now)
+        self.blocked_until = max(self.blocked_until, now + seconds)
+        self.rate = max(self.min_rate, self.rate * DECREASE_FACTOR)
+        self.tokens = 0
+
+    def reward(self):
+        self.rate = min(self.max_rate, self.rate + self.max_rate * INCREASE_STEP)
+
+
+class RateLimiter:
+    """Global, per-account and per-destination token buckets"""
+
+    def __init__(self, global_rate=GLOBAL_RATE, account_rate=ACCOUNT_RATE,
+                 destination_rate=DESTINATION_RATE, destination_burst=DESTINATION_BURST):
+        self.global_bucket = TokenBucket(global_rate)
+        self.account_rate = account_rate
+        self.destination_rate = destination_rate
+        self.destination_burst = destination_burst
+        self._accounts = {}
+        self._destinations = {}
+
+    def account_bucket(self, account):
+        if account not in self._accounts:
+            self._accounts[account] = TokenBucket(self.account_rate)
+        return self._accounts[account]
+
+    def destination_bucket(self, destination):
+        if destination not in self._destinations:
+            self._destinations[destination] = TokenBucket(
+                self.destination_rate, capacity=self.destination_burst)
+        return self._destinations[destination]
+
+    async def acquire(self, destination, account=None):
+        """Wait until a request to ``destination`` may be sent"""
+        # Narrowest bucket first, so no wider token is wasted while waiting
+        await self.destination_bucket(destination).acquire()
+        await self.account_bucket(account).acquire()
+        await self.global_bucket.acquire()
+
+    def on_success(self, destination, account=None):
+        self.destination_bucket(destination).reward()
+        self.account_bucket(account).reward()
+        self.global_bucket.reward()
+
+    def on_flood_wait(self, destination, seconds, account=None):
+        """Learn from a FloodWaitError raised for ``destination``"""
+        metrics.flood_wait(destination, seconds)
+        self.destination_bucket(destination).penalize(seconds)
+        # The account keeps sending elsewhere, but more slowly
+        bucket = self.account_bucket(account)
+        bucket.rate = max(bucket.min_rate, bucket.rate * DECREASE_FACTOR)
+
+    async def call(self, destination, func, account=None, max_flood_retries=MAX_FLOOD_RETRIES):
+        """Await ``func()`` under the limiter, retrying after FloodWaitError"""
+        attempts = 0
+        while True:
+            await self.acquire(destination, account)
+            try:
+                result = await func()
+            except errors.FloodWaitError as e:
+                self.on_flood_wait(destination, e.seconds, account)
+                attempts += 1
+                if attempts > max_flood_retries:
+                    raise
+                continue
+            self.on_success(destination, account)
+            return result
+
+
+# Limiter shared by everything in one process unless another one is passed in
+DEFAULT_RATE_LIMITER = RateLimiter()
@@ -0,0 +1,225 @@
+"""
+Daily job scheduler sharing one connected TelegramClient.
+
+Jobs are kept in a heap ordered by their next fire time. When a job fires
+it runs as its own task and is pushed back for its next day, skipping any
+day its skip rule rejects.
+
+A job is woken LEAD_TIME seconds before its slot to do all slow work
+early: the connection is verified (and re-established if needed), every
+destination is resolved into the peer cache and the payloads are
+pre-rendered. The remaining wait is a drift-corrected precise timer that
+re-reads the wall clock as it closes in, so the first send starts within
+milliseconds of the slot.
+"""
+
+import asyncio
+import heapq
+import itertools
+import logging
+import random
+import time
+from datetime import datetime, timedelta
+
+from telethon import TelegramClient, functions
+
+import metrics
+from fanout import prerender_messages
+from peer_cache import DEFAULT_PEER_CACHE
+
+logger = logging.getLogger('scheduler')
+
+# Longest single sleep, so wall clock changes are noticed
+MAX_SLEEP = 60
+# Seconds before a slot at which a job is prepared
+LEAD_TIME = 30
+# Below this many seconds the precise timer re-checks the clock every step
+PRECISE_WINDOW = 0.05
+
+
+def skip_weekends(day):
+    """Skip rule for jobs that only run Monday to Friday"""
+    return day.weekday() in (5, 6)
+
+
+def next_fire_time(send_time, skip=None, now=None):
+    """
+    Next datetime at ``send_time`` (hour, minute) strictly after ``now``.
+
+    Days for which ``skip(date)`` is true are passed over.
+    """
+    now = now or datetime.now()
+    hour, minute = send_time
+    fire_time = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    if fire_time <= now:
+        fire_time += timedelta(days=1)
+    while skip and skip(fire_time.date()):
+        fire_time += timedelta(days=1)
+    return fire_time
+
+
+async def sleep_until(fire_time):
+    """Sleep until the wall clock reaches ``fire_time``"""
+    while True:
+        remaining = (fire_time - datetime.now()).total_seconds()
+        if remaining <= 0:
+            return
+        await asyncio.sleep(min(remaining, MAX_SLEEP))
+
+
+async def fire_at(fire_time):
+    """
+    Return as close to ``fire_time`` as the event loop allows.
+
+    Sleeps in shrinking steps, re-reading the wall clock each time, so
+    timer overshoot and clock adjustments do not accumulate.
+    """
+    while True:
+        remaining = (fire_time - datetime.now()).total_seconds()
+        if remaining <= 0:
+            return
+        if remaining > PRECISE_WINDOW:
+            await asyncio.sleep(min(remaining - PRECISE_WINDOW, MAX_SLEEP))
+        elif remaining > 0.002:
+            await asyncio.sleep(remaining / 2)
+        else:
+            # Last couple of milliseconds: yield without a timer
+            await asyncio.sleep(0)
+
+
+async def ensure_connected(client):
+    """Connect ``client`` if needed and prove the connection with a ping"""
+    if not client.is_connected():
+        await client.connect()
+    if isinstance(client, TelegramClient):
+        await client(functions.PingRequest(ping_id=random.getrandbits(63)))
+
+
+class Job:
+    """A coroutine function ``run(client)`` fired daily at ``send_time``"""
+
+    def __init__(self, name, send_time, run, skip=None, destinations=(), messages=None,
+                 parse_mode='md'):
+        self.name = name
+        self.send_time = send_time
+        self.run = run
+        self.skip = skip
+        self.destinations = list(destinations)
+        # Payload to pre-render before the slot (destination -> text, or one text)
+        self.messages = messages
+        self.parse_mode = parse_mode
+
+    def next_fire_time(self, now=None):
+        return next_fire_time(self.send_time, self.skip, now)
+
+    def __repr__(self):
+        hour, minute = self.send_time
+        return f"<Job {self.name} at {hour:02d}:{minute:02d}>"
+
+
+async def prepare_job(client, job, peer_cache=DEFAULT_PEER_CACHE):
+    """Verify the connection, resolve destinations and pre-render the payload"""
+    started = time.monotonic()
+    await ensure_connected(client)
+    if peer_cache is not None and job.destinations:
+        await peer_cache.warm(client, job.destinations)
+    if job.messages is not None:
+        prerender_messages(job.messages, job.destinations, job.parse_mode)
+    logger.info(f"{job.name} prepared in {time.monotonic() - started:.2f}s")
+
+
+async def prepare_and_fire(client, job, fire_time, peer_cache=DEFAULT_PEER_CACHE):
+    """
+    Prepare ``job`` now and run it precisely at ``fire_time``.
+
+    A failed or slow preparation is logged but never delays the slot;
+    whatever was not prepared is done lazily by the send itself.
+    """
+    budget = (fire_time - datetime.now()).total_seconds() - PRECISE_WINDOW
+    if budget > 0:
+        try:
+            await asyncio.wait_for(prepare_job(client, job, peer_cache), timeout=budget)
+        except Exception as e:
+            logger.warning(f"Preparing {job.name} failed: {e!r}")
+    await fire_at(fire_time)
+    lateness = (datetime.now() - fire_time).total_seconds()
+    logger.info(f"Firing {job.name} {lateness * 1000:.1f}ms after {fire_time}")
+    metrics.planned(job.name, fire_time)
+    await job.run(client)
+
+
+async def run_standalone(client, job, ledger=None, lead_time=LEAD_TIME, peer_cache=DEFAULT_PEER_CACHE,
+                         outbox=None):
+    """
+    Run ``job`` once, the way the one-shot timed scripts do.
+
+    If the ledger shows today's broadcast was started but not finished
+    (the previous run crashed), the missing destinations are sent at once;
+    otherwise wait for the next slot, waking ``lead_time`` seconds early
+    to prepare. Sends a crashed run left in ``outbox`` are resumed right
+    away, and the outbox is drained before returning.
+    """
+    if outbox is not None:
+        await outbox.start(client)
+    try:
+        if ledger is not None and ledger.interrupted(job.name, job.destinations):
+            print(f"Resuming interrupted {job.name}")
+            await job.run(client)
+        else:
+            target_time = job.next_fire_time()
+            wait_time = (target_time - datetime.now()).total_seconds()
+            print(f"Waiting for {wait_time} seconds until {target_time}")
+            await sleep_until(target_time - timedelta(seconds=lead_time))
+            await prepare_and_fire(client, job, target_time, peer_cache)
+        if outbox is not None:
+            await outbox.join()
+    finally:
+        if outbox is not None:
+            await outbox.stop()
+
+
+class Scheduler:
+    """Fires jobs on time and reschedules them for the next day"""
+
+    def __init__(self, client, ledger=None, lead_time=LEAD_TIME, peer_cache=DEFAULT_PEER_CACHE):
+        self.client = client
+        self.ledger = ledger
+        self.lead_time = lead_time
+        self.peer_cache = peer_cache
+        self._heap = []
+        self._counter = itertools.count()
+        self._running = set()
+
+    def add(self, job, now=None):
+        if now is None and self.ledger is not None \
+                and self.ledger.interrupted(job.name, job.destinations):
+            # Finish a broadcast a crash cut short, right away
+            fire_time = datetime.now()
+        else:
+            fire_time = job.next_fire_time(now)
+        heapq.heappush(self._heap, (fire_time, next(self._counter), job))
+        logger.info(f"{job.name} scheduled for {fire_time}")
+        return fire_time
+
+    def pending(self):
+        """(fire_time, job) pairs in firing order"""
+        return [(fire_time, job) for fire_time, _, job in sorted(self._heap)]
+
+    async def _run_job(self, job, fire_time):
+        logger.info(f"Preparing {job.name} (planned {fire_time})")
+        try:
+            await prepare_and_fire(self.client, job, fire_time, self.peer_cache)
+        except Exception as e:
+            logger.error(f"{job.name} failed: {e}")
+
+    async def run_forever(self):
+        while self._heap:
+            fire_time, _, job = self._heap[0]
+            await sleep_until(fire_time - timedelta(seconds=self.lead_time))
+            heapq.heappop(self._heap)
+
+            task = asyncio.ensure_future(self._run_job(job, fire_time))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+            self.add(job, now=fire_time)
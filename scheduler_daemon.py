@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Scheduler Daemon
+
+Runs every timed broadcast script from one resident process on a single
+connected TelegramClient, instead of one interpreter and one MTProto
+connection per time slot.
+
+Each script in SCHEDULED_SCRIPTS is imported (not executed) and must define
+SEND_TIME = (hour, minute) and ``async def send_messages(client)``. An
+optional SKIP_DAY(date) rule skips days, e.g. weekends. Destinations are
+taken from ``target_accounts`` or the keys of ``account_messages`` and are
+resolved once at startup through the shared peer cache. A broadcast that
+was cut short by a crash is finished as soon as the daemon restarts, and
+sends still pending in the outbox (.outbox/scheduler_daemon.wal) are
+resumed on connect.
+
+Each job wakes --lead-time seconds before its slot to check the
+connection, re-resolve its destinations and pre-render its payload
+(``account_messages`` in the script's optional PARSE_MODE), then fires on
+a precise timer.
+
+The daemon owns the session itself and refuses to start while broker.py
+is running; use one or the other.
+
+Usage:
+    python scheduler_daemon.py [--lead-time 30]
+"""
+
+import argparse
+import asyncio
+import importlib.util
+import logging
+import os
+
+import metrics
+import settings
+from broker_client import session_client
+from outbox import DEFAULT_OUTBOX
+from peer_cache import DEFAULT_PEER_CACHE
+from scheduler import LEAD_TIME, Job, Scheduler
+from send_ledger import DEFAULT_LEDGER
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S'
+)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+SCHEDULED_SCRIPTS = [
+    "7_30_morning_msg_scheduler.py",
+    "7_45_superprofile.py",
+    "8_00_market_prime.py",
+    "8_45_premium_must_read.py",
+    "12_00_premium_suggest_remaining.py",
+    "3_15_screenshot.py",
+    "4_00_accuracy.py",
+]
+
+
+def load_script(filename):
+    """Import a script whose file name is not a valid module name"""
+    name = os.path.splitext(filename)[0]
+    spec = importlib.util.spec_from_file_location(f"job_{name}", os.path.join(BASE_DIR, filename))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def script_destinations(module):
+    if hasattr(module, "target_accounts"):
+        return list(module.target_accounts)
+    return list(module.account_messages)
+
+
+def load_jobs(filenames=SCHEDULED_SCRIPTS):
+    jobs = []
+    for filename in filenames:
+        module = load_script(filename)
+        jobs.append(Job(
+            os.path.splitext(filename)[0],
+            module.SEND_TIME,
+            module.send_messages,
+            getattr(module, "SKIP_DAY", None),
+            script_destinations(module),
+            messages=module.account_messages,
+            parse_mode=getattr(module, "PARSE_MODE", 'md'),
+        ))
+    return jobs
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Run the timed broadcast scripts from one process")
+    parser.add_argument("--lead-time", type=float, default=LEAD_TIME,
+                        help="Seconds before each slot to connect, resolve and pre-render")
+    return parser.parse_args()
+
+
+async def main():
+    args = parse_arguments()
+    metrics.install()
+    client = session_client(settings.SESSION_NAME, settings.API_ID, settings.API_HASH)
+    scheduler = Scheduler(client, DEFAULT_LEDGER, lead_time=args.lead_time)
+    jobs = load_jobs()
+    for job in jobs:
+        scheduler.add(job)
+
+    async with client:
+        await DEFAULT_PEER_CACHE.warm(client, [d for job in jobs for d in job.destinations])
+        await DEFAULT_OUTBOX.start(client)
+        print("🚀 Scheduler is running...")
+        await scheduler.run_forever()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,207 @@
+"""
+Crash-safe ledger of completed sends.
+
+Each successful send is committed to an SQLite table keyed by
+(job, destination, scheduled date) right after it goes out. Right before
+each send the destination is claimed: the claim fails if it was already
+sent or another running process holds it. A restarted or overlapping run
+therefore sends only to the destinations still missing for that day,
+instead of relying on "sleep 65s to prevent double sending". A claim left
+by a process that died marks the broadcast as interrupted, even if the
+process died before its first send was recorded.
+
+A second table remembers which server-side scheduled messages were pushed
+for which job and slot (see server_schedule.py), so the queue can be
+reconciled on the next run.
+"""
+
+import os
+import sqlite3
+from datetime import date, datetime
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_PATH = os.path.join(BASE_DIR, "send_ledger.db")
+
+
+def job_name(path):
+    """Job name for a script, from its file name"""
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+def _alive(pid):
+    """True if process ``pid`` is still running"""
+    if os.name != 'posix':
+        # No cheap check; treat the claim as abandoned
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class SendLedger:
+    """SQLite table of (job, destination, scheduled_date) already sent"""
+
+    def __init__(self, path=DEFAULT_PATH):
+        self.path = path
+        self._conn = None
+        # Claims of this process whose send is in flight
+        self._in_flight = set()
+
+    @property
+    def conn(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, timeout=30)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS sends ("
+                " job TEXT NOT NULL,"
+                " destination TEXT NOT NULL,"
+                " scheduled_date TEXT NOT NULL,"
+                " sent_at TEXT NOT NULL,"
+                " message_id INTEGER,"
+                " PRIMARY KEY (job, destination, scheduled_date))"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS scheduled ("
+                " destination TEXT NOT NULL,"
+                " message_id INTEGER NOT NULL,"
+                " job TEXT NOT NULL,"
+                " fire_at INTEGER NOT NULL,"
+                " PRIMARY KEY (destination, message_id))"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS claims ("
+                " job TEXT NOT NULL,"
+                " destination TEXT NOT NULL,"
+                " scheduled_date TEXT NOT NULL,"
+                " pid INTEGER NOT NULL,"
+                " claimed_at TEXT NOT NULL,"
+                " PRIMARY KEY (job, destination, scheduled_date))"
+            )
+            self._conn.commit()
+        return self._conn
+
+    def sent(self, job, scheduled_date=None):
+        """Destinations already sent to for ``job`` on ``scheduled_date``"""
+        scheduled_date = (scheduled_date or date.today()).isoformat()
+        rows = self.conn.execute(
+            "SELECT destination FROM sends WHERE job = ? AND scheduled_date = ?",
+            (job, scheduled_date)
+        )
+        return {row[0] for row in rows}
+
+    def is_sent(self, job, destination, scheduled_date=None):
+        scheduled_date = (scheduled_date or date.today()).isoformat()
+        row = self.conn.execute(
+            "SELECT 1 FROM sends WHERE job = ? AND destination = ? AND scheduled_date = ?",
+            (job, destination, scheduled_date)
+        ).fetchone()
+        return row is not None
+
+    def claim(self, job, destination, scheduled_date=None):
+        """
+        Reserve ``destination`` right before sending ``job`` to it.
+
+        Returns False if it was already sent, or if another send holds the
+        claim: in flight in this process, or from another live process.
+        Claims released after a failed send, and claims of processes that
+        died, are taken over.
+        """
+        scheduled_date = (scheduled_date or date.today()).isoformat()
+        key = (job, destination, scheduled_date)
+        if key in self._in_flight:
+            return False
+        conn = self.conn
+        # Serializes claims across processes until the commit
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if conn.execute("SELECT 1 FROM sends WHERE job = ? AND destination = ? AND scheduled_date = ?",
+                            key).fetchone():
+                return False
+            row = conn.execute("SELECT pid FROM claims WHERE job = ? AND destination = ? AND scheduled_date = ?",
+                               key).fetchone()
+            if row and row[0] != os.getpid() and _alive(row[0]):
+                return False
+            conn.execute("INSERT OR REPLACE INTO claims VALUES (?, ?, ?, ?, ?)",
+                         key + (os.getpid(), datetime.now().isoformat()))
+            self._in_flight.add(key)
+            return True
+        finally:
+            conn.commit()
+
+    def release(self, job, destination, scheduled_date=None):
+        """
+        Give a claim up after a failed send, so a retry may claim it again.
+
+        The claim stays on disk: until the send is recorded, the broadcast
+        counts as interrupted.
+        """
+        scheduled_date = (scheduled_date or date.today()).isoformat()
+        self._in_flight.discard((job, destination, scheduled_date))
+
+    def claimed(self, job, scheduled_date=None):
+        """Destinations claimed for ``job`` on ``scheduled_date`` but not recorded as sent"""
+        scheduled_date = (scheduled_date or date.today()).isoformat()
+        rows = self.conn.execute(
+            "SELECT destination FROM claims WHERE job = ? AND scheduled_date = ?",
+            (job, scheduled_date)
+        )
+        return {row[0] for row in rows}
+
+    def record(self, job, destination, scheduled_date=None, message_id=None):
+        scheduled_date = (scheduled_date or date.today()).isoformat()
+        self.conn.execute(
+            "INSERT OR IGNORE INTO sends VALUES (?, ?, ?, ?, ?)",
+            (job, destination, scheduled_date, datetime.now().isoformat(), message_id)
+        )
+        self.conn.execute(
+            "DELETE FROM claims WHERE job = ? AND destination = ? AND scheduled_date = ?",
+            (job, destination, scheduled_date)
+        )
+        self.conn.commit()
+        self._in_flight.discard((job, destination, scheduled_date))
+
+    def missing(self, job, destinations, scheduled_date=None):
+        """Destinations of ``job`` not sent yet on ``scheduled_date``"""
+        done = self.sent(job, scheduled_date)
+        return [destination for destination in destinations if destination not in done]
+
+    def interrupted(self, job, destinations, scheduled_date=None):
+        """True if a broadcast of ``job`` was started but not finished"""
+        started = self.sent(job, scheduled_date) | self.claimed(job, scheduled_date)
+        return bool(started) and bool(self.missing(job, destinations, scheduled_date))
+
+    def scheduled(self, destination):
+        """message_id -> (job, fire_at timestamp) pushed to ``destination``"""
+        rows = self.conn.execute(
+            "SELECT message_id, job, fire_at FROM scheduled WHERE destination = ?",
+            (destination,)
+        )
+        return {row[0]: (row[1], row[2]) for row in rows}
+
+    def record_scheduled(self, job, destination, fire_at, message_ids):
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO scheduled VALUES (?, ?, ?, ?)",
+            [(destination, message_id, job, fire_at) for message_id in message_ids]
+        )
+        self.conn.commit()
+
+    def forget_scheduled(self, destination, message_ids):
+        self.conn.executemany(
+            "DELETE FROM scheduled WHERE destination = ? AND message_id = ?",
+            [(destination, message_id) for message_id in message_ids]
+        )
+        self.conn.commit()
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+# Ledger shared by the broadcast scripts unless another one is passed in
+DEFAULT_LEDGER = SendLedger()
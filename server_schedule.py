@@ -0,0 +1,280 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Server-Side Scheduled Delivery
+
+Pushes the fixed daily posts of the timed scripts (the jobs of
+scheduler_daemon.py) to Telegram ahead of time as scheduled messages,
+using send_message's ``schedule`` parameter. Telegram then delivers each
+post at its slot by itself, so delivery no longer depends on this host
+being up and connected at that minute.
+
+Every run reconciles the scheduled queue of each destination, for the
+slots of the next --days days, against what the scripts would send:
+  - a slot with nothing queued is pushed,
+  - a slot whose queued text has changed is deleted and pushed again,
+  - a slot pushed earlier that is no longer wanted (script removed, moved
+    to another time or now skipped) is deleted.
+The ids of pushed messages are kept in the send ledger. Scheduled messages
+posted by hand are left alone; one that already matches a slot exactly is
+adopted instead of being pushed twice.
+
+Pushes are not logged in an Outbox: a push that fails is simply made by
+the next run, and replaying one blindly could queue a post twice.
+
+Run it once a day (e.g. from cron) instead of the scheduler daemon; with
+the default two-day window one missed run still loses no post. Like the
+daemon it opens the session itself and refuses to run while the broker
+does, so stop the broker first.
+
+Usage:
+    python server_schedule.py [--days 2] [--dry-run]
+"""
+
+import argparse
+import asyncio
+import logging
+from datetime import datetime, time, timedelta, timezone
+
+from telethon import functions
+from telethon.tl import types
+
+import metrics
+import settings
+from broker_client import session_client
+from fanout import DEFAULT_CONCURRENCY, fan_out, prerender_messages
+from peer_cache import DEFAULT_PEER_CACHE
+from prerender import send_prerendered
+from rate_limiter import DEFAULT_RATE_LIMITER
+from scheduler_daemon import load_jobs
+from send_ledger import DEFAULT_LEDGER
+
+logger = logging.getLogger('server_schedule')
+
+# Days of slots kept queued, today included
+DEFAULT_DAYS = 2
+# Slots closer than this are left to the local scheduler
+MIN_LEAD = 60
+
+# Entities Telegram detects by itself, ignored when comparing queued posts
+AUTO_ENTITIES = (
+    types.MessageEntityUrl,
+    types.MessageEntityMention,
+    types.MessageEntityHashtag,
+    types.MessageEntityCashtag,
+    types.MessageEntityBotCommand,
+    types.MessageEntityEmail,
+    types.MessageEntityPhone,
+    types.MessageEntityBankCard,
+)
+
+
+def fire_times(job, days=DEFAULT_DAYS, now=None):
+    """Unix timestamps of ``job``'s slots within the next ``days`` days"""
+    now = now or datetime.now()
+    hour, minute = job.send_time
+    slots = []
+    for offset in range(days):
+        day = now.date() + timedelta(days=offset)
+        if job.skip and job.skip(day):
+            continue
+        fire_time = datetime.combine(day, time(hour, minute))
+        if (fire_time - now).total_seconds() >= MIN_LEAD:
+            slots.append(int(fire_time.timestamp()))
+    return slots
+
+
+def plan(jobs, days=DEFAULT_DAYS, now=None):
+    """destination -> {(job name, fire_at): chunks} of every post due in the window"""
+    wanted = {}
+    for job in jobs:
+        slots = fire_times(job, days, now)
+        if not slots:
+            continue
+        rendered = prerender_messages(job.messages, job.destinations, job.parse_mode)
+        for destination, chunks in rendered.items():
+            for fire_at in slots:
+                wanted.setdefault(destination, {})[(job.name, fire_at)] = chunks
+    return wanted
+
+
+def _signature(text, entities):
+    kept = sorted(
+        (type(e).__name__, e.offset, e.length, getattr(e, 'url', None))
+        for e in entities or () if not isinstance(e, AUTO_ENTITIES)
+    )
+    return text, tuple(kept)
+
+
+def matches(messages, chunks):
+    """True if queued ``messages`` are exactly the pre-rendered ``chunks``"""
+    return ([_signature(m.message, m.entities) for m in messages]
+            == [_signature(text, entities) for text, entities in chunks])
+
+
+class Reconciliation:
+    """What one run changed in a destination's scheduled queue"""
+
+    def __init__(self, destination):
+        self.destination = destination
+        self.kept = 0
+        self.pushed = 0
+        self.replaced = 0
+        self.deleted = 0
+
+    def __repr__(self):
+        return (f"<Reconciliation {self.destination} kept={self.kept} pushed={self.pushed}"
+                f" replaced={self.replaced} deleted={self.deleted}>")
+
+
+async def reconcile(client, peer, destination, wanted, window_end, ledger=DEFAULT_LEDGER,
+                    dry_run=False, limiter=None):
+    """
+    Bring the scheduled queue of ``destination`` in line with ``wanted``.
+
+    Args:
+        client: Connected TelegramClient
+        peer: Input peer of ``destination``
+        destination: Destination string, as used in the ledger
+        wanted: {(job name, fire_at): chunks} due for this destination
+        window_end: Timestamp up to which earlier pushes no longer wanted are deleted
+        ledger: SendLedger remembering which queued messages were pushed here
+        dry_run: Only count what would change
+        limiter: RateLimiter pacing each request to ``destination``, or None
+
+    Returns:
+        Reconciliation
+    """
+    summary = Reconciliation(destination)
+
+    async def request(func):
+        if limiter is None:
+            return await func()
+        return await limiter.call(destination, func)
+
+    async def get_history():
+        with metrics.rpc("get_scheduled_history"):
+            return await client(functions.messages.GetScheduledHistoryRequest(peer=peer, hash=0))
+
+    history = await request(get_history)
+    queued = {m.id: m for m in getattr(history, 'messages', ()) if isinstance(m, types.Message)}
+
+    recorded = ledger.scheduled(destination)
+    gone = [message_id for message_id in recorded if message_id not in queued]
+    if gone and not dry_run:
+        # Delivered, or deleted by hand
+        ledger.forget_scheduled(destination, gone)
+
+    ours = {}
+    for message_id, slot in recorded.items():
+        if message_id in queued:
+            ours.setdefault(slot, []).append(queued[message_id])
+    for slot, chunks in wanted.items():
+        if slot in ours:
+            continue
+        at_slot = sorted((m for m in queued.values()
+                          if m.id not in recorded and int(m.date.timestamp()) == slot[1]),
+                         key=lambda m: m.id)
+        if at_slot and matches(at_slot, chunks):
+            ours[slot] = at_slot
+            if not dry_run:
+                ledger.record_scheduled(slot[0], destination, slot[1], [m.id for m in at_slot])
+
+    stale, push = [], []
+    for slot, messages in ours.items():
+        messages.sort(key=lambda m: m.id)
+        if slot in wanted and matches(messages, wanted[slot]):
+            summary.kept += 1
+        elif slot in wanted:
+            stale.extend(m.id for m in messages)
+            summary.replaced += 1
+        elif slot[1] <= window_end:
+            stale.extend(m.id for m in messages)
+            summary.deleted += 1
+    for slot in sorted(wanted, key=lambda slot: slot[1]):
+        if slot not in ours or not matches(ours[slot], wanted[slot]):
+            push.append(slot)
+    summary.pushed = len(push) - summary.replaced
+
+    if dry_run:
+        return summary
+    if stale:
+        async def delete():
+            with metrics.rpc("delete_scheduled_messages"):
+                await client(functions.messages.DeleteScheduledMessagesRequest(peer=peer, id=stale))
+
+        await request(delete)
+        ledger.forget_scheduled(destination, stale)
+    for job, fire_at in push:
+        schedule = datetime.fromtimestamp(fire_at, timezone.utc)
+        sent = []
+        try:
+            # One limiter token per message; a post may span several chunks
+            for chunk in wanted[(job, fire_at)]:
+                sent.extend(await request(lambda chunk=chunk: send_prerendered(
+                    client, peer, [chunk], schedule=schedule, link_preview=False)))
+        finally:
+            # A partly pushed slot is recorded too, and replaced by the next run
+            if sent:
+                ledger.record_scheduled(job, destination, fire_at, [m.id for m in sent])
+    return summary
+
+
+async def push_scheduled(client, jobs, days=DEFAULT_DAYS, concurrency=DEFAULT_CONCURRENCY,
+                         peer_cache=DEFAULT_PEER_CACHE, limiter=DEFAULT_RATE_LIMITER,
+                         ledger=DEFAULT_LEDGER, dry_run=False, now=None):
+    """
+    Reconcile the scheduled queues of all destinations of ``jobs`` at once.
+
+    Returns:
+        List of SendResult; ``value`` holds each destination's Reconciliation
+    """
+    now = now or datetime.now()
+    window_end = int((datetime.combine(now.date() + timedelta(days=days), time())).timestamp())
+    wanted = plan(jobs, days, now)
+    destinations = list(dict.fromkeys(d for job in jobs for d in job.destinations))
+
+    async def send(destination):
+        async def reconcile_peer(peer):
+            return await reconcile(client, peer, destination, wanted.get(destination, {}),
+                                   window_end, ledger, dry_run, limiter)
+
+        return await peer_cache.call(client, destination, reconcile_peer)
+
+    # reconcile() paces each of its requests itself
+    return await fan_out(destinations, send, concurrency=concurrency)
+
+
+def print_reconciliation(results, dry_run=False):
+    """Print one line per destination"""
+    prefix = "Would change" if dry_run else "Queued"
+    for result in results:
+        summary = result.value
+        if not result.ok:
+            print(f"❌ Failed to reconcile {result.destination}: {result.error}")
+        else:
+            print(f"🗓️ {prefix} {result.destination}: {summary.kept} kept, {summary.pushed} pushed,"
+                  f" {summary.replaced} replaced, {summary.deleted} deleted")
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Queue the timed posts as server-side scheduled messages")
+    parser.add_argument("--days", type=int, default=DEFAULT_DAYS,
+                        help="Days of slots to keep queued, today included (default 2)")
+    parser.add_argument("--dry-run", action="store_true", help="Show what would change without changing it")
+    return parser.parse_args()
+
+
+async def main():
+    args = parse_arguments()
+    metrics.install()
+    client = session_client(settings.SESSION_NAME, settings.API_ID, settings.API_HASH)
+    jobs = load_jobs()
+    async with client:
+        results = await push_scheduled(client, jobs, days=args.days, dry_run=args.dry_run)
+    print_reconciliation(results, args.dry_run)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
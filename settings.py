@@ -0,0 +1,17 @@
+"""
+Shared Telegram credentials for the long-running processes.
+
+The one-shot scripts keep their own api_id/api_hash lines; daemons that
+serve several scripts at once read them from here.
+"""
+
+API_ID = "27647645"
+API_HASH = "2cdcf90271ae9b647a9561f5f2b0aade"
+SESSION_NAME = "session_name"
+
+# Sessions sharing the broadcast load (see sharding.py): (session, api_id, api_hash).
+# Each extra session has to be logged in once interactively before use.
+ACCOUNTS = [
+    (SESSION_NAME, API_ID, API_HASH),
+    ("session_account_2", "28178981", "92dac09b406e93e836e8b9b5e6ce5e80"),
+]
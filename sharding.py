@@ -0,0 +1,174 @@
+"""
+Multi-account sharding of destinations.
+
+Per-account flood limits cap what one account can send. AccountPool
+spreads destinations over several logged-in sessions with rendezvous
+(highest random weight) hashing, so each destination always goes through
+the same account while the pool is healthy, and adding an account only
+moves the destinations that now rank it first.
+
+When an account is flood-waited or spam-limited it is benched for that
+long and its destinations fail over to their next-ranked account. Each
+account keeps its own peer cache, since access hashes are per account.
+
+An AccountPool can be used wherever the broadcast code expects a client:
+    async with AccountPool.from_settings() as pool:
+        results = await pool.broadcast(account_messages, link_preview=False)
+
+Every account must be a member (or admin) of the destinations it may
+serve.
+
+Sends go out directly, not through an Outbox: an outbox lane would wait a
+FloodWait out on the benched account instead of failing the destination
+over, so failures are reported per destination instead.
+"""
+
+import hashlib
+import logging
+import os
+import time
+
+from telethon import TelegramClient, errors
+
+import settings
+from fanout import DEFAULT_CONCURRENCY, broadcast
+from peer_cache import BASE_DIR, PeerCache
+from rate_limiter import DEFAULT_RATE_LIMITER
+
+logger = logging.getLogger('sharding')
+
+# How long an account is benched after Telegram flags it for spam
+PEER_FLOOD_PENALTY = 3600
+
+# Errors meaning this account cannot post there, but another one may
+ACCOUNT_ERRORS = (
+    errors.ChatWriteForbiddenError,
+    errors.ChatAdminRequiredError,
+    errors.UserBannedInChannelError,
+    errors.ChannelPrivateError,
+)
+
+
+class Account:
+    """One logged-in session of the pool"""
+
+    def __init__(self, name, client, peer_cache=None):
+        self.name = name
+        self.client = client
+        self.peer_cache = peer_cache or PeerCache(
+            os.path.join(BASE_DIR, f"peer_cache_{name}.json"))
+        self.blocked_until = 0.0
+
+    @property
+    def available(self):
+        return time.monotonic() >= self.blocked_until
+
+    def block(self, seconds):
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+        logger.warning(f"Account {self.name} benched for {seconds}s")
+
+    def __repr__(self):
+        return f"<Account {self.name}>"
+
+
+def _weight(account_name, destination):
+    digest = hashlib.sha1(f"{account_name}|{destination}".encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'big')
+
+
+class AccountPool:
+    """Routes each destination to an account by stable hash, with failover"""
+
+    def __init__(self, accounts, limiter=DEFAULT_RATE_LIMITER):
+        if not accounts:
+            raise ValueError("AccountPool needs at least one account")
+        self.accounts = list(accounts)
+        self.limiter = limiter
+
+    @classmethod
+    def from_settings(cls, accounts=None):
+        """Pool of TelegramClients for settings.ACCOUNTS (session, api_id, api_hash)"""
+        return cls([Account(session, TelegramClient(session, api_id, api_hash))
+                    for session, api_id, api_hash in accounts or settings.ACCOUNTS])
+
+    async def __aenter__(self):
+        for account in self.accounts:
+            await account.client.start()
+        return self
+
+    async def __aexit__(self, *args):
+        for account in self.accounts:
+            await account.client.disconnect()
+
+    def rank(self, destination):
+        """Accounts in failover order for ``destination``"""
+        return sorted(self.accounts, key=lambda a: _weight(a.name, destination), reverse=True)
+
+    def owner(self, destination):
+        """Account that serves ``destination`` while the pool is healthy"""
+        return self.rank(destination)[0]
+
+    def shards(self, destinations):
+        """Account name -> destinations it owns"""
+        result = {account.name: [] for account in self.accounts}
+        for destination in destinations:
+            result[self.owner(destination).name].append(destination)
+        return result
+
+    async def _route(self, destination, func):
+        """
+        Await ``func(client, peer)`` on the best available account.
+
+        Raises FloodWaitError with the shortest remaining wait only when
+        every account that could serve ``destination`` is benched.
+        """
+        last_error = None
+        for account in self.rank(destination):
+            if not account.available:
+                continue
+            # Per-chat limits apply per sender, so pace each pair separately
+            key = (account.name, destination)
+            if self.limiter is not None:
+                await self.limiter.acquire(key, account.name)
+            try:
+                result = await account.peer_cache.call(
+                    account.client, destination, lambda peer: func(account.client, peer))
+            except errors.FloodWaitError as e:
+                account.block(e.seconds)
+                if self.limiter is not None:
+                    self.limiter.on_flood_wait(key, e.seconds, account.name)
+                last_error = e
+                continue
+            except errors.PeerFloodError as e:
+                account.block(PEER_FLOOD_PENALTY)
+                last_error = e
+                continue
+            except ACCOUNT_ERRORS as e:
+                logger.info(f"{account.name} cannot post to {destination}: {e}")
+                last_error = e
+                continue
+            if self.limiter is not None:
+                self.limiter.on_success(key, account.name)
+            return result
+
+        if last_error is None or isinstance(last_error, (errors.FloodWaitError, errors.PeerFloodError)):
+            wait = min(a.blocked_until for a in self.accounts) - time.monotonic()
+            raise errors.FloodWaitError(None, capture=max(1, int(wait + 0.999)))
+        raise last_error
+
+    async def send_message(self, entity, message="", **kwargs):
+        return await self._route(
+            entity, lambda client, peer: client.send_message(peer, message, **kwargs))
+
+    async def forward_messages(self, entity, messages, **kwargs):
+        return await self._route(
+            entity, lambda client, peer: client.forward_messages(peer, messages, **kwargs))
+
+    async def send_file(self, entity, file, **kwargs):
+        return await self._route(
+            entity, lambda client, peer: client.send_file(peer, file, **kwargs))
+
+    async def broadcast(self, messages, targets=None, concurrency=DEFAULT_CONCURRENCY, **kwargs):
+        """fanout.broadcast() across the pool; peers and pacing are per account"""
+        return await broadcast(self, messages, targets, concurrency=concurrency * len(self.accounts),
+                               peer_cache=None, limiter=None, **kwargs)
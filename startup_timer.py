@@ -0,0 +1,65 @@
+"""
+Startup phase timing for the on-demand scripts.
+
+StartupTimer splits a run into phases (interpreter start, imports, connect,
+first send, ...) and prints how long each took. The first phase is
+measured from the process start time the OS reports, so interpreter
+startup is included, not just the time after the script began.
+
+Standard library only, so it costs nothing on the fast path.
+
+    timer = StartupTimer()
+    ...imports...
+    timer.mark("import")
+    ...
+    timer.report()
+"""
+
+import os
+import sys
+import time
+
+
+def process_age():
+    """Seconds since this process started, or None where /proc is unavailable"""
+    try:
+        with open("/proc/self/stat", 'r') as f:
+            # Fields after the command name, which may contain spaces
+            fields = f.read().rsplit(")", 1)[1].split()
+        with open("/proc/uptime", 'r') as f:
+            uptime = float(f.read().split()[0])
+        return uptime - int(fields[19]) / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+class StartupTimer:
+    """Durations of consecutive startup phases"""
+
+    def __init__(self):
+        now = time.monotonic()
+        age = process_age()
+        self.started = now - age if age is not None else now
+        self.phases = {}
+        self._last = self.started
+        if age is not None:
+            self.mark("interpreter", now)
+
+    def mark(self, phase, at=None):
+        """End ``phase`` at monotonic time ``at`` (now by default)"""
+        at = time.monotonic() if at is None else at
+        self.phases[phase] = at - self._last
+        self._last = at
+
+    @property
+    def total(self):
+        return self._last - self.started
+
+    def report(self):
+        """Print the phases and publish them to metrics if that module is loaded"""
+        parts = " | ".join(f"{phase} {seconds:.3f}s" for phase, seconds in self.phases.items())
+        print(f"⏱️ {parts} | total {self.total:.3f}s")
+        metrics = sys.modules.get("metrics")
+        if metrics is not None:
+            for phase, seconds in self.phases.items():
+                metrics.STARTUP_SECONDS.set(seconds, phase=phase)
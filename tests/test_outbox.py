@@ -0,0 +1,188 @@
+"""Outbox write-ahead log, replay and delivery, against FakeTelegramClient"""
+
+import asyncio
+import json
+import time
+from datetime import date
+
+import pytest
+
+from fake_client import FakeTelegramClient, peer_for
+from outbox import Outbox
+from peer_cache import PeerCache
+from send_ledger import SendLedger
+from tl_json import encode_value
+
+
+class RecordingClient(FakeTelegramClient):
+    """FakeTelegramClient that remembers (peer, text) of every send"""
+
+    def __init__(self, **kwargs):
+        super().__init__(rtt=kwargs.pop("rtt", 0.001), jitter=0, **kwargs)
+        self.sent = []
+
+    async def send_message(self, entity, message="", **kwargs):
+        result = await super().send_message(entity, message, **kwargs)
+        self.sent.append((entity, message))
+        return result
+
+
+def make_outbox(tmp_path, **kwargs):
+    kwargs.setdefault("ledger", None)
+    return Outbox("test", directory=str(tmp_path), limiter=None,
+                  peer_cache=PeerCache(str(tmp_path / "peers.json")), **kwargs)
+
+
+def message_args(text, **extra):
+    return dict({"chunks": encode_value([[text, []]])}, **extra)
+
+
+def write_log(tmp_path, records):
+    with open(tmp_path / "test.wal", 'w', encoding='utf-8') as f:
+        for record in records:
+            f.write(json.dumps(record) + "\n")
+
+
+def put_record(item_id, target, text, **extra):
+    return {"put": item_id, "op": "send_message", "target": target,
+            "args": message_args(text, **extra), "attempts": 0}
+
+
+def replayed(tmp_path):
+    """Ids of the operations a restarted outbox would resume"""
+    async def replay():
+        return list(make_outbox(tmp_path)._replay())
+    return asyncio.run(replay())
+
+
+async def run(outbox, client):
+    await outbox.start(client)
+    await outbox.join()
+    await outbox.stop()
+
+
+def test_put_sends_and_acks(tmp_path):
+    client = RecordingClient()
+
+    async def main():
+        outbox = make_outbox(tmp_path)
+        await outbox.start(client)
+        future = await outbox.put("send_message", "chan", message_args("hello"))
+        sent = await future
+        await outbox.stop()
+        return sent
+
+    sent = asyncio.run(main())
+    assert [message.text for message in sent] == ["hello"]
+    assert client.sent == [(peer_for("chan"), "hello")]
+    # Nothing is left to replay
+    assert replayed(tmp_path) == []
+
+
+def test_replay_resumes_unacked_operations_in_order(tmp_path):
+    write_log(tmp_path, [
+        put_record(1, "chan", "one"),
+        put_record(2, "chan", "two"),
+        put_record(3, "chan", "three"),
+        {"ack": 1},
+    ])
+    client = RecordingClient()
+    asyncio.run(run(make_outbox(tmp_path), client))
+    assert [text for _, text in client.sent] == ["two", "three"]
+    assert replayed(tmp_path) == []
+
+
+def test_replay_ignores_a_torn_last_record(tmp_path):
+    write_log(tmp_path, [put_record(1, "chan", "one")])
+    with open(tmp_path / "test.wal", 'a', encoding='utf-8') as f:
+        f.write('{"put": 2, "op": "send_mes')
+    client = RecordingClient()
+    asyncio.run(run(make_outbox(tmp_path), client))
+    assert [text for _, text in client.sent] == ["one"]
+
+
+def test_replay_skips_sends_already_in_the_ledger(tmp_path):
+    # Crashed after the ledger recorded the send but before the ack was on disk
+    ledger = SendLedger(str(tmp_path / "ledger.db"))
+    today = date.today()
+    ledger.record("job", "chan", today, 1)
+    write_log(tmp_path, [
+        put_record(1, "chan", "daily", job="job", date=today.isoformat()),
+        put_record(2, "other", "daily", job="job", date=today.isoformat()),
+    ])
+    client = RecordingClient()
+    asyncio.run(run(make_outbox(tmp_path, ledger=ledger), client))
+    assert client.sent == [(peer_for("other"), "daily")]
+    assert ledger.is_sent("job", "other", today)
+    assert replayed(tmp_path) == []
+
+
+def test_invalid_request_goes_to_dead_letters(tmp_path):
+    client = RecordingClient(peer_error_rate=1.0)
+
+    async def main():
+        outbox = make_outbox(tmp_path)
+        await outbox.start(client)
+        future = await outbox.put("send_message", "chan", message_args("hello"))
+        with pytest.raises(Exception):
+            await future
+        await outbox.stop()
+
+    asyncio.run(main())
+    with open(tmp_path / "test.dead.jsonl", 'r', encoding='utf-8') as f:
+        dead = [json.loads(line) for line in f]
+    assert [entry["target"] for entry in dead] == ["chan"]
+    assert replayed(tmp_path) == []
+
+
+def test_missing_local_file_is_dead_lettered_without_retries(tmp_path):
+    image = tmp_path / "present.jpg"
+    image.write_bytes(b"jpeg")
+    client = RecordingClient()
+
+    async def main():
+        outbox = make_outbox(tmp_path)
+        await outbox.start(client)
+        futures = [
+            await outbox.put("send_file", "chan", {"path": str(tmp_path / "missing.jpg")}),
+            await outbox.put("send_album", "chan", {"paths": [str(image), str(tmp_path / "missing.jpg")]}),
+        ]
+        # Retried with backoff, this would take seconds
+        outcomes = await asyncio.wait_for(asyncio.gather(*futures, return_exceptions=True), 1)
+        await outbox.stop()
+        return outcomes
+
+    outcomes = asyncio.run(main())
+    assert all(isinstance(outcome, FileNotFoundError) for outcome in outcomes)
+    assert client.stats["uploaded_bytes"] == 0
+    with open(tmp_path / "test.dead.jsonl", 'r', encoding='utf-8') as f:
+        assert [json.loads(line)["attempts"] for line in f] == [1, 1]
+
+
+def test_expired_operation_is_dead_lettered_unsent(tmp_path):
+    write_log(tmp_path, [put_record(1, "chan", "stale", expires=time.time() - 1)])
+    client = RecordingClient()
+    asyncio.run(run(make_outbox(tmp_path), client))
+    assert client.sent == []
+    assert (tmp_path / "test.dead.jsonl").exists()
+
+
+def test_put_waits_while_the_lane_is_full(tmp_path):
+    client = RecordingClient(rtt=0.1)
+
+    async def main():
+        outbox = make_outbox(tmp_path, lane_size=1)
+        await outbox.start(client)
+        await outbox.put("send_message", "chan", message_args("one"))
+        second = asyncio.ensure_future(outbox.put("send_message", "chan", message_args("two")))
+        await asyncio.sleep(0.02)
+        waited = not second.done()
+        # Other targets have lanes of their own
+        await asyncio.wait_for(outbox.put("send_message", "other", message_args("three")), 0.05)
+        await (await second)
+        await outbox.join()
+        await outbox.stop()
+        return waited
+
+    assert asyncio.run(main())
+    assert [text for target, text in client.sent if target == peer_for("chan")] == ["one", "two"]
@@ -0,0 +1,34 @@
+"""Splitting pre-rendered posts into chunks that fit Telegram's limit"""
+
+from telethon import helpers
+from telethon.tl import types
+
+from prerender import split_entities
+
+
+def utf16_length(text):
+    return len(helpers.add_surrogate(text))
+
+
+def test_short_text_is_one_chunk():
+    entity = types.MessageEntityBold(0, 5)
+    assert split_entities("Hello world", [entity], 20) == [("Hello world", [entity])]
+
+
+def test_split_prefers_paragraph_breaks():
+    text = "first paragraph\n\nsecond one here"
+    assert [chunk for chunk, _ in split_entities(text, [], 25)] == ["first paragraph", "second one here"]
+
+
+def test_forced_split_never_cuts_a_surrogate_pair():
+    text = "a" + "😀" * 3000
+    chunks = split_entities(text, [], 4096)
+    assert all(utf16_length(chunk) <= 4096 for chunk, _ in chunks)
+    assert "".join(chunk for chunk, _ in chunks) == text
+
+
+def test_forced_split_clips_entities_into_both_chunks():
+    text = "x" * 30
+    chunks = split_entities(text, [types.MessageEntityBold(5, 20)], 10)
+    assert [chunk for chunk, _ in chunks] == ["x" * 10] * 3
+    assert [[(e.offset, e.length) for e in entities] for _, entities in chunks] == [[(5, 5)], [(0, 10)], [(0, 5)]]
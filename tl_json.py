@@ -0,0 +1,39 @@
+"""
+JSON-safe encoding of TL objects, datetimes and containers of them.
+
+TL objects such as input peers and formatting entities are stored as
+their serialized TL bytes (base64), datetimes as ISO strings. Used by the
+session broker's socket protocol and by the outbox's write-ahead log.
+"""
+
+import base64
+from datetime import datetime
+
+from telethon.extensions import BinaryReader
+from telethon.tl.tlobject import TLObject
+
+
+def encode_value(value):
+    """JSON-safe form of strings, ints, lists, datetimes and TL objects"""
+    if isinstance(value, TLObject):
+        return {"tl": base64.b64encode(bytes(value)).decode('ascii')}
+    if isinstance(value, datetime):
+        return {"datetime": value.isoformat()}
+    if isinstance(value, (list, tuple)):
+        return [encode_value(item) for item in value]
+    if isinstance(value, dict):
+        return {key: encode_value(item) for key, item in value.items()}
+    return value
+
+
+def decode_value(value):
+    if isinstance(value, dict):
+        if "tl" in value:
+            with BinaryReader(base64.b64decode(value["tl"])) as reader:
+                return reader.tgread_object()
+        if "datetime" in value:
+            return datetime.fromisoformat(value["datetime"])
+        return {key: decode_value(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [decode_value(item) for item in value]
+    return value